@@ -0,0 +1,535 @@
+"""
+asyncio support.
+
+Connection aliases for asynchronous database drivers are initialized
+with this module's initAlias(), which takes the same arguments as
+pydo.initAlias(), except that the driver is one of:
+
+   * aiosqlite -- sqlite, with the aiosqlite package
+   * psycopg -- PostgreSQL, with psycopg 3's AsyncConnection
+
+and that a pool, if given, should be an AsyncConnectionPool.  A PyDO
+class whose connectionAlias is such an alias can be queried with the
+coroutine methods agetSome(), agetUnique() and anew(), and with
+pydo.multifetch's afetch() and aiterfetch().  The SQL is generated
+exactly as for the blocking methods, by an instance of the blocking
+driver's DBI class for the same database, the "dialect" of the async
+DBI object, which is never connected itself.
+
+Inside an "async with dbi.transaction():" block, a task's statements
+(and those of tasks it starts meanwhile) use one connection, which is
+committed at the end of the block, or rolled back if it raises;
+otherwise each statement takes a connection of its own and commits.
+The identity map and write-behind are not used by the coroutine
+methods.
+"""
+
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from threading import Lock
+
+from pydo import dbi as _dbi
+from pydo.dbi import DBIBase, ConnectionPool, _PoolEntry
+from pydo.exceptions import PyDOError
+from pydo.log import debug
+from pydo.utils import _import_a_class
+
+_driverConfig = {
+    'aiosqlite':   'pydo.drivers.aiosqliteconn.AiosqliteDBI',
+    'psycopg':     'pydo.drivers.psycopgasyncconn.AsyncPsycopgDBI',
+    }
+_loadedDrivers = {}
+_aliases = {}
+_connlock=Lock()
+
+
+async def _real_connect(connfunc, connargs, initFunc=None):
+    if isinstance(connargs, dict):
+        conn=await connfunc(**connargs)
+    elif isinstance(connargs, tuple):
+        conn=await connfunc(*connargs)
+    else:
+        conn=await connfunc(connargs)
+    if initFunc:
+        await initFunc(conn)
+    return conn
+
+
+class AsyncDBIBase(object):
+    """the asynchronous counterpart of pydo.dbi.DBIBase, for a
+    connection alias initialized with pydo.aio.initAlias().
+
+    Drivers set dialectClass to the blocking DBI class of the same
+    database; its instance, the dialect attribute, supplies the
+    converter and the other particulars of the SQL that PyDO
+    generates.
+    """
+    dialectClass=None
+    arraysize=1000
+
+    def __init__(self,
+                 connectArgs,
+                 connectFunc,
+                 dbapiModule,
+                 pool=None,
+                 verbose=False,
+                 initFunc=None):
+        """
+        constructor.
+        * connectArgs are arguments passed directly to connectFunc.
+        * connectFunc is the driver's coroutine function for
+          connecting.
+        * pool is an AsyncConnectionPool instance.
+        * verbose is whether or not to log the sql being executed.
+        * initFunc is a coroutine function called with each new
+          connection.
+        """
+        self.connectArgs=connectArgs
+        self.connectFunc=connectFunc
+        self.dbapiModule=dbapiModule
+        self.pool=pool
+        self.verbose=verbose
+        self.initFunc=initFunc
+        self.dialect=self.dialectClass(connectArgs, verbose=verbose)
+        # the connection of the current task's transaction
+        self._conn=contextvars.ContextVar('pydo_aio_conn_%x' % id(self),
+                                          default=None)
+
+    async def _connect(self):
+        if self.pool:
+            return await self.pool.connect(self.connectFunc,
+                                           self.connectArgs,
+                                           self.initFunc)
+        return await _real_connect(self.connectFunc,
+                                   self.connectArgs,
+                                   self.initFunc)
+
+    async def _release(self, conn):
+        if self.pool:
+            await self.pool.release(conn)
+        else:
+            await conn.close()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """an asynchronous context manager within which the current
+        task's statements use the same connection, committed when the
+        block ends, or rolled back if it raises.  Nested blocks join
+        the outermost one."""
+        if self._conn.get() is not None:
+            yield
+            return
+        conn=await self._connect()
+        token=self._conn.set(conn)
+        try:
+            try:
+                yield
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+        finally:
+            self._conn.reset(token)
+            await self._release(conn)
+
+    @asynccontextmanager
+    async def _connection(self):
+        """yields the connection of the current transaction, starting
+        one for the duration if there isn't one"""
+        conn=self._conn.get()
+        if conn is not None:
+            yield conn
+            return
+        async with self.transaction():
+            yield self._conn.get()
+
+    async def cursor(self, conn):
+        """returns a cursor of conn"""
+        return await conn.cursor()
+
+    async def serverCursor(self, conn):
+        """returns a cursor of conn suitable for streaming a large
+        result set; by default, an ordinary cursor."""
+        return await self.cursor(conn)
+
+    def _startQuery(self, sql, values, caller):
+        """logs a query if verbose and notifies any query hooks, as
+        DBIBase._startQuery() does."""
+        if self.verbose:
+            debug("SQL: %s", sql)
+            debug("bind variables: %s", values)
+        if not _dbi._query_hooks:
+            return None
+        info=dict(dbi=self,
+                  sql=sql,
+                  binds=values and len(values) or 0,
+                  caller=caller,
+                  start=time.time())
+        _dbi._notifyQueryHooks('before', info)
+        return info
+
+    _endQuery=DBIBase._endQuery
+
+    async def _execute(self, cursor, sql, values):
+        if values:
+            await cursor.execute(sql, values)
+        else:
+            await cursor.execute(sql)
+
+    async def _fetchResult(self, cursor):
+        """returns the rows resulting from an executed statement, or
+        None if it doesn't return any."""
+        if cursor.description is None:
+            return None
+        return await cursor.fetchall()
+
+    async def execute(self, sql, values=(), qualified=False, caller=None,
+                      factory=dict):
+        """Executes the statement with the values and returns a list
+        of rows made by factory (see DBIBase.execute()) or the number
+        of rows affected."""
+        info=self._startQuery(sql, values, caller)
+        async with self._connection() as conn:
+            c=await self.cursor(conn)
+            try:
+                try:
+                    await self._execute(c, sql, values)
+                    resultset=await self._fetchResult(c)
+                except Exception as e:
+                    self._endQuery(info, error=e)
+                    raise
+                if not resultset:
+                    rowcount=c.rowcount
+                    self._endQuery(info, rowcount)
+                    return rowcount
+                self._endQuery(info, len(resultset), len(resultset))
+                return DBIBase._convertResultSet(c.description, resultset,
+                                                 qualified, factory)
+            finally:
+                await c.close()
+
+    async def iterBatches(self, sql, values=(), arraysize=None, caller=None):
+        """Executes a query on a server-side cursor (where the driver
+        supports it) and yields (description, rows) pairs, as
+        DBIBase.iterBatches() does.  The connection is held until the
+        generator is exhausted or closed."""
+        if arraysize is None:
+            arraysize=self.arraysize
+        info=self._startQuery(sql, values, caller)
+        numrows=0
+        error=None
+        async with self._connection() as conn:
+            c=await self.serverCursor(conn)
+            try:
+                try:
+                    await self._execute(c, sql, values)
+                    while True:
+                        rows=await c.fetchmany(arraysize)
+                        if not rows:
+                            break
+                        numrows+=len(rows)
+                        yield c.description, rows
+                except Exception as e:
+                    error=e
+                    raise
+            finally:
+                await c.close()
+                if self.verbose:
+                    debug('fetched %d rows', numrows)
+                self._endQuery(info, numrows, numrows, error)
+
+    async def iterExecute(self, sql, values=(), qualified=False,
+                          arraysize=None, caller=None, factory=dict):
+        """Executes a query and yields the result rows as for
+        execute(), fetching them arraysize at a time."""
+        batches=self.iterBatches(sql, values, arraysize, caller)
+        try:
+            async for description, rows in batches:
+                for row in DBIBase._convertResultSet(description, rows,
+                                                     qualified, factory):
+                    yield row
+        finally:
+            await batches.aclose()
+
+    async def getSequence(self, name, field, table):
+        """If db has sequences, this should return the next value of
+        the sequence named 'name'"""
+        pass
+
+    async def getAutoIncrement(self, name):
+        """If db uses auto increment, should obtain the value of the
+        auto-incremented field named 'name', in the current
+        transaction"""
+        pass
+
+
+class AsyncConnectionPool(ConnectionPool):
+    """a connection pool for an asynchronous connection alias, taking
+    the same arguments as ConnectionPool (delay and retries aside)
+    and keeping the same statistics.  Tasks waiting for a connection
+    yield to the event loop, and connections are checked and reset
+    with the coroutines onHandOut() and onRelease().  connect()
+    returns the connection itself, which must be given back with
+    release().  A pool belongs to one event loop."""
+
+    def __init__(self,
+                 max_poolsize=0,
+                 keep_poolsize=1,
+                 timeout=2.0,
+                 max_lifetime=None,
+                 max_idle=None,
+                 ping_after=0):
+        super(AsyncConnectionPool, self).__init__(max_poolsize,
+                                                  keep_poolsize,
+                                                  timeout=timeout,
+                                                  max_lifetime=max_lifetime,
+                                                  max_idle=max_idle,
+                                                  ping_after=ping_after)
+        self._cond=None
+
+    def _condition(self):
+        # made on first use, in the event loop's thread
+        if self._cond is None:
+            self._cond=asyncio.Condition()
+        return self._cond
+
+    async def connect(self, connectFunc, connectArgs, initFunc=None):
+        """returns a connection, reusing an idle one if possible,
+        creating one if max_poolsize permits, and otherwise waiting
+        up to the pool's timeout for one to be released."""
+        start=time.time()
+        cond=self._condition()
+        while 1:
+            entry=None
+            expired=[]
+            waited=False
+            async with cond:
+                try:
+                    while 1:
+                        now=time.time()
+                        while self._free and entry is None:
+                            e=self._free.pop()
+                            if self._expired(e, now):
+                                self._discards+=1
+                                expired.append(e)
+                            else:
+                                entry=e
+                        if entry is not None:
+                            self._busy[id(entry.conn)]=entry
+                            self._peak_busy=max(self._peak_busy,
+                                                len(self._busy))
+                            break
+                        max_poolsize=self._max_poolsize
+                        if max_poolsize<=0 \
+                               or len(self._busy)+self._pending < max_poolsize:
+                            self._pending+=1
+                            break
+                        remaining=start+self._timeout-now
+                        if remaining<=0:
+                            self._timeouts+=1
+                            self._notify('timeout', wait_time=now-start)
+                            raise PyDOError("all %d connections in use; timed out "
+                                            "after %.2f seconds" \
+                                            % (max_poolsize, now-start))
+                        waited=True
+                        try:
+                            await asyncio.wait_for(cond.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    if waited:
+                        self._waits+=1
+                        self._wait_time+=time.time()-start
+            for e in expired:
+                await self._aclose(e.conn)
+                self._notify('discard', reason='expired')
+            if entry is None:
+                # a slot has been reserved
+                entry=await self._acreate(connectFunc, connectArgs, initFunc)
+                break
+            if time.time()-entry.released < self._ping_after \
+                   or await self.onHandOut(entry.conn):
+                break
+            await self._adiscard(entry)
+        latency=time.time()-start
+        self._checkouts+=1
+        buckets=self.latency_buckets
+        for i, bound in enumerate(buckets):
+            if latency<=bound:
+                break
+        else:
+            i=len(buckets)
+        self._latencies[i]+=1
+        self._notify('checkout', latency=latency)
+        return entry.conn
+
+    async def _acreate(self, connectFunc, connectArgs, initFunc):
+        start=time.time()
+        cond=self._condition()
+        try:
+            c=await _real_connect(connectFunc, connectArgs, initFunc)
+        except:
+            async with cond:
+                self._pending-=1
+                cond.notify()
+            raise
+        now=time.time()
+        async with cond:
+            self._pending-=1
+            self._creates+=1
+            self._create_time+=now-start
+            entry=self._busy[id(c)]=_PoolEntry(c, now)
+            self._peak_busy=max(self._peak_busy, len(self._busy))
+        self._notify('create', time=now-start)
+        return entry
+
+    async def _adiscard(self, entry):
+        cond=self._condition()
+        async with cond:
+            del self._busy[id(entry.conn)]
+            self._discards+=1
+            self._rejects+=1
+            cond.notify()
+        await self._aclose(entry.conn)
+        self._notify('reject')
+
+    async def _aclose(self, conn):
+        try:
+            await conn.close()
+        except:
+            # it may well be broken already
+            pass
+
+    async def release(self, conn):
+        """returns a connection to the pool."""
+        start=time.time()
+        await self.onRelease(conn)
+        now=time.time()
+        expired=False
+        cond=self._condition()
+        async with cond:
+            self._releases+=1
+            self._release_time+=now-start
+            keep=self._keep_poolsize >= len(self._free)+len(self._busy)
+            entry=self._busy.pop(id(conn))
+            if keep and self._max_lifetime is not None \
+                   and now-entry.created>=self._max_lifetime:
+                keep=False
+                expired=True
+                self._discards+=1
+            if keep:
+                entry.released=now
+                self._free.append(entry)
+            cond.notify()
+        if not keep:
+            await self._aclose(conn)
+        self._notify('release', time=now-start, kept=keep)
+        if expired:
+            self._notify('discard', reason='expired')
+
+    async def close(self):
+        """closes the idle connections"""
+        free=self._free
+        self._free=deque()
+        for entry in free:
+            await self._aclose(entry.conn)
+
+    async def onRelease(self, realConn):
+        """anything you want to do to a connection when it is returned
+        (default: rollback)"""
+        try:
+            await realConn.rollback()
+        except:
+            pass
+
+    async def onHandOut(self, realConn):
+        """any test you want to perform on a cached (i.e., not newly
+        connected) connection before giving it out.  If the connection
+        isn't good, return False"""
+        return super(AsyncConnectionPool, self).onHandOut(realConn)
+
+
+def _get_driver_class(name):
+    if name not in _loadedDrivers:
+        _loadedDrivers[name]=_import_a_class(_driverConfig[name])
+    return _loadedDrivers[name]
+
+def _init_function(init):
+    """turns the init argument of initAlias() into a coroutine
+    function of a connection, or None"""
+    if isinstance(init, str):
+        init=[init]
+    if isinstance(init, (list, tuple)):
+        for s in init:
+            if not isinstance(s, str):
+                raise ValueError("expected string, got %s" % s)
+        sql=init
+        async def init(conn):
+            c=await conn.cursor()
+            for s in sql:
+                await c.execute(s)
+            await c.close()
+    elif init and not asyncio.iscoroutinefunction(init):
+        raise ValueError("init must be either None, a string, "
+                         "or a coroutine function, got %s" % type(init))
+    return init
+
+def initAlias(alias, driver, connectArgs, pool=None, verbose=False, init=None):
+    """initializes an asynchronous connection alias, as
+    pydo.initAlias() does a blocking one.  init may be SQL (a string
+    or a list of strings) or a coroutine function to run on each new
+    connection."""
+    init=_init_function(init)
+    data=dict(driver=driver,
+              connectArgs=connectArgs,
+              pool=pool,
+              verbose=verbose,
+              initFunc=init)
+    _connlock.acquire()
+    try:
+        old=_aliases.get(alias)
+        if old:
+            old=old.copy()
+            old.pop('connection', None)
+            if data!=old:
+                raise ValueError("already initialized: %s: %r != %r" %
+                                 (alias, data, old))
+        else:
+            _aliases[alias]=data
+    finally:
+        _connlock.release()
+
+def delAlias(alias):
+    """delete an asynchronous connection alias if it has already been
+    initialized; does nothing otherwise"""
+    _connlock.acquire()
+    try:
+        _aliases.pop(alias, None)
+    finally:
+        _connlock.release()
+
+def getConnection(alias, create=True):
+    """get the async DBI object for an asynchronous connection alias"""
+    _connlock.acquire()
+    try:
+        try:
+            conndata=_aliases[alias]
+        except KeyError:
+            raise ValueError("async alias %s not recognized" % alias)
+        if 'connection' not in conndata:
+            if not create:
+                return None
+            driver=_get_driver_class(conndata['driver'])
+            conndata['connection']=driver(conndata['connectArgs'],
+                                          conndata['pool'],
+                                          conndata['verbose'],
+                                          conndata['initFunc'])
+        return conndata['connection']
+    finally:
+        _connlock.release()
+
+
+__all__=['AsyncConnectionPool']
@@ -1,22 +1,29 @@
 # -*-python-*-
+from pydo import dbi as _dbi
+from pydo import aio
 from pydo.dbi import getConnection
 from pydo.field import Field
 from pydo.guesscache import GuessCache
 from pydo.exceptions import PyDOError
-from pydo.operators import AND, EQ, FIELD, IS, NULL
+from pydo.operators import (AND, OR, EQ, LT, GT, IN, FIELD, IS, NULL, CONSTANT,
+                            SET, ROW, ANY, SQLOperator, render)
 from pydo.dbtypes import unwrap
 from pydo.utils import (_tupleize, _setize, formatTexp, moduleize,
-                        _strip_tablename, every, string_to_obj)
+                        _strip_tablename, every, string_to_obj, ichunks,
+                        LRUCache)
 import sys
 if sys.version_info[0] == 2:
     from itertools import izip as zip
 else:
     basestring=str
 import re
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from inspect import isfunction
 
 _group_pat=re.compile(r'\s*group ', re.I)
 _as_pat=re.compile(r'^(\w+)\s+as\s+(\w+)$', re.I)
+_column_pat=re.compile(r'^[\w.]+$')
 
 
 def _restrict(flds, coll):
@@ -60,6 +67,95 @@ def _restrict(flds, coll):
         return dict((x, y) for x, y in coll.items() if infld(x,flds))
 
 
+def _is_sql(val):
+    """whether val will be rendered into SQL, rather than bound"""
+    return isinstance(val, (CONSTANT, SET, SQLOperator))
+
+
+class _Bind(object):
+    """stands in for a bind value, identified by name, while a
+    statement template is being compiled."""
+    __slots__=('name',)
+
+    def __init__(self, name):
+        self.name=name
+
+
+def _bind_order(values):
+    """given the values accumulated by a converter while compiling a
+    statement template, returns the names of the _Bind instances in
+    the order the bind variables occur."""
+    if isinstance(values, dict):
+        return [values[k].name for k in sorted(values, key=lambda k: int(k[1:]))]
+    return [v.name for v in values]
+
+
+class Record(tuple):
+    """base class for the immutable, tuple-backed records returned by
+    compact projections (see PyDO.project()).  Fields can be accessed
+    as attributes or by name (or by position) as items; iteration
+    yields the values, as for a tuple."""
+    __slots__=()
+    # set in each subclass: the field names in order, and their positions
+    _fields=()
+    _index={}
+
+    def __new__(cls, pairs=()):
+        if isinstance(pairs, dict):
+            pairs=pairs.items()
+        vals=[None]*len(cls._fields)
+        index=cls._index
+        for k, v in pairs:
+            vals[index[k]]=v
+        return tuple.__new__(cls, vals)
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            try:
+                key=self._index[key]
+            except KeyError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        """returns the value of the field key, or default"""
+        if key in self._index:
+            return tuple.__getitem__(self, self._index[key])
+        return default
+
+    def keys(self):
+        """returns the field names"""
+        return list(self._fields)
+
+    def values(self):
+        """returns the field values"""
+        return list(self)
+
+    def items(self):
+        """returns (name, value) pairs for the fields"""
+        return list(zip(self._fields, self))
+
+    def dict(self):
+        """returns a copy of self as a plain dict"""
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join('%s=%r' % x for x in self.items()))
+
+
+def _record_class(name, fields):
+    """returns a Record subclass with the given field names"""
+    ns=dict(__slots__=(),
+            _fields=tuple(fields),
+            _index=dict((f, i) for i, f in enumerate(fields)))
+    for i, f in enumerate(fields):
+        # fields may shadow tuple methods, but not Record's own
+        if f not in Record.__dict__ and not f.startswith('_'):
+            ns[f]=property(lambda self, i=i: tuple.__getitem__(self, i))
+    return type(name, (Record,), ns)
+
+
 class _metapydo(type):
     """metaclass for _pydobase.
     Manages attribute inheritance.
@@ -68,6 +164,8 @@ class _metapydo(type):
     def __init__(cls, cl_name, bases, namespace):
         # add a dictionary to store projections for this class.
         cls._projections={}
+        # and a cache of compiled statement templates
+        cls._statements=LRUCache(cls.statement_cache_size)
         # tablename guessing
         if namespace.get('table') is not None:
             # table has been explicitly declared, so
@@ -193,6 +291,12 @@ class PyDO(dict, metaclass=_metapydo):
     schema=None
     refetch=False
     guesscache=None
+    # maximum number of compiled statement templates to keep
+    statement_cache_size=128
+    # whether to keep one instance per row for the current transaction
+    use_identity_map=False
+    # whether to defer updates until the next flush
+    write_behind=False
     _ignore_update_rowcount=False
 
     ## not defined by default, but if you aren't using guess_columns
@@ -201,6 +305,10 @@ class PyDO(dict, metaclass=_metapydo):
 
     # private - don't touch
     _is_projection=False
+    # for compact projections, the Record class of the rows returned
+    _record=None
+    # (alias generation, connection alias, DBI object); see getDBI()
+    _dbi_cache=None
 
     @classmethod
     def _getTableDescription(cls):
@@ -214,17 +322,22 @@ class PyDO(dict, metaclass=_metapydo):
         compatible a pydo.GuessCache, and it will be consulted and
         populated.
         """
-        args = [cls.getTable(False), cls.schema]
-        if cls.sequence_mapper:
-            args.append(cls.sequence_mapper)
         if cls.guesscache:
             data=cls.guesscache.retrieve(cls)
             if not data:
-                data=cls.getDBI().describeTable(*args)
+                data=cls._describeTable()
                 cls.guesscache.store(cls, data)
             return data
         else:
-            return cls.getDBI().describeTable(*args)
+            return cls._describeTable()
+
+    @classmethod
+    def _describeTable(cls):
+        """asks the DBI driver for the table description"""
+        args = [cls.getTable(False), cls.schema]
+        if cls.sequence_mapper:
+            args.append(cls.sequence_mapper)
+        return cls.getDBI().describeTable(*args)
 
     @staticmethod
     def _create_field(*args, **kwargs):
@@ -250,16 +363,30 @@ class PyDO(dict, metaclass=_metapydo):
 
     @classmethod
     def project(cls, *fields, **kwargs):
+        """returns a subclass of the class restricted to the given
+        fields (which may be declared as in the fields attribute).
+
+        Keyword arguments:
+
+        * mutable: whether the projection is mutable (by default, as
+          for the class).
+        * module: a module in which to make the projection available.
+        * compact: if true, the projection's query methods return
+          immutable, tuple-backed Record instances, which take much
+          less memory than the dictionaries that are PyDO instances
+          but can't be updated or deleted.
+        """
         # also accept passing in a list or tuple (backwards compatibility)
         if len(fields)==1 and isinstance(fields[0], (list, tuple)):
             fields=fields[0]
 
-        acceptable=frozenset(('mutable','module'))
+        acceptable=frozenset(('mutable','module','compact'))
         diff=frozenset(kwargs)-acceptable
         if diff:
             raise ValueError("unrecognized keyword arguments: %s" \
                   % ', '.join(str(x) for x in diff))
-        mutable=kwargs.get('mutable', cls.mutable)
+        compact=kwargs.get('compact', False)
+        mutable=kwargs.get('mutable', cls.mutable) and not compact
         module=kwargs.get('module', None)
         s=[]
         for f in fields:
@@ -287,6 +414,9 @@ class PyDO(dict, metaclass=_metapydo):
                                            mutable=mutable,
                                            table=cls.getTable(False),
                                            _is_projection=True))
+            if compact:
+                kls._record=_record_class('record_%s' % klsname,
+                                          kls.getColumns())
             cls._projections[t]=kls
         if module:
             moduleize(module, kls)
@@ -304,17 +434,80 @@ class PyDO(dict, metaclass=_metapydo):
         # Check that the fields in the dictionary are kosher
         self._validateFields(d)
         # do the actual update
-        self._update_raw(d)
+        if self.write_behind:
+            self._defer(d)
+        else:
+            self._update_raw(d)
+        if self.use_identity_map:
+            conn=self.getDBI()
+            self._forget(conn)
         # if successful, modify the object's field data,
         # taking any wrapped values out of their wrappers
         unwrapped=dict((k, unwrap(v)) for k,v in d.items())
         super(PyDO, self).update(unwrapped)
+        # prefetched relations may no longer apply
+        self.__dict__.pop('_prefetched', None)
+        if self.use_identity_map:
+            self._identify(conn, self, True)
 
     def onUpdate(self, adict):
         """a hook for subclasses to modify/validate updates;
         by default returns the original data unchanged."""
         return adict
 
+    def _defer(self, adict):
+        """records the changes in adict to be written to the database
+        when the DBI object is flushed, for write_behind classes."""
+        conn=self.getDBI()
+        if [v for v in adict.values() if _is_sql(v)]:
+            # values rendered as SQL can't be batched; write everything
+            # pending, then this, now
+            conn.flush()
+            self._update_raw(adict)
+            return
+        pending=self.__dict__.get('_pending')
+        if pending is None:
+            # remember how to find the row, in case the changes
+            # include its unique fields
+            where=dict((u, self[u]) for u in self._matchUnique(self))
+            pending=self.__dict__['_pending']=(where, {})
+        # (again, if a failed flush left it out of the registry)
+        conn.addPending(self)
+        pending[1].update(adict)
+
+    def _flushKey(self):
+        """the key by which pending changes are grouped for writing
+        together"""
+        where, changes=self._pending
+        return (self.__class__, tuple(sorted(changes)), tuple(sorted(where)))
+
+    @classmethod
+    def _flushMany(cls, conn, objs):
+        """writes the pending changes of objs, which all have the
+        same _flushKey(), with a single UPDATE statement."""
+        setcols, wherecols=objs[0]._flushKey()[1:]
+        converter=conn.getConverter()
+        marks=converter.placeholders(len(setcols)+len(wherecols))
+        sql="UPDATE %s SET %s WHERE %s" % (
+            cls.getTable(),
+            ", ".join("%s = %s" % x for x in zip(setcols, marks)),
+            " AND ".join("%s = %s" % x for x in zip(wherecols,
+                                                     marks[len(setcols):])))
+        rows=[]
+        for obj in objs:
+            where, changes=obj.__dict__.pop('_pending')
+            rows.append(converter.rowValues([changes[c] for c in setcols]+
+                                            [where[u] for u in wherecols]))
+        result=conn.executemany(sql, rows, caller=cls)
+        if conn.has_sane_rowcount and result >= 0 and result != len(rows) \
+               and not cls._ignore_update_rowcount:
+            raise PyDOError("updated %s rows instead of %s" % (result, len(rows)))
+
+    @classmethod
+    def flush(cls):
+        """write any pending changes of write_behind objects"""
+        cls.getDBI().flush()
+
     def __setitem__(self, k, v):
         self.update({k:v})
 
@@ -325,15 +518,27 @@ class PyDO(dict, metaclass=_metapydo):
         # and class/instance is mutable
 
         conn=self.getDBI()
-        converter=conn.getConverter()
-        sqlbuff=["%s  = %s" % (x, converter(y)) for x, y in adict.items()]
-        # pass in the same converter so that we don't get generated
-        # interpolation names that clobber any others
-        where, values=self._uniqueWhere(conn, self, converter)
-        sql = "UPDATE %s SET %s WHERE %s" % (self.getTable(),
-                                             ", ".join(sqlbuff),
-                                             where)
-        result=conn.execute(sql, values)
+        unique=self._matchUnique(self)
+        data=dict((('set', k), v) for k, v in adict.items())
+        data.update((('where', u), self[u]) for u in unique)
+
+        def compile(data):
+            converter=conn.getConverter()
+            sqlbuff=["%s  = %s" % (x[1], converter(y)) \
+                     for x, y in data.items() if x[0]=='set']
+            # pass in the same converter so that we don't get generated
+            # interpolation names that clobber any others
+            where, values=self._uniqueWhere(conn,
+                                            dict((x[1], y) for x, y in data.items() \
+                                                 if x[0]=='where'),
+                                            converter)
+            sql = "UPDATE %s SET %s WHERE %s" % (self.getTable(),
+                                                 ", ".join(sqlbuff),
+                                                 where)
+            return sql, values
+
+        sql, values=self._compiled(conn, 'update', data, compile)
+        result=conn.execute(sql, values, caller=self.__class__)
         # mysql will return 0 if the update was vacuous,
         # but that doesn't imply failure.  Postgresql and sqlite
         # will return 1 in this case.
@@ -357,16 +562,32 @@ class PyDO(dict, metaclass=_metapydo):
             return
         cls._validateFields(adict)
         conn=cls.getDBI()
-        converter=conn.getConverter()
-        sqlbuff=["UPDATE ",
-                 cls.getTable(),
-                 " SET ",
-                 ', '.join(["%s = %s" % (x, converter(y)) \
-                            for x, y in adict.items()])]
-        where, values=cls._processWhere(conn, args, fieldData, converter)
-        if where:
-            sqlbuff.extend([' WHERE ', where])
-        return conn.execute(''.join(sqlbuff), values)
+        if cls.use_identity_map:
+            # we can't know which rows were affected
+            conn.getIdentityMap().pop(cls.getTable(), None)
+        # rows updated by one chunk's statement mustn't then match
+        # another's
+        chunkable=not [a for a in args if isinstance(a, IN) \
+                       and isinstance(a[1], CONSTANT) and a[1].name in adict]
+        argsets, done=cls._largeIn(conn, args, chunkable)
+        try:
+            counts=[]
+            for a in argsets:
+                converter=conn.getConverter()
+                sqlbuff=["UPDATE ",
+                         cls.getTable(),
+                         " SET ",
+                         ', '.join(["%s = %s" % (x, converter(y)) \
+                                    for x, y in adict.items()])]
+                where, values=cls._processWhere(conn, a, dict(fieldData),
+                                                converter)
+                if where:
+                    sqlbuff.extend([' WHERE ', where])
+                counts.append(conn.execute(''.join(sqlbuff), values, caller=cls))
+        finally:
+            if done:
+                done()
+        return _sumCounts(counts)
 
 
     def dict(self):
@@ -444,9 +665,22 @@ class PyDO(dict, metaclass=_metapydo):
     @classmethod
     def getDBI(cls):
         """return the database interface"""
+        # cached on the class until an alias is initialized or deleted
+        cached=cls._dbi_cache
+        if cached is not None and cached[0]==_dbi._generation \
+               and cached[1]==cls.connectionAlias:
+            return cached[2]
+        generation=_dbi._generation
         conn=getConnection(cls.connectionAlias)
+        cls._dbi_cache=(generation, cls.connectionAlias, conn)
         return conn
 
+    @classmethod
+    def getAsyncDBI(cls):
+        """return the asynchronous database interface, for a
+        connection alias initialized with pydo.aio.initAlias()"""
+        return aio.getConnection(cls.connectionAlias)
+
     @classmethod
     def commit(cls):
         """ Commit changes to database"""
@@ -498,16 +732,8 @@ class PyDO(dict, metaclass=_metapydo):
             for s, sn in list(cls._sequenced.items()):
                 if s not in fieldData:
                     fieldData[s] = conn.getSequence(sn, s, cls.getTable(True))
-        cols=list(fieldData.keys())
-        vals=[fieldData[c] for c in cols]
-        converter=conn.getConverter()
-        converted=list(map(converter, vals))
-
-        sql = 'INSERT INTO %s (%s) VALUES  (%s)' \
-              % (cls.getTable(),
-                 ', '.join(cols),
-                 ', '.join(converted))
-        res = conn.execute(sql, converter.values)
+        sql, values=cls._newSQL(conn, fieldData)
+        res = conn.execute(sql, values, caller=cls)
         if res != 1:
             raise PyDOError("inserted %s rows instead of 1" % res)
 
@@ -523,12 +749,291 @@ class PyDO(dict, metaclass=_metapydo):
             # add None for any missing columns
             for c in cls.getColumns():
                 fieldData.setdefault(c, None)
-            return cls(fieldData)
-        return cls.getUnique(**fieldData)
+            return cls._identify(conn, fieldData, True)
+        return cls._fetchUnique(conn, fieldData)
 
     @classmethod
-    def _sequence_for(cls, field):
-        mapper = cls.sequence_mapper or getattr(cls.getDBI(), 'sequence_mapper', None)
+    def _newSQL(cls, conn, fieldData):
+        """returns the INSERT statement and bind values for new()"""
+        def compile(data):
+            cols=sorted(data)
+            converter=conn.getConverter()
+            converted=[converter(data[c]) for c in cols]
+            return cls._insertSQL(cols, converted), converter.values
+
+        return cls._compiled(conn, 'new', fieldData, compile)
+
+    @classmethod
+    async def anew(cls, **fieldData):
+        """coroutine counterpart of new(), for classes whose
+        connectionAlias is asynchronous (see pydo.aio).  The row is
+        inserted (and refetched) in the current task's transaction,
+        or in one of its own."""
+        if 'refetch' in cls._fields:
+            refetch=cls.refetch
+        else:
+            refetch=fieldData.pop('refetch', cls.refetch)
+        if not cls.mutable:
+            raise ValueError('cannot make a new immutable object!')
+        if refetch and not cls._unique:
+            raise ValueError("cannot refetch without a unique index!")
+        cls._validateFields(fieldData)
+        adbi=cls.getAsyncDBI()
+        conn=adbi.dialect
+        async with adbi.transaction():
+            if not conn.auto_increment:
+                for s, sn in list(cls._sequenced.items()):
+                    if s not in fieldData:
+                        fieldData[s]=await adbi.getSequence(sn, s, cls.getTable(True))
+            sql, values=cls._newSQL(conn, fieldData)
+            res=await adbi.execute(sql, values, caller=cls)
+            if res != 1:
+                raise PyDOError("inserted %s rows instead of 1" % res)
+            if conn.auto_increment:
+                for k, v in list(cls._sequenced.items()):
+                    if k not in fieldData:
+                        if v == True:
+                            v = cls._sequence_for(k, conn)
+                        fieldData[k]=await adbi.getAutoIncrement(v)
+            fieldData=dict((k, unwrap(v)) for k,v in fieldData.items())
+            if not refetch:
+                for c in cls.getColumns():
+                    fieldData.setdefault(c, None)
+                return cls(fieldData)
+            return await cls._afetchUnique(adbi, fieldData)
+
+    @classmethod
+    def newMany(cls, rows, chunksize=1000):
+        """insert many rows at once, and return a list of the new data
+        class instances, in the same order.  rows is an iterable of
+        dictionaries of field data, as would be passed to new() as
+        keyword arguments; instances are never refetched.
+
+        The rows are processed chunksize at a time.  Within a chunk,
+        missing sequence values are obtained in bulk, and rows with
+        the same columns are inserted together, either with
+        executemany() or, for drivers for which it is faster, with
+        multi-row INSERT statements.  On auto-increment drivers, rows
+        that lack a value for an auto-increment field must be
+        inserted one at a time to learn the new value, although the
+        SQL is still only generated once.
+        """
+        if not cls.mutable:
+            raise ValueError('cannot make a new immutable object!')
+        conn=cls.getDBI()
+        result=[]
+        for chunk in ichunks(rows, chunksize):
+            result.extend(cls._newMany(conn, [dict(r) for r in chunk]))
+        if cls.use_identity_map:
+            for obj in result:
+                cls._identify(conn, obj, True)
+        return result
+
+    @classmethod
+    def _newMany(cls, conn, rows):
+        for fieldData in rows:
+            cls._validateFields(fieldData)
+        cls._fillSequences(conn, rows)
+        # group the rows by the columns they supply
+        groups={}
+        for fieldData in rows:
+            groups.setdefault(tuple(sorted(fieldData)), []).append(fieldData)
+        for cols, group in groups.items():
+            autoinc=[k for k in cls._sequenced if k not in cols] \
+                     if conn.auto_increment else None
+            sqlvals=[r for r in group \
+                     if [v for v in r.values() if _is_sql(v)]]
+            if autoinc or sqlvals:
+                cls._insertEach(conn, cols, group, autoinc)
+            elif conn.multirow_insert:
+                cls._insertMultirow(conn, cols, group)
+            else:
+                converter=conn.getConverter()
+                sql=cls._insertSQL(cols, converter.placeholders(len(cols)))
+                res=conn.executemany(sql, [converter.rowValues([r[c] for c in cols]) \
+                                           for r in group],
+                                     caller=cls)
+                if res >= 0 and res != len(group):
+                    raise PyDOError("inserted %s rows instead of %s" \
+                                    % (res, len(group)))
+        allcols=cls.getColumns()
+        result=[]
+        for fieldData in rows:
+            fieldData=dict((k, unwrap(v)) for k, v in fieldData.items())
+            for c in allcols:
+                fieldData.setdefault(c, None)
+            result.append(cls(fieldData))
+        return result
+
+    @classmethod
+    def _fillSequences(cls, conn, rows):
+        """obtains in bulk the sequence values missing from rows, if
+        the driver doesn't use auto-increment fields."""
+        if conn.auto_increment:
+            return
+        table=cls.getTable(True)
+        for s, sn in list(cls._sequenced.items()):
+            missing=[r for r in rows if s not in r]
+            if missing:
+                seqvals=conn.getSequenceValues(sn, s, table, len(missing))
+                for r, v in zip(missing, seqvals):
+                    r[s]=v
+
+    @classmethod
+    def upsert(cls, **fieldData):
+        """inserts a row with the values in fieldData or, if a row with
+        the same values for one of the class's uniqueness constraints
+        already exists, updates that row with them instead, in a single
+        statement.  The constraint matched is the narrowest one for
+        which fieldData has values.  Returns an instance for the row,
+        which is always refetched, since an existing row may have
+        values not in fieldData."""
+        if not cls.mutable:
+            raise ValueError('cannot upsert through an immutable class')
+        cls._validateFields(fieldData)
+        conn=cls.getDBI()
+        keys, update=cls._upsertColumns(fieldData)
+        row=dict(fieldData)
+        cls._fillSequences(conn, [row])
+
+        def compile(data):
+            cols=sorted(data)
+            converter=conn.getConverter()
+            converted=[converter(data[c]) for c in cols]
+            return conn.upsertSQL(cls.getTable(), cols, converted, keys, update), \
+                   converter.values
+
+        sql, values=cls._compiled(conn, ('upsert', update), row, compile)
+        conn.execute(sql, values, caller=cls)
+        return cls._fetchUnique(conn, dict((k, unwrap(row[k])) for k in keys))
+
+    @classmethod
+    def upsertMany(cls, rows, chunksize=1000, refetch=False):
+        """upserts many rows at once: rows is an iterable of
+        dictionaries of field data, as would be passed to upsert() as
+        keyword arguments.  Rows with the same columns are written
+        together with executemany(), chunksize rows at a time.  If
+        refetch is true, returns a list of instances for the rows, in
+        the same order, fetched with one query per chunk; otherwise
+        returns None."""
+        if not cls.mutable:
+            raise ValueError('cannot upsert through an immutable class')
+        conn=cls.getDBI()
+        result=[] if refetch else None
+        for chunk in ichunks(rows, chunksize):
+            chunk=[dict(r) for r in chunk]
+            specs=[]
+            for fieldData in chunk:
+                cls._validateFields(fieldData)
+                specs.append(cls._upsertColumns(fieldData))
+            cls._fillSequences(conn, chunk)
+            groups={}
+            for fieldData, (keys, update) in zip(chunk, specs):
+                groups.setdefault((keys, update, tuple(sorted(fieldData))),
+                                  []).append(fieldData)
+            for (keys, update, cols), group in groups.items():
+                converter=conn.getConverter()
+                template=conn.upsertSQL(cls.getTable(), cols,
+                                        converter.placeholders(len(cols)),
+                                        keys, update)
+                plain=[]
+                for fieldData in group:
+                    vals=[fieldData[c] for c in cols]
+                    if [v for v in vals if _is_sql(v)]:
+                        converter.reset()
+                        sql=conn.upsertSQL(cls.getTable(), cols,
+                                           list(map(converter, vals)),
+                                           keys, update)
+                        conn.execute(sql, converter.values, caller=cls)
+                    else:
+                        plain.append(converter.rowValues(vals))
+                if plain:
+                    conn.executemany(template, plain, caller=cls)
+            if refetch:
+                result.extend(cls._refetchRows(chunk, specs))
+        if cls.use_identity_map and not refetch:
+            # we don't know which rows were updated
+            conn.getIdentityMap().pop(cls.getTable(), None)
+        return result
+
+    @classmethod
+    def _upsertColumns(cls, fieldData):
+        """returns the uniqueness constraint an upsert of fieldData
+        matches on, and the columns it updates."""
+        keys=cls._narrowestUnique(fieldData)
+        if keys is None:
+            raise ValueError('No way to get unique row! %s' % fieldData)
+        return keys, tuple(sorted(c for c in fieldData if c not in keys))
+
+    @classmethod
+    def _refetchRows(cls, rows, specs):
+        """fetches instances for rows, given the constraints they were
+        upserted by"""
+        bykeys={}
+        for fieldData, (keys, update) in zip(rows, specs):
+            bykeys.setdefault(keys, set()).add(tuple(unwrap(fieldData[k]) \
+                                                     for k in keys))
+        found=dict((keys, _fetchByKeys(cls, keys, list(vals))) \
+                   for keys, vals in bykeys.items())
+        conn=cls.getDBI()
+        result=[]
+        for fieldData, (keys, update) in zip(rows, specs):
+            objs=found[keys].get(tuple(unwrap(fieldData[k]) for k in keys))
+            result.append(cls._identify(conn, objs[0]) if objs else None)
+        return result
+
+    @classmethod
+    def _insertSQL(cls, cols, converted):
+        return 'INSERT INTO %s (%s) VALUES  (%s)' % (cls.getTable(),
+                                                     ', '.join(cols),
+                                                     ', '.join(converted))
+
+    @classmethod
+    def _insertEach(cls, conn, cols, group, autoinc):
+        """inserts rows one at a time, obtaining auto-increment values
+        for the fields in autoinc"""
+        converter=conn.getConverter()
+        template=cls._insertSQL(cols, converter.placeholders(len(cols)))
+        for fieldData in group:
+            vals=[fieldData[c] for c in cols]
+            if [v for v in vals if _is_sql(v)]:
+                converter.reset()
+                sql=cls._insertSQL(cols, list(map(converter, vals)))
+                res=conn.execute(sql, converter.values, caller=cls)
+            else:
+                res=conn.execute(template, converter.rowValues(vals), caller=cls)
+            if res != 1:
+                raise PyDOError("inserted %s rows instead of 1" % res)
+            for k in autoinc or ():
+                v=cls._sequenced[k]
+                if v == True:
+                    v = cls._sequence_for(k)
+                fieldData[k] = conn.getAutoIncrement(v)
+
+    @classmethod
+    def _insertMultirow(cls, conn, cols, group):
+        """inserts rows with multi-row INSERT statements, respecting the
+        driver's limit on bind variables."""
+        perstmt=len(group)
+        if conn.max_bind_params:
+            perstmt=max(1, conn.max_bind_params // len(cols))
+        for chunk in ichunks(group, perstmt):
+            converter=conn.getConverter()
+            rowsql=['(%s)' % ', '.join([converter(r[c]) for c in cols]) \
+                    for r in chunk]
+            sql='INSERT INTO %s (%s) VALUES %s' % (cls.getTable(),
+                                                   ', '.join(cols),
+                                                   ', '.join(rowsql))
+            res=conn.execute(sql, converter.values, caller=cls)
+            if res >= 0 and res != len(chunk):
+                raise PyDOError("inserted %s rows instead of %s" \
+                                % (res, len(chunk)))
+
+    @classmethod
+    def _sequence_for(cls, field, conn=None):
+        if conn is None:
+            conn = cls.getDBI()
+        mapper = cls.sequence_mapper or getattr(conn, 'sequence_mapper', None)
         if mapper:
             return mapper(cls.table, field)
 
@@ -567,9 +1072,9 @@ class PyDO(dict, metaclass=_metapydo):
             converter=conn.getConverter()
         if len(unique)==1:
             u=tuple(unique)[0]
-            sql=str(EQ(FIELD(u), kw[u], converter=converter))
+            sql=render(EQ(FIELD(u), kw[u]), converter)
         else:
-            sql=str(AND(converter=converter, *[EQ(FIELD(u), kw[u]) for u in unique]))
+            sql=render(AND(*[EQ(FIELD(u), kw[u]) for u in unique]), converter)
         return sql, converter.values
 
 
@@ -583,15 +1088,146 @@ class PyDO(dict, metaclass=_metapydo):
         """
         cls._validateFields(fieldData)
         conn = cls.getDBI()
-        where, values = cls._uniqueWhere(conn, fieldData)
-        sql = "%s WHERE %s" % (cls._baseSelect(), where)
-        results = conn.execute(sql, values)
+        if cls.use_identity_map:
+            imap=cls._identityMap(conn)
+            for key in cls._identityKeys(fieldData):
+                obj=imap.get(key)
+                if obj is not None:
+                    if every(True, (obj.get(u)==fieldData[u] \
+                                    for u in cls._matchUnique(fieldData))):
+                        return obj
+                    break
+        return cls._fetchUnique(conn, fieldData)
+
+    @classmethod
+    def _fetchUnique(cls, conn, fieldData):
+        """does the work of getUnique(), without consulting the
+        identity map."""
+        sql, values = cls._uniqueSQL(conn, fieldData)
+        results = conn.execute(sql, values, caller=cls,
+                               factory=cls._record or cls)
         if not results or not isinstance(results, (list,tuple)):
             return
         if len(results) > 1:
             raise PyDOError('got more than one row on unique query!')
-        if results:
-            return cls(results[0])
+        if cls._record:
+            return results[0]
+        return cls._identify(conn, results[0])
+
+    @classmethod
+    def _uniqueSQL(cls, conn, fieldData):
+        """returns the SELECT statement and bind values for getUnique()"""
+        def compile(data):
+            where, values = cls._uniqueWhere(conn, data)
+            return "%s WHERE %s" % (cls._baseSelect(), where), values
+
+        return cls._compiled(conn, 'getUnique', fieldData, compile)
+
+    @classmethod
+    async def agetUnique(cls, **fieldData):
+        """coroutine counterpart of getUnique(), for classes whose
+        connectionAlias is asynchronous (see pydo.aio)"""
+        cls._validateFields(fieldData)
+        return await cls._afetchUnique(cls.getAsyncDBI(), fieldData)
+
+    @classmethod
+    async def _afetchUnique(cls, adbi, fieldData):
+        sql, values = cls._uniqueSQL(adbi.dialect, fieldData)
+        results = await adbi.execute(sql, values, caller=cls,
+                                     factory=cls._record or cls)
+        if not results or not isinstance(results, (list,tuple)):
+            return
+        if len(results) > 1:
+            raise PyDOError('got more than one row on unique query!')
+        return results[0]
+
+    @classmethod
+    def _identityKeys(cls, data):
+        """yields the identity map keys for the row data, one for
+        each uniqueness constraint for which it has non-null values."""
+        for unique in cls._unique:
+            if isinstance(unique, basestring):
+                names=(unique,)
+            else:
+                names=tuple(sorted(unique))
+            vals=tuple(data.get(n) for n in names)
+            if None not in vals:
+                yield (cls, names, vals)
+
+    @classmethod
+    def _identityMap(cls, conn):
+        """returns the part of the connection's identity map for
+        the class's table."""
+        return conn.getIdentityMap().setdefault(cls.getTable(), {})
+
+    @classmethod
+    def _identify(cls, conn, data, replace=False, remember=True):
+        """returns an instance for the row data.  If the class uses
+        an identity map and it already has an instance for the row,
+        that instance is updated with the data and returned (unless
+        replace is true, in which case a new instance supersedes it);
+        otherwise a new instance is created and, if remember is true,
+        added to the map."""
+        if not cls.use_identity_map:
+            return data if isinstance(data, cls) else cls(data)
+        imap=cls._identityMap(conn)
+        keys=list(cls._identityKeys(data))
+        obj=None
+        if not replace:
+            for key in keys:
+                obj=imap.get(key)
+                if obj is not None:
+                    if obj is not data:
+                        dict.update(obj, data)
+                    break
+        if obj is None:
+            obj=data if isinstance(data, cls) else cls(data)
+            if not remember:
+                return obj
+        for key in keys:
+            imap[key]=obj
+        return obj
+
+    def _forget(self, conn):
+        """removes self's row from the identity map."""
+        imap=self._identityMap(conn)
+        for key in self._identityKeys(self):
+            imap.pop(key, None)
+
+    @classmethod
+    def _compiled(cls, conn, operation, data, compile):
+        """returns the SQL and bind values for a statement generated by
+        compile(data), where data is a dictionary of values keyed by
+        name and compile returns the SQL and the values accumulated by
+        a converter.
+
+        For a given operation, set of names, and paramstyle, the SQL
+        generated is always the same, so the statement template is
+        compiled once and kept in the class's statement cache;
+        subsequent calls only bind the values.  None values are part
+        of the template (as they may appear as NULL literals), and
+        values that are themselves SQL (operators and constants)
+        bypass the cache.
+        """
+        cache=cls._statements
+        if cache.maxsize<=0 or [v for v in data.values() if _is_sql(v)]:
+            return compile(data)
+        nulls=tuple(sorted(k for k, v in data.items() if v is None))
+        key=(operation, tuple(sorted(data)), nulls, conn.paramstyle)
+        template=cache.get(key)
+        if template is None:
+            tdata=dict((k, v if v is None else _Bind(k)) for k, v in data.items())
+            sql, values=compile(tdata)
+            template=(sql, _bind_order(values))
+            cache[key]=template
+        sql, names=template
+        return sql, conn.getConverter().rowValues([data[n] for n in names])
+
+    @classmethod
+    def getStatementCacheStats(cls):
+        """returns a dictionary of statistics for the class's cache of
+        compiled statements: hits, misses, size, and maxsize."""
+        return cls._statements.stats()
 
     @classmethod
     def _baseSelect(cls, qualified=False):
@@ -640,17 +1276,185 @@ class PyDO(dict, metaclass=_metapydo):
             andlen=len(andValues)
             if converter is None:
                 converter=conn.getConverter()
+            # render each condition from a cached template, as
+            # AND(*andValues) would be rendered
             if andlen==0:
                 sql=''
             elif andlen==1:
-                andValues[0].setConverter(converter)
-                sql=repr(andValues[0])
+                sql=render(andValues[0], converter)
             else:
-                sql=repr(AND(converter=converter, *andValues))
+                sql="(%s)" % " AND ".join([render(v, converter) for v in andValues])
             values=converter.values
         return sql, values
 
 
+    @classmethod
+    def _selectSQL(cls, conn, args, fieldData):
+        """returns the SELECT statement and bind values for the query
+        arguments accepted by getSome()."""
+        order=fieldData.pop('order', None)
+        limit=fieldData.pop('limit', None)
+        offset=fieldData.pop('offset', None)
+        if 'after' in fieldData and 'after' not in cls._fields:
+            after=fieldData.pop('after')
+            if not order:
+                raise ValueError("keyset pagination requires an order")
+            keyset=cls._keysetOrder(order)
+            order=["%s DESC" % c if desc else c for c, desc in keyset]
+            if after is not None:
+                if args and isinstance(args[0], basestring):
+                    raise ValueError("keyset pagination cannot be combined "
+                                     "with a SQL string")
+                args=(cls._afterCondition(conn, keyset, after),)+tuple(args)
+
+        def compile(data):
+            sql, values=cls._processWhere(conn, args, data)
+            query=[cls._baseSelect()]
+            if sql:
+                if _group_pat.match(sql):
+                    query.append(sql)
+                else:
+                    query.extend(['WHERE', sql])
+            return ' '.join(query), values
+
+        if args:
+            # positional arguments can't be compiled into a template
+            sql, values=compile(fieldData)
+        else:
+            sql, values=cls._compiled(conn, 'getSome', fieldData, compile)
+        query=[sql]
+        if [_f for _f in (order, limit, offset) if _f]:
+            query.append(conn.orderByString(order, limit, offset))
+        return ' '.join(query), values
+
+    @classmethod
+    def _keysetOrder(cls, order):
+        """parses an order specification, which must consist of plain
+        column names, each optionally followed by ASC or DESC, into a
+        list of (column, descending) pairs.  If the columns don't
+        include a uniqueness constraint, the columns of the narrowest
+        constraint are added (in the direction of the last), so that
+        the order is total."""
+        if isinstance(order, basestring):
+            items=order.split(',')
+        else:
+            items=[o if isinstance(o, basestring) else ' '.join(o) \
+                   for o in _tupleize(order)]
+        keyset=[]
+        for item in items:
+            parts=item.split()
+            if not (len(parts)==1 or \
+                    (len(parts)==2 and parts[1].upper() in ('ASC', 'DESC'))):
+                raise ValueError("cannot paginate by keyset on %r" % item)
+            keyset.append((parts[0], parts[-1].upper()=='DESC'))
+        names=set(c for c, desc in keyset)
+        constraints=[_tupleize(u) for u in cls._unique]
+        if not [u for u in constraints if names.issuperset(u)]:
+            if not constraints:
+                raise ValueError("cannot paginate by keyset without a unique index")
+            desc=keyset[-1][1] if keyset else False
+            unique=min((len(u), sorted(u)) for u in constraints)[1]
+            keyset.extend((c, desc) for c in unique if c not in names)
+        return keyset
+
+    @staticmethod
+    def _afterCondition(conn, keyset, after):
+        """returns a condition selecting the rows that come after the
+        row with the values in after, in the order given by keyset."""
+        cols=[c for c, desc in keyset]
+        vals=[after[c] for c in cols]
+        if None in vals:
+            raise ValueError("cannot paginate by keyset on null values")
+        descs=set(desc for c, desc in keyset)
+        if len(cols)>1 and len(descs)==1 and conn.row_value_compare:
+            cmp=LT if descs.pop() else GT
+            return cmp(ROW(*[FIELD(c) for c in cols]), ROW(*vals))
+        # (a > x) OR (a = x AND b > y) OR ...
+        terms=[]
+        for i, (c, desc) in enumerate(keyset):
+            cmp=(LT if desc else GT)(FIELD(c), vals[i])
+            terms.append(AND(*[EQ(FIELD(p), v) for p, v in zip(cols[:i], vals[:i])] \
+                             +[cmp]))
+        return OR(*terms)
+
+    @classmethod
+    def _chunkable(cls, fieldData):
+        """whether a query with the keyword arguments of getSome()
+        may be split into several whose results are simply
+        concatenated: not if it is ordered, limited or paginated, or
+        selects anything but plain columns (aggregates, say)."""
+        for k in ('order', 'limit', 'offset', 'after'):
+            if fieldData.get(k) and k not in cls._fields:
+                return False
+        for f in cls._fields.values():
+            if not _column_pat.match(f.name):
+                return False
+        return True
+
+    @staticmethod
+    def _largeIn(conn, args, chunkable, temptable=True):
+        """rewrites a query argument of the form IN(FIELD(x), SET(...))
+        with more values than the driver's large_in_threshold,
+        according to its large_in_strategy (see DBIBase).  Returns a
+        list of argument tuples, one for each query to run (several
+        only for the 'chunk' strategy, which is used only if chunkable
+        is true, and is otherwise replaced by 'temptable'), and a
+        function to call when they have been run, or None.  'split'
+        is used instead of 'temptable' if temptable is false (for the
+        asyncio methods, which can't make one) or the driver can't
+        put the values in one, and 'chunk' instead of 'split' if
+        there are more values than the driver's max_bind_params (in
+        which case, if chunkable is false, ValueError is raised)."""
+        threshold=conn.large_in_threshold
+        if not threshold or not args or isinstance(args[0], basestring):
+            return [args], None
+        for i, arg in enumerate(args):
+            if isinstance(arg, IN) and len(arg)==3 \
+                   and isinstance(arg[1], CONSTANT) and isinstance(arg[2], SET) \
+                   and len(arg[2].values)>threshold:
+                break
+        else:
+            return [args], None
+        field=arg[1]
+        # nulls never match, and the chunks mustn't overlap
+        values=[v for v in arg[2].values if v is not None]
+        try:
+            values=list(OrderedDict.fromkeys(values))
+        except TypeError:
+            pass
+
+        def replace(cond):
+            return tuple(args[:i])+(cond,)+tuple(args[i+1:])
+
+        strategy=conn.large_in_strategy
+        if strategy=='chunk' and not chunkable:
+            strategy='temptable'
+        if strategy=='temptable' and (not temptable or not values
+                                      or conn.tempColumnType(values) is None):
+            # values a temporary table can't hold stay in the query
+            strategy='split'
+        if strategy=='split' and conn.max_bind_params \
+               and len(values)>conn.max_bind_params:
+            if not chunkable:
+                raise ValueError("cannot bind %d values for an IN list in one "
+                                 "statement (the driver's limit is %d), nor "
+                                 "run an ordered, limited or aggregated query "
+                                 "in chunks" % (len(values), conn.max_bind_params))
+            strategy='chunk'
+        if strategy=='array':
+            return [replace(EQ(field, ANY(values)))], None
+        elif strategy=='split':
+            return [replace(OR(*[IN(field, SET(*c)) \
+                                 for c in ichunks(values, threshold)]))], None
+        elif strategy=='chunk':
+            return [replace(IN(field, SET(*c))) \
+                    for c in ichunks(values, threshold)], None
+        elif strategy=='temptable':
+            table=conn.createTempTable(values)
+            return ([replace(IN(field, CONSTANT('(SELECT v FROM %s)' % table)))],
+                    lambda: conn.dropTempTable(table))
+        raise ValueError("unknown large_in_strategy: %r" % strategy)
+
     @classmethod
     def getSome(cls,
                 *args,
@@ -663,29 +1467,234 @@ class PyDO(dict, metaclass=_metapydo):
         If you use SQL directly and pass variables, it is up to
         you to use the same paramstyle as the underlying driver.
 
+        Unless the class has fields of the same names, the keyword
+        argument prefetch names relations to load for all the
+        objects at once (see prefetch()), and if the keyword argument
+        columnar is true, the result is returned by column, as a
+        dictionary of column names and arrays of values (see
+        pydo.columnar), rather than as a list of objects.
+
+        The keyword argument after requests keyset pagination: only
+        rows that come after the object (or dictionary) passed, in the
+        given order, are returned, and the order is made total by
+        adding a uniqueness constraint's columns if necessary.  Pass
+        after=None for the first page.  Unlike offset, the cost of
+        this doesn't grow with the depth of the page.
         """
-        order=fieldData.pop('order', None)
-        limit=fieldData.pop('limit', None)
-        offset=fieldData.pop('offset', None)
-
+        if 'prefetch' in cls._fields:
+            relations=()
+        else:
+            relations=fieldData.pop('prefetch', ())
+        if 'columnar' in cls._fields:
+            columnar=False
+        else:
+            columnar=fieldData.pop('columnar', False)
         conn=cls.getDBI()
-        sql, values=cls._processWhere(conn, args, fieldData)
-        query=[cls._baseSelect()]
-        if sql:
-            if _group_pat.match(sql):
-                query.append(sql)
+        argsets, done=cls._largeIn(conn, args, cls._chunkable(fieldData) \
+                                   and not columnar)
+        try:
+            if columnar:
+                query, values=cls._selectSQL(conn, argsets[0], fieldData)
+                return conn.executeColumns(query, values, caller=cls)
+            results=[]
+            for a in argsets:
+                query, values=cls._selectSQL(conn, a, dict(fieldData))
+                # instances are built directly from the cursor's rows
+                rows=conn.execute(query, values, caller=cls,
+                                  factory=cls._record or cls)
+                if rows and isinstance(rows, (list, tuple)):
+                    results.extend(rows)
+        finally:
+            if done:
+                done()
+        if results:
+            if cls.use_identity_map and not cls._record:
+                objs=[cls._identify(conn, r) for r in results]
             else:
-                query.extend(['WHERE', sql])
-        if [_f for _f in (order, limit, offset) if _f]:
-            query.append(conn.orderByString(order, limit, offset))
-        query=' '.join(query)
-
-        results = conn.execute(query, values)
-        if results and isinstance(results, (list, tuple)):
-            return list(map(cls, results))
+                objs=results
+            if relations:
+                prefetch(objs, *_tupleize(relations))
+            return objs
         else:
             return []
 
+    @classmethod
+    async def agetSome(cls, *args, **fieldData):
+        """coroutine counterpart of getSome(), for classes whose
+        connectionAlias is asynchronous (see pydo.aio).  The prefetch
+        and columnar keyword arguments are not accepted."""
+        adbi=cls.getAsyncDBI()
+        conn=adbi.dialect
+        argsets, done=cls._largeIn(conn, args, cls._chunkable(fieldData), False)
+        results=[]
+        for a in argsets:
+            query, values=cls._selectSQL(conn, a, dict(fieldData))
+            rows=await adbi.execute(query, values, caller=cls,
+                                    factory=cls._record or cls)
+            if rows and isinstance(rows, (list, tuple)):
+                results.extend(rows)
+        return results
+
+    @classmethod
+    def iterSome(cls,
+                 *args,
+                 **fieldData):
+        """ Like getSome(), but returns an iterator that yields the
+        objects one at a time as rows are fetched, rather than a list.
+        Where the driver supports it, a server-side cursor is used, so
+        that very large result sets can be processed in constant
+        memory.  The keyword argument arraysize (by default, the DBI
+        object's arraysize attribute) sets how many rows are fetched
+        from the cursor at a time.
+
+        The cursor remains open until the iterator is exhausted or
+        closed (or garbage collected); with some drivers, the
+        connection can't be used for other queries in the meantime.
+        """
+        arraysize=fieldData.pop('arraysize', None)
+        conn=cls.getDBI()
+        argsets, done=cls._largeIn(conn, args, cls._chunkable(fieldData))
+        try:
+            for a in argsets:
+                query, values=cls._selectSQL(conn, a, dict(fieldData))
+                rows=conn.iterExecute(query, values, arraysize=arraysize,
+                                      caller=cls, factory=cls._record or cls)
+                try:
+                    if cls._record or not cls.use_identity_map:
+                        for row in rows:
+                            yield row
+                    else:
+                        # instances already in the identity map are
+                        # used, but streamed rows aren't added to it,
+                        # which would defeat streaming
+                        for row in rows:
+                            yield cls._identify(conn, row, remember=False)
+                finally:
+                    # release the cursor now if we are abandoned early
+                    rows.close()
+        finally:
+            if done:
+                done()
+
+    @classmethod
+    def iterKeyset(cls, *args, **fieldData):
+        """Like iterSome(), but fetches the rows with a series of
+        keyset-paginated queries (see getSome()), each returning at
+        most chunksize (by default 1000) rows, so no cursor is held
+        open between chunks.  The order defaults to that of the
+        narrowest uniqueness constraint; limit and offset are not
+        accepted."""
+        for page in cls._iterPages(args, fieldData):
+            for obj in page:
+                yield obj
+
+    @classmethod
+    def iterChunks(cls, chunk_size, *args, **fieldData):
+        """Walks the rows matching the query arguments (as for
+        getSome()) in keyset order, by default that of the narrowest
+        uniqueness constraint, and yields them as lists of at most
+        chunk_size objects.  Each chunk is fetched with its own query,
+        so no cursor is held open while the chunks are processed.
+
+        Unless the class has fields of the same names, two more
+        keyword arguments are accepted.  If commit is true, the
+        transaction is committed after each chunk is processed (that
+        is, when the next one is requested), so a batch job needn't
+        hold a transaction open over a whole table.  If threads is
+        greater than zero, up to that many chunks are fetched ahead
+        concurrently by worker threads, each using its own connection
+        (from the connection alias's pool, if it has one); the chunk
+        boundaries are found first by querying the ordering columns
+        alone.  Either way, chunks are yielded in order.
+        """
+        commit=False if 'commit' in cls._fields else fieldData.pop('commit', False)
+        threads=0 if 'threads' in cls._fields else fieldData.pop('threads', 0)
+        fieldData['chunksize']=chunk_size
+        if threads:
+            pages=cls._iterPagesAhead(args, fieldData, threads)
+        else:
+            pages=cls._iterPages(args, fieldData)
+        try:
+            for page in pages:
+                yield page
+                if commit:
+                    cls.commit()
+        finally:
+            pages.close()
+
+    @classmethod
+    def _pageArgs(cls, fieldData):
+        """pops the chunk size and order from the keyword arguments of
+        iterKeyset() or iterChunks(), returning the chunk size and
+        total order to paginate by."""
+        chunksize=fieldData.pop('chunksize', 1000)
+        if 'limit' in fieldData or 'offset' in fieldData:
+            raise ValueError("limit and offset cannot be used with keyset pagination")
+        order=fieldData.pop('order', None) or ()
+        keyset=cls._keysetOrder(order)
+        return chunksize, ["%s DESC" % c if desc else c for c, desc in keyset]
+
+    @classmethod
+    def _iterPagesAhead(cls, args, fieldData, threads):
+        """like _iterPages(), but fetches up to threads pages ahead in
+        a pool of worker threads."""
+        chunksize, order=cls._pageArgs(fieldData)
+        # the first row of each page after the first is found by
+        # skipping over a page's worth of the ordering columns
+        keys=cls.project(*[o.split()[0] for o in order])
+
+        def fetch(after):
+            try:
+                return cls.getSome(*args, **dict(fieldData,
+                                                 order=order,
+                                                 after=after,
+                                                 limit=chunksize))
+            finally:
+                # give the worker's connection back
+                cls.getDBI().endConnection()
+
+        executor=ThreadPoolExecutor(threads)
+        futures=deque()
+        try:
+            after=None
+            more=True
+            while futures or more:
+                while more and len(futures)<threads:
+                    futures.append(executor.submit(fetch, after))
+                    last=keys.getSome(*args, **dict(fieldData,
+                                                    order=order,
+                                                    after=after,
+                                                    limit=1,
+                                                    offset=chunksize-1))
+                    if last:
+                        after=last[0]
+                    else:
+                        more=False
+                page=futures.popleft().result()
+                if page:
+                    yield page
+        finally:
+            for f in futures:
+                f.cancel()
+            executor.shutdown(wait=True)
+
+    @classmethod
+    def _iterPages(cls, args, fieldData):
+        """yields successive keyset-paginated lists of objects, for
+        iterKeyset()."""
+        chunksize, order=cls._pageArgs(fieldData)
+        after=None
+        while True:
+            page=cls.getSome(*args, **dict(fieldData,
+                                           order=order,
+                                           after=after,
+                                           limit=chunksize))
+            if page:
+                yield page
+            if len(page)<chunksize:
+                break
+            after=page[-1]
+
     @classmethod
     def getCount(cls, *args, **fieldData):
         """ Retrieve the number of object of this particular class,
@@ -705,11 +1714,121 @@ class PyDO(dict, metaclass=_metapydo):
         if not cls.mutable:
             raise ValueError("cannot deleteSome through an immutable class")
         conn=cls.getDBI()
-        sql, values=cls._processWhere(conn, args, fieldData)
-        query=["DELETE FROM %s" % cls.getTable()]
-        if sql:
-            query.extend(['WHERE', sql])
-        return conn.execute(' '.join(query), values)
+        if cls.use_identity_map:
+            conn.getIdentityMap().pop(cls.getTable(), None)
+        argsets, done=cls._largeIn(conn, args, True)
+        try:
+            counts=[]
+            for a in argsets:
+                sql, values=cls._processWhere(conn, a, dict(fieldData))
+                query=["DELETE FROM %s" % cls.getTable()]
+                if sql:
+                    query.extend(['WHERE', sql])
+                counts.append(conn.execute(' '.join(query), values, caller=cls))
+        finally:
+            if done:
+                done()
+        return _sumCounts(counts)
+
+    @classmethod
+    def _narrowestUnique(cls, data):
+        """returns the columns of the narrowest uniqueness constraint
+        for which data has non-null values, or None if there isn't
+        one."""
+        candidates=[]
+        for unique in cls._unique:
+            if isinstance(unique, basestring):
+                unique=(unique,)
+            else:
+                unique=tuple(sorted(unique))
+            key=tuple(data.get(u) for u in unique)
+            if None not in key and NULL not in key:
+                candidates.append((len(unique), unique))
+        if candidates:
+            return min(candidates)[1]
+
+    @classmethod
+    def _groupByUnique(cls, objects):
+        """returns a list of (fields, keys) pairs grouping the unique
+        keys of objects (instances of the class) by the unique fields
+        that identify them.  For each object the narrowest uniqueness
+        constraint for which it has non-null values is used, so that
+        single-column keys can be matched with IN."""
+        groups={}
+        for obj in objects:
+            if not obj.mutable:
+                raise ValueError("instance isn't mutable!")
+            unique=obj._narrowestUnique(obj)
+            if unique is None:
+                raise ValueError('No way to get unique row! %s' % obj)
+            groups.setdefault(unique, []).append(tuple(obj[u] for u in unique))
+        # drop duplicates, keeping order
+        result=[]
+        for fields, keys in groups.items():
+            seen=set()
+            result.append((fields, [k for k in keys \
+                                    if not (k in seen or seen.add(k))]))
+        return result
+
+    @classmethod
+    def deleteMany(cls, objects):
+        """deletes the rows represented by many instances of the class,
+        with as few statements as the driver's limit on bind variables
+        permits, and returns the number of rows deleted (-1 if the
+        driver can't tell).  The instances become immutable, as with
+        delete()."""
+        if not cls.mutable:
+            raise ValueError("cannot deleteMany through an immutable class")
+        objects=list(objects)
+        conn=cls.getDBI()
+        counts=[]
+        for fields, keys in cls._groupByUnique(objects):
+            for cond in _keyConditions(conn, fields, keys):
+                where, values=cls._processWhere(conn, (cond,), {})
+                counts.append(conn.execute("DELETE FROM %s WHERE %s" \
+                                           % (cls.getTable(), where),
+                                           values,
+                                           caller=cls))
+        for obj in objects:
+            if obj.use_identity_map:
+                obj._forget(conn)
+            obj.mutable=False
+        return _sumCounts(counts)
+
+    @classmethod
+    def updateMany(cls, objects, adict):
+        """updates the rows represented by many instances of the class
+        with the same values, with as few statements as the driver's
+        limit on bind variables permits, and returns the number of rows
+        updated (-1 if the driver can't tell).  The instances are
+        updated too; as with updateSome(), onUpdate() is not called."""
+        if not cls.mutable:
+            raise ValueError("class isn't mutable!")
+        objects=list(objects)
+        if not (adict and objects):
+            return 0
+        cls._validateFields(adict)
+        conn=cls.getDBI()
+        counts=[]
+        for fields, keys in cls._groupByUnique(objects):
+            for cond in _keyConditions(conn, fields, keys):
+                converter=conn.getConverter()
+                sets=', '.join(["%s = %s" % (x, converter(y)) \
+                                for x, y in adict.items()])
+                where, values=cls._processWhere(conn, (cond,), {}, converter)
+                counts.append(conn.execute("UPDATE %s SET %s WHERE %s" \
+                                           % (cls.getTable(), sets, where),
+                                           values,
+                                           caller=cls))
+        unwrapped=dict((k, unwrap(v)) for k, v in adict.items())
+        for obj in objects:
+            if obj.use_identity_map:
+                obj._forget(conn)
+            super(PyDO, obj).update(unwrapped)
+            obj.__dict__.pop('_prefetched', None)
+            if obj.use_identity_map:
+                obj._identify(conn, obj, True)
+        return _sumCounts(counts)
 
     def delete(self):
         """remove the row that represents me in the database"""
@@ -725,7 +1844,9 @@ class PyDO(dict, metaclass=_metapydo):
         # object
         assert unique
         sql = 'DELETE FROM %s WHERE %s' % (self.getTable(), unique)
-        conn.execute(sql, values)
+        conn.execute(sql, values, caller=self.__class__)
+        if self.use_identity_map:
+            self._forget(conn)
         # shadow the class attribute with an instance attribute
         self.mutable = False
 
@@ -733,12 +1854,14 @@ class PyDO(dict, metaclass=_metapydo):
         """refetch myself from the database"""
         if not self._unique:
             raise ValueError("cannot refresh without a unique index")
-        obj = self.getUnique(**self)
+        # bypass the identity map, which may well contain self
+        obj = self._fetchUnique(self.getDBI(), self)
         if not obj:
             raise ValueError("current object doesn't exist in database!")
         # the ordinary dict update needs to be called here, not the
         # overloaded method that updates the database!
         super(PyDO, self).update(obj)
+        self.__dict__.pop('_prefetched', None)
 
 
     def joinTable(self,
@@ -796,9 +1919,9 @@ class PyDO(dict, metaclass=_metapydo):
                                        order,
                                        limit,
                                        offset)
-        results = conn.execute(sql, vals)
+        results = conn.execute(sql, vals, caller=thatObject, factory=thatObject)
         if results and isinstance(results, (list, tuple)):
-            return list(map(thatObject, results))
+            return results
         return []
 
     def _joinTableSQL(self,
@@ -868,12 +1991,19 @@ def autoschema(alias, schema=None, guesscache=True, module=None, sequence_mapper
     """
     ns={}
     db=getConnection(alias)
+    # the first class not found in the guess cache describes them all
+    described={}
+    def _describeTable(cls):
+        if not described:
+            described.update(db.describeSchema(schema, sequence_mapper))
+        return described[cls.table]
     for table in db.listTables(schema):
         d=dict(guesscache=guesscache,
                guess_columns=True,
                connectionAlias=alias,
                schema=schema,
-               table=table)
+               table=table,
+               _describeTable=classmethod(_describeTable))
         if sequence_mapper:
             d['sequence_mapper'] = sequence_mapper
         Table=table.capitalize()
@@ -940,10 +2070,30 @@ class ForeignKey(object):
     kls=property(kls())
 
     def __get__(self, obj, type_):
+        if obj is None:
+            return self
+        prefetched=obj.__dict__.get('_prefetched')
+        if prefetched and self in prefetched:
+            return prefetched[self]
         d=dict((x, obj[y]) for x, y in zip(self.that_side, self.this_side))
         if not every(None, iter(d.values())):
             return self.kls.getUnique(**d)
 
+    def _prefetch(self, objects):
+        """fetches the related objects for all of objects at once,
+        for prefetch()."""
+        keys=set()
+        for obj in objects:
+            key=tuple(obj[y] for y in self.this_side)
+            if None not in key:
+                keys.add(key)
+        related=_fetchByKeys(self.kls, self.that_side, keys)
+        for obj in objects:
+            key=tuple(obj[y] for y in self.this_side)
+            if None not in key:
+                rel=related.get(key)
+                obj.__dict__.setdefault('_prefetched', {})[self]=rel and rel[0]
+
     def __set__(self, obj, value):
         if value in (None, NULL):
             obj.update(dict((f, None) for f in self.this_side))
@@ -975,6 +2125,10 @@ def OneToMany(this_side, that_side, kls):
 
 
     def getMany(self, *args, **kwargs):
+        if not (args or kwargs):
+            prefetched=self.__dict__.get('_prefetched')
+            if prefetched and getMany in prefetched:
+                return list(prefetched[getMany])
         if isinstance(kls, basestring):
             # resolve it to a class
             realkls=string_to_obj(kls)
@@ -1004,6 +2158,21 @@ def OneToMany(this_side, that_side, kls):
 
         else:
             return realkls.getSome(*(tuple(eq)+args), **kwargs)
+
+    def _prefetch(objects):
+        if isinstance(kls, basestring):
+            realkls=string_to_obj(kls)
+        else:
+            realkls=kls
+        keys=set(tuple(obj[y] for y in this_side) for obj in objects)
+        related=_fetchByKeys(realkls,
+                             that_side,
+                             [k for k in keys if None not in k])
+        for obj in objects:
+            key=tuple(obj[y] for y in this_side)
+            obj.__dict__.setdefault('_prefetched', {})[getMany]=related.get(key, [])
+
+    getMany._prefetch=_prefetch
     return getMany
 
 def ManyToMany(this_side,
@@ -1033,4 +2202,70 @@ def ManyToMany(this_side,
 
 
 
-__all__=['PyDO', 'autoschema', 'ForeignKey', 'OneToMany', 'ManyToMany']
+def _sumCounts(counts):
+    """totals the row counts of several statements, which is -1
+    if any is unknown"""
+    if len(counts)==1:
+        return counts[0]
+    if [c for c in counts if not isinstance(c, int) or c<0]:
+        return -1
+    return sum(counts)
+
+def _keyConditions(conn, fields, keys):
+    """yields conditions that together match the rows whose values
+    for fields are any of keys (tuples of values), each with no more
+    bind variables than the driver permits.  Single-column keys use
+    IN; multi-column keys use a row value IN where the database
+    supports it, and otherwise an OR of ANDs."""
+    chunksize=max(1, (conn.max_bind_params or 1000) // len(fields))
+    for chunk in ichunks(keys, chunksize):
+        if len(fields)==1:
+            yield IN(FIELD(fields[0]), SET(*[k[0] for k in chunk]))
+        elif conn.row_value_in:
+            yield IN(ROW(*[FIELD(f) for f in fields]),
+                     SET(*[ROW(*k) for k in chunk]))
+        else:
+            yield OR(*[AND(*[EQ(FIELD(f), v) for f, v in zip(fields, k)]) \
+                       for k in chunk])
+
+def _fetchByKeys(kls, fields, keys):
+    """fetches the instances of kls whose values for fields match
+    any of keys (tuples of values), with as few queries as the
+    driver's limit on bind variables permits, and returns a
+    dictionary mapping each key to a list of the matching
+    instances."""
+    result={}
+    if not keys:
+        return result
+    for where in _keyConditions(kls.getDBI(), fields, sorted(keys)):
+        for obj in kls.getSome(where):
+            result.setdefault(tuple(obj[f] for f in fields), []).append(obj)
+    return result
+
+def prefetch(objects, *relations):
+    """eagerly loads relations for a list of PyDO instances, so that
+    accessing them does not query the database for each instance.
+    Each relation is the name of a ForeignKey attribute or OneToMany
+    accessor of the instances' class; one query is performed per
+    relation (or, for very many instances, per chunk of keys).
+    Calling a prefetched OneToMany accessor with no arguments returns
+    the prefetched list; with arguments, it queries as usual.
+    Prefetched relations are discarded when the instance is updated
+    or refreshed.
+    """
+    byclass={}
+    for obj in objects:
+        byclass.setdefault(obj.__class__, []).append(obj)
+    for kls, objs in byclass.items():
+        for name in relations:
+            relation=getattr(kls, name, None)
+            loader=getattr(relation, '_prefetch', None)
+            if loader is None:
+                raise ValueError("%s is not a relation of %s" \
+                      % (name, kls.__name__))
+            loader(objs)
+    return objects
+
+
+__all__=['PyDO', 'autoschema', 'ForeignKey', 'OneToMany', 'ManyToMany',
+         'prefetch', 'Record']
@@ -0,0 +1,108 @@
+"""
+support for returning query results by column rather than by row.
+
+A columnar result is a dictionary mapping each column name to an
+array of that column's values.  If NumPy is installed the arrays are
+NumPy arrays; otherwise they are array.array instances for numeric
+columns and lists for everything else.  Rows are consumed from the
+cursor a batch at a time and distributed directly into per-column
+buffers, so no per-row dictionaries or PyDO instances are created.
+"""
+
+from array import array
+import datetime
+import sys
+if sys.version_info[0] == 3:
+    long=int
+
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+# the kinds of column inferred from a cursor description
+NUMBER='number'
+STRING='string'
+DATETIME='datetime'
+
+def columnKinds(description, dbapiModule):
+    """returns a list with the kind of each column in a cursor
+    description (NUMBER, STRING, DATETIME, or None if unknown),
+    according to the DBAPI module's type objects."""
+    kinds=[]
+    for d in description:
+        type_code=d[1]
+        kind=None
+        if type_code is not None:
+            for k, name in ((NUMBER, 'NUMBER'),
+                            (STRING, 'STRING'),
+                            (DATETIME, 'DATETIME')):
+                typeobj=getattr(dbapiModule, name, None)
+                try:
+                    if typeobj is not None and type_code==typeobj:
+                        kind=k
+                        break
+                except Exception:
+                    # some drivers' type objects don't compare kindly
+                    pass
+        kinds.append(kind)
+    return kinds
+
+def _isint(v):
+    return isinstance(v, (int, long)) and not isinstance(v, bool)
+
+def _isnumber(v):
+    return _isint(v) or isinstance(v, float)
+
+def _toArray(values, kind):
+    """converts a list of column values to an array, choosing the
+    element type from the column kind and the values themselves.
+    Integer columns without nulls become 64-bit integer arrays;
+    other numeric columns become double arrays, with nulls as NaN."""
+    if kind in (None, NUMBER):
+        nonnull=[v for v in values if v is not None]
+        if nonnull and len(nonnull)==len(values) and all(map(_isint, nonnull)):
+            try:
+                if numpy is not None:
+                    return numpy.array(values, dtype=numpy.int64)
+                return array('q', values)
+            except OverflowError:
+                pass
+        elif nonnull and all(map(_isnumber, nonnull)):
+            nan=float('nan')
+            values=[nan if v is None else float(v) for v in values]
+            if numpy is not None:
+                return numpy.array(values, dtype=numpy.float64)
+            return array('d', values)
+    if numpy is None:
+        return values
+    if kind in (None, DATETIME) and values \
+           and all(isinstance(v, datetime.datetime) for v in values):
+        return numpy.array(values, dtype='datetime64[us]')
+    arr=numpy.empty(len(values), dtype=object)
+    arr[:]=values
+    return arr
+
+def collect(batches):
+    """distributes the rows in an iterable of lists of row tuples
+    into a list of per-column lists, which is None if there are no
+    rows."""
+    buffers=None
+    for rows in batches:
+        if buffers is None:
+            buffers=[[] for x in rows[0]]
+        for buf, col in zip(buffers, zip(*rows)):
+            buf.extend(col)
+    return buffers
+
+def toColumns(names, kinds, buffers):
+    """builds a columnar result from column names, their kinds (as
+    returned by columnKinds()), and per-column lists of values (as
+    returned by collect(), or None for no rows)."""
+    if buffers is None:
+        buffers=[[] for n in names]
+    return dict((name, _toArray(buf, kind)) \
+                for name, buf, kind in zip(names, buffers, kinds))
+
+
+__all__=[]
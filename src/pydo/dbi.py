@@ -3,13 +3,15 @@ if sys.version_info[0] == 2:
     from itertools import izip as zip
 else:
     basestring=str
-from threading import Lock, local
+from threading import Lock, Condition, local
+from itertools import count
 from collections import deque
 import time
 from pydo.log import *
 from pydo.operators import BindingConverter
 from pydo.exceptions import PyDOError
-from pydo.utils import _strip_tablename, _import_a_class
+from pydo.utils import _strip_tablename, _import_a_class, LRUCache
+from pydo import columnar
 
 exception_names=('DataError',
                  'DatabaseError',
@@ -21,6 +23,69 @@ exception_names=('DataError',
                  'OperationalError',
                  'ProgrammingError')
 
+# callables notified of every query; see addQueryHook()
+_query_hooks=[]
+
+# column names for cursor descriptions already seen; see DBIBase._fieldNames()
+_fieldnames_cache={}
+_fieldnames_cache_size=1000
+
+# numbers for the names of temporary tables; see DBIBase.createTempTable()
+_temp_tables=count(1)
+
+def addQueryHook(hook):
+    """registers a callable to be notified of every query executed
+    by any DBI object.  It is called as hook(phase, info), where phase
+    is 'before' (just before the query is executed), 'after' (when
+    its results have been fetched), or 'error' (if it failed), and
+    info is a dictionary with the keys:
+
+    * dbi: the DBI object
+    * sql: the SQL executed
+    * binds: the number of bind variables
+    * caller: the PyDO class on whose behalf the query is executed,
+      if known
+    * start: the time the query was started
+
+    and, after the query, also:
+
+    * elapsed: the time taken, in seconds, including fetching
+    * rowcount: the number of rows affected or fetched
+    * rows: the number of rows fetched
+    * error: the exception raised (for the 'error' phase)
+
+    For executemany(), info also has 'batch', the number of sets of
+    bind values.  The same dictionary is passed for all the phases of
+    a query, so hooks may store their own data in it.  Exceptions
+    raised by hooks are logged and otherwise ignored.
+    """
+    _query_hooks.append(hook)
+
+def removeQueryHook(hook):
+    """unregisters a hook added with addQueryHook()"""
+    _query_hooks.remove(hook)
+
+
+class SlowQueryLogger(object):
+    """a query hook that logs queries that take at least threshold
+    seconds, e.g.:
+
+    >>> addQueryHook(SlowQueryLogger(0.5))
+    """
+    def __init__(self, threshold, log=warn):
+        self.threshold=threshold
+        self.log=log
+
+    def __call__(self, phase, info):
+        if phase=='after' and info['elapsed']>=self.threshold:
+            caller=info['caller']
+            self.log("slow query (%.3f seconds, %d rows%s): %s",
+                     info['elapsed'],
+                     info['rowcount'],
+                     caller and ', for %s' % caller.__name__ or '',
+                     info['sql'])
+
+
 class DBIBase(object):
     """base class for db connection wrappers.
     """
@@ -30,6 +95,39 @@ class DBIBase(object):
     auto_increment=False
     # should we pay attention to rowcount by default?
     has_sane_rowcount=True
+    # number of rows fetched at a time when streaming a result set
+    arraysize=1000
+    # the maximum number of bind variables the driver permits in one
+    # statement (None means no practical limit)
+    max_bind_params=None
+    # whether bulk inserts should be sent as multi-row INSERT
+    # statements rather than with executemany()
+    multirow_insert=False
+    # whether the database accepts row values in IN lists, as in
+    # "(a, b) IN ((1, 2), (3, 4))"
+    row_value_in=False
+    # whether the database compares row values, as in "(a, b) > (1, 2)"
+    row_value_compare=False
+    # the maximum number of prepared statements to keep per
+    # connection, for drivers that can prepare statements (0 leaves
+    # it to the driver's default, if any)
+    prepare_cache_size=0
+    # the keyword argument to the DBAPI connect function, if any,
+    # that sets the size of its own statement cache
+    prepare_connect_arg=None
+    # IN lists of more values than this (None means no limit) are
+    # handled according to large_in_strategy: 'chunk' runs a query
+    # for each chunk of this many values and merges the results,
+    # 'split' ORs together IN lists of at most this many values,
+    # 'array' binds the values as a single array (= ANY(...)), and
+    # 'temptable' loads them into a temporary table and selects from
+    # it in a subquery
+    large_in_threshold=None
+    large_in_strategy='chunk'
+    # the statement that creates a temporary table, given its name
+    # and column definitions, and the prefix for the names used
+    temp_table_create='CREATE TEMPORARY TABLE %s (%s)'
+    temp_table_prefix='pydo_in_'
 
     def __init__(self,
                  connectArgs,
@@ -71,10 +169,12 @@ class DBIBase(object):
 
         def fset(self, c):
             self._local.connection=c
+            self._local.__dict__.pop('prepared', None)
 
         def fdel(self):
             c=self._local.connection
             del self._local.connection
+            self._local.__dict__.pop('prepared', None)
             c.close()
 
         return fget, fset, fdel, "the underlying db connection"
@@ -82,76 +182,391 @@ class DBIBase(object):
 
     def swapConnection(self, connection):
         """switch the connection in use for the current thread with another one."""
+        # pending changes belong to the old connection's transaction
+        self.flush()
         c=self._local.__dict__.get('connection')
-        self._local.connection=connection
+        self.conn=connection
+        self.clearIdentityMap()
         return c
 
     def endConnection(self):
         """ disassociate from the current connection, which may be
         deleted or returned to a pool."""
+        self._discardPending()
+        self.clearIdentityMap()
         del self.conn
 
     def commit(self):
         """commits a transaction"""
+        self.flush()
         self.conn.commit()
+        self.clearIdentityMap()
         if self.pool:
             # release connection
             del self.conn
 
     def rollback(self):
         """rolls back a transaction"""
+        self._discardPending()
         self.conn.rollback()
+        self.clearIdentityMap()
         if self.pool:
             # release connection
             del self.conn
 
+    def addPending(self, obj):
+        """registers an object with changes to be written by flush().
+        The object must have a _flushKey() method, returning a key
+        such that objects with equal keys can be written together, and
+        a _flushMany(dbi, objs) method that writes a list of such
+        objects, and a _pending attribute, deleted when its changes
+        are written or discarded.  This is used by PyDO classes that
+        declare write_behind."""
+        self._local.__dict__.setdefault('pending', {})[id(obj)]=obj
+
+    def flush(self):
+        """writes the pending changes of objects registered with
+        addPending() in the current thread, grouping those that can
+        be written together.  This happens automatically before a
+        commit and before any other query is executed."""
+        # taken out of the registry, or the queries would flush again
+        pending=self._local.__dict__.pop('pending', None)
+        if not pending:
+            return
+        groups={}
+        for obj in pending.values():
+            groups.setdefault(obj._flushKey(), []).append(obj)
+        groups=list(groups.values())
+        try:
+            while groups:
+                groups[0][0]._flushMany(self, groups[0])
+                del groups[0]
+        finally:
+            if groups:
+                # the changes of the group that failed are lost with
+                # its statement; the rest stay pending, for rollback()
+                # to discard
+                for obj in groups[0]:
+                    obj.__dict__.pop('_pending', None)
+                for objs in groups[1:]:
+                    for obj in objs:
+                        self.addPending(obj)
+
+    def _discardPending(self):
+        pending=self._local.__dict__.pop('pending', None)
+        if pending:
+            for obj in pending.values():
+                obj.__dict__.pop('_pending', None)
+
+    def getIdentityMap(self):
+        """returns the identity map for the current thread's
+        transaction, a dictionary mapping table names to dictionaries
+        of objects keyed by the values of their uniqueness
+        constraints.  It is used by PyDO classes that declare
+        use_identity_map, and is cleared when the transaction ends."""
+        try:
+            return self._local.identity_map
+        except AttributeError:
+            m=self._local.identity_map={}
+            return m
+
+    def clearIdentityMap(self):
+        """discards the identity map for the current thread."""
+        self._local.__dict__.pop('identity_map', None)
+
     def cursor(self):
         """returns a database cursor for direct access to the db connection"""
         return self.conn.cursor()
 
+    def serverCursor(self):
+        """returns a cursor suitable for streaming a large result set.
+        By default this is an ordinary cursor; drivers that support
+        server-side cursors override this so that the result set isn't
+        transferred to the client all at once."""
+        return self.conn.cursor()
+
     def _connect(self):
+        connectArgs=self.connectArgs
+        arg=self.prepare_connect_arg
+        if self.prepare_cache_size and arg and isinstance(connectArgs, dict) \
+               and arg not in connectArgs:
+            connectArgs=dict(connectArgs)
+            connectArgs[arg]=self.prepare_cache_size
         if self.pool:
-            return self.pool.connect(self.connectFunc, self.connectArgs, self.initFunc)
+            return self.pool.connect(self.connectFunc, connectArgs, self.initFunc)
+        else:
+            return _real_connect(self.connectFunc, connectArgs, self.initFunc)
+
+    def getPreparedCache(self):
+        """returns the cache of statements prepared on the current
+        connection, keyed by SQL text, which holds at most
+        prepare_cache_size statements.  It belongs to the underlying
+        connection: a pooled connection keeps it while in the pool,
+        and it is discarded with the connection."""
+        conn=self.conn
+        if isinstance(conn, ConnectionWrapper) and conn._entry is not None:
+            holder=conn._entry
+        else:
+            holder=self._local
+        cache=getattr(holder, 'prepared', None)
+        if cache is None:
+            cache=holder.prepared=LRUCache(self.prepare_cache_size)
         else:
-            return _real_connect(self.connectFunc, self.connectArgs, self.initFunc)
+            # in case it has been changed
+            cache.maxsize=self.prepare_cache_size
+        return cache
+
+    def _executeCursor(self, cursor, sql, values, many=False):
+        """internal method that executes sql on a cursor, with the
+        bind values if there are any (or, if many is true, once for
+        each set of values in a list).  Drivers that prepare
+        statements explicitly override this."""
+        if many:
+            cursor.executemany(sql, values)
+        elif values:
+            cursor.execute(sql, values)
+        else:
+            # I don't want to assume that all drivers will like None,
+            # or (), or {}, equally when there are no bind variables
+            cursor.execute(sql)
 
     def getConverter(self):
         """returns a converter instance."""
         return BindingConverter(self.paramstyle)
 
-    def execute(self, sql, values=(), qualified=False):
-        """Executes the statement with the values and does conversion
-        of the return result as necessary.
-        result is list of dictionaries, or number of rows affected"""
+    def _startQuery(self, sql, values, caller, **extra):
+        """internal method called before executing a query; logs it
+        if verbose and notifies any query hooks.  Returns the info
+        dictionary to pass to _endQuery(), or None if there are no
+        hooks."""
+        if 'pending' in self._local.__dict__:
+            # write deferred changes first, so the query sees them
+            self.flush()
         if self.verbose:
             debug("SQL: %s", sql)
             debug("bind variables: %s", values)
+        if not _query_hooks:
+            return None
+        info=dict(dbi=self,
+                  sql=sql,
+                  binds=values and len(values) or 0,
+                  caller=caller,
+                  start=time.time())
+        info.update(extra)
+        _notifyQueryHooks('before', info)
+        return info
 
-        c=self.conn.cursor()
-        if values:
-            c.execute(sql, values)
+    def _endQuery(self, info, rowcount=-1, rows=0, error=None):
+        """internal method called when a query started with
+        _startQuery() has finished, or failed with error."""
+        if info is None:
+            return
+        info.update(elapsed=time.time()-info['start'],
+                    rowcount=rowcount,
+                    rows=rows)
+        if error is None:
+            _notifyQueryHooks('after', info)
         else:
-            # I don't want to assume that all drivers will like None,
-            # or (), or {}, equally when there are no bind variables
-            c.execute(sql)
-        resultset=c.fetchall()
+            info['error']=error
+            _notifyQueryHooks('error', info)
+
+    def execute(self, sql, values=(), qualified=False, caller=None,
+                factory=dict, columnar=False):
+        """Executes the statement with the values and does conversion
+        of the return result as necessary.
+        result is list of dictionaries, or number of rows affected.
+        caller is the PyDO class on whose behalf the query is
+        executed, if any, for the benefit of query hooks.  factory is
+        called with an iterable of (column name, value) pairs to make
+        each row; a PyDO class can be passed to construct instances
+        directly from the cursor's rows.  If columnar is true, the
+        result is as for executeColumns()."""
+        if columnar:
+            return self.executeColumns(sql, values, qualified, caller=caller)
+        info=self._startQuery(sql, values, caller)
+        c=self.conn.cursor()
+        try:
+            self._executeCursor(c, sql, values)
+            resultset=self._fetchResult(c)
+        except Exception as e:
+            self._endQuery(info, error=e)
+            raise
         if not resultset:
-            return c.rowcount
-        res=self._convertResultSet(c.description, resultset, qualified)
+            rowcount=self._rowcount(c)
+            self._endQuery(info, rowcount)
+            return rowcount
+        self._endQuery(info, len(resultset), len(resultset))
+        res=self._convertResultSet(c.description, resultset, qualified, factory)
         c.close()
         #if self.autocommit and self.pool:
         #    # release connection
         #    del self.conn
         return res
 
+    def executeColumns(self, sql, values=(), qualified=False, arraysize=None,
+                       caller=None, names=None):
+        """Executes a query and returns the result by column: a
+        dictionary mapping each column name to an array of its values
+        (see pydo.columnar), built from batches of arraysize rows
+        fetched from a server-side cursor (where the driver supports
+        it), without making a dictionary per row.  names, if given,
+        are used as the column names instead of those in the cursor
+        description."""
+        info=self._startQuery(sql, values, caller)
+        numrows=0
+        c=self.serverCursor()
+        try:
+            try:
+                if values:
+                    c.execute(sql, values)
+                else:
+                    c.execute(sql)
+                buffers=columnar.collect(self._fetchBatches(c, arraysize))
+            except Exception as e:
+                self._endQuery(info, error=e)
+                raise
+            # some server-side cursors only have a description after
+            # the first fetch
+            if c.description is None:
+                rowcount=self._rowcount(c)
+                self._endQuery(info, rowcount)
+                return rowcount
+            if buffers:
+                numrows=len(buffers[0])
+            self._endQuery(info, numrows, numrows)
+            if names is None:
+                names=self._fieldNames(c.description, qualified)
+            kinds=columnar.columnKinds(c.description, self.dbapiModule)
+        finally:
+            c.close()
+        return columnar.toColumns(names, kinds, buffers)
+
+    def _fetchResult(self, cursor):
+        """internal method that returns the rows resulting from an
+        executed statement, or None if it doesn't return any."""
+        return cursor.fetchall()
+
+    def _rowcount(self, cursor):
+        """internal method that returns the number of rows affected
+        by an executed statement that returned no rows."""
+        return cursor.rowcount
+
+    def iterBatches(self, sql, values=(), arraysize=None, caller=None,
+                    server=True):
+        """Executes a query on a server-side cursor (where the driver
+        supports it, unless server is false) and yields (description,
+        rows) pairs, where rows is a list of up to arraysize rows, as
+        tuples, and description is the cursor description.  The
+        cursor is closed when the result set is exhausted, or when the
+        generator is closed or garbage collected, at which point query
+        hooks are notified."""
+        info=self._startQuery(sql, values, caller)
+        numrows=0
+        error=None
+        if server:
+            c=self.serverCursor()
+        else:
+            c=self.cursor()
+        try:
+            try:
+                if values:
+                    c.execute(sql, values)
+                else:
+                    c.execute(sql)
+                for rows in self._fetchBatches(c, arraysize):
+                    numrows+=len(rows)
+                    # some server-side cursors only have a
+                    # description after the first fetch
+                    yield c.description, rows
+            except Exception as e:
+                error=e
+                raise
+        finally:
+            c.close()
+            if self.verbose:
+                debug('fetched %d rows', numrows)
+            self._endQuery(info, numrows, numrows, error)
+
+    def iterExecute(self, sql, values=(), qualified=False, arraysize=None,
+                    caller=None, factory=dict):
+        """Executes a query and yields the result rows as
+        dictionaries (or whatever factory makes of them, as for
+        execute()), fetching them from a server-side cursor (where
+        the driver supports it) arraysize rows at a time rather than
+        materializing the whole result set.  The cursor is closed when
+        the result set is exhausted, or when the generator is closed
+        or garbage collected."""
+        batches=self.iterBatches(sql, values, arraysize, caller)
+        try:
+            fldnames=None
+            for description, rows in batches:
+                if fldnames is None:
+                    fldnames=self._fieldNames(description, qualified)
+                for row in rows:
+                    yield factory(zip(fldnames, row))
+        finally:
+            batches.close()
+
+    def _fetchBatches(self, cursor, arraysize=None):
+        """internal generator that yields lists of rows fetched from
+        an executed cursor, arraysize rows at a time."""
+        if not arraysize:
+            arraysize=self.arraysize
+        while 1:
+            rows=cursor.fetchmany(arraysize)
+            if not rows:
+                break
+            yield rows
+
+    def executemany(self, sql, valuelist, caller=None):
+        """Executes a statement once for each set of bind values in
+        valuelist and returns the number of rows affected, or -1 if
+        the driver can't tell."""
+        extra={}
+        if _query_hooks:
+            valuelist=list(valuelist)
+            extra=dict(binds=valuelist and len(valuelist[0]) or 0,
+                       batch=len(valuelist))
+        info=self._startQuery(sql, valuelist, caller, **extra)
+        c=self.conn.cursor()
+        try:
+            try:
+                self._executeCursor(c, sql, valuelist, True)
+            except Exception as e:
+                self._endQuery(info, error=e)
+                raise
+            self._endQuery(info, c.rowcount)
+            return c.rowcount
+        finally:
+            c.close()
+
     @staticmethod
-    def _convertResultSet(description, resultset, qualified=False):
-        """internal function that turns a result set into a list of dictionaries."""
+    def _fieldNames(description, qualified=False):
+        """internal function that returns the column names of a cursor
+        description.  They are remembered for each distinct set of
+        columns, so that table names are stripped once per query
+        rather than per call."""
+        key=(tuple(x[0] for x in description), qualified)
+        try:
+            return _fieldnames_cache[key]
+        except KeyError:
+            pass
         if qualified:
-            fldnames=[x[0] for x in description]
+            names=key[0]
         else:
-            fldnames=[_strip_tablename(x[0]) for x in description]
-        return [dict(zip(fldnames, row)) for row in resultset]
+            names=tuple(_strip_tablename(x) for x in key[0])
+        if len(_fieldnames_cache)>=_fieldnames_cache_size:
+            _fieldnames_cache.clear()
+        _fieldnames_cache[key]=names
+        return names
+
+    @staticmethod
+    def _convertResultSet(description, resultset, qualified=False, factory=dict):
+        """internal function that turns a result set into a list of
+        dictionaries, or of whatever factory makes of an iterable of
+        (column name, value) pairs."""
+        fldnames=DBIBase._fieldNames(description, qualified)
+        return [factory(zip(fldnames, row)) for row in resultset]
 
     @staticmethod
     def orderByString(order, limit, offset):
@@ -181,15 +596,82 @@ class DBIBase(object):
         the next value of the sequence named 'name'"""
         pass
 
+    def getSequenceValues(self, name, field, table, count):
+        """returns a list of the next count values of the sequence
+        named 'name'.  By default calls getSequence() count times;
+        drivers that can do better in one round trip override this."""
+        return [self.getSequence(name, field, table) for i in range(count)]
+
     def getAutoIncrement(self, name):
         """If db uses auto increment, should obtain
         the value of the auto-incremented field named 'name'"""
         pass
 
+    def upsertSQL(self, table, cols, values, keys, update):
+        """returns SQL that inserts a row into table or, if a row with
+        the same values for the columns in keys (a uniqueness
+        constraint) already exists, updates that row's columns in
+        update instead.  cols are the columns supplied and values the
+        SQL for their values (normally bind variable markers), in the
+        same order.
+
+        By default this is the INSERT ... ON CONFLICT statement of
+        PostgreSQL (9.5+) and sqlite (3.24+); drivers for databases
+        with other syntax override it."""
+        if update:
+            action="DO UPDATE SET %s" % ', '.join("%s = EXCLUDED.%s" % (c, c) \
+                                                   for c in update)
+        else:
+            action="DO NOTHING"
+        return "INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) %s" % (
+            table, ', '.join(cols), ', '.join(values), ', '.join(keys), action)
+
+    def tempColumnType(self, values):
+        """returns the type of a temporary table column that can hold
+        values: BIGINT, DOUBLE PRECISION or VARCHAR for all integers,
+        all numbers or all strings, or None for anything else, which
+        createTempTable() refuses."""
+        if all(map(columnar._isint, values)):
+            return 'BIGINT'
+        elif all(map(columnar._isnumber, values)):
+            return 'DOUBLE PRECISION'
+        elif all(isinstance(v, basestring) for v in values):
+            return 'VARCHAR(%d)' % max(1, max(len(v) for v in values))
+        return None
+
+    def createTempTable(self, values):
+        """creates a temporary table with a single column, v, holding
+        values (of a type tempColumnType() accepts), and returns its
+        name.  Drop it with dropTempTable() when done."""
+        values=list(values)
+        if not values:
+            raise ValueError("you must supply some values")
+        coltype=self.tempColumnType(values)
+        if coltype is None:
+            raise ValueError("cannot put values of mixed or unsupported "
+                             "types in a temporary table")
+        name='%s%d' % (self.temp_table_prefix, next(_temp_tables))
+        self.execute(self.temp_table_create % (name, ('v %s' % coltype).strip()))
+        converter=self.getConverter()
+        self.executemany('INSERT INTO %s (v) VALUES (%s)' \
+                         % (name, converter.placeholders(1)[0]),
+                         [converter.rowValues([v]) for v in values])
+        return name
+
+    def dropTempTable(self, name):
+        """drops a table made by createTempTable()"""
+        self.execute('DROP TABLE %s' % name)
+
     def listTables(self, schema=None):
         """list the tables in the database schema"""
         raise NotImplementedError
 
+    def schemaFingerprint(self, schema=None):
+        """returns a string that changes whenever the database schema
+        does, for invalidating cached table descriptions, or None if
+        the driver can't tell (the default)."""
+        return None
+
     def describeTable(self, table, schema=None):
         """for the given table, returns a 2-tuple: a dict of Field objects
         keyed by name, and list of multi-column unique constraints (sets of Fields)).
@@ -198,6 +680,15 @@ class DBIBase(object):
         """
         raise NotImplementedError
 
+    def describeSchema(self, schema=None, sequence_mapper=None):
+        """returns a dict of what describeTable() returns for each table
+        in the database schema, keyed by table name.  This calls
+        describeTable() for each; drivers override it to describe them
+        all in a few queries."""
+        args=(schema, sequence_mapper) if sequence_mapper else (schema,)
+        return dict((table, self.describeTable(table, *args))
+                    for table in self.listTables(schema))
+
 
 
 _driverConfig = {
@@ -215,6 +706,20 @@ _driverConfig = {
 _loadedDrivers = {}
 _aliases= {}
 _connlock=Lock()
+# the DBI objects of aliases already connected.  This is replaced,
+# never modified, under _connlock, so getConnection() can read it
+# without taking the lock.
+_connections={}
+# incremented whenever an alias is initialized or deleted, to
+# invalidate the DBI objects cached by PyDO classes
+_generation=0
+
+def _notifyQueryHooks(phase, info):
+    for hook in _query_hooks[:]:
+        try:
+            hook(phase, info)
+        except:
+            exception("error in query hook %r", hook)
 
 def _real_connect(connfunc, connargs, initFunc=None):
     if isinstance(connargs, dict):
@@ -281,6 +786,7 @@ def initAlias(alias, driver, connectArgs, pool=None, verbose=False, init=None):
               pool=pool,
               verbose=verbose,
               initFunc=init)
+    global _generation
     _connlock.acquire()
     try:
         old=_aliases.get(alias)
@@ -293,6 +799,7 @@ def initAlias(alias, driver, connectArgs, pool=None, verbose=False, init=None):
                                  (alias, data, old))
         else:
             _aliases[alias]=data
+            _generation+=1
     finally:
         _connlock.release()
 
@@ -300,15 +807,27 @@ def initAlias(alias, driver, connectArgs, pool=None, verbose=False, init=None):
 def delAlias(alias):
     """delete a connection alias if it has already been initialized;
     does nothing otherwise"""
+    global _connections, _generation
     _connlock.acquire()
     try:
         if alias in _aliases:
             del _aliases[alias]
+            if alias in _connections:
+                connections=_connections.copy()
+                del connections[alias]
+                _connections=connections
+            _generation+=1
     finally:
         _connlock.release()
 
 def getConnection(alias, create=True):
     """get a connection given a connection alias"""
+    global _connections
+    # once an alias is connected, no lock is needed
+    try:
+        return _connections[alias]
+    except KeyError:
+        pass
     _connlock.acquire()
     try:
         try:
@@ -318,10 +837,12 @@ def getConnection(alias, create=True):
         if 'connection' not in conndata:
             if not create:
                 return None
-            res=_connect(**conndata)
-            conndata['connection']=res
-            return res
-        return conndata['connection']
+            conndata['connection']=_connect(**conndata)
+        res=conndata['connection']
+        connections=_connections.copy()
+        connections[alias]=res
+        _connections=connections
+        return res
     finally:
         _connlock.release()
 
@@ -331,12 +852,14 @@ class ConnectionWrapper(object):
     overrides close(), which instead of closing the connection,
     returns the it to the pool.  """
 
-    __slots__=('_conn', '_pool', '_closed')
+    __slots__=('_conn', '_pool', '_closed', '_entry')
 
-    def __init__(self, conn, pool):
+    def __init__(self, conn, pool, entry=None):
         self._conn=conn
         self._pool=pool
         self._closed=0
+        # the pool's bookkeeping for the connection
+        self._entry=entry
 
     def __getattr__(self, attr):
         return getattr(self._conn, attr)
@@ -357,100 +880,326 @@ class ConnectionWrapper(object):
             self.close()
 
 
+class _PoolEntry(object):
+    """a real connection held by a pool, with its bookkeeping."""
+    __slots__=('conn', 'created', 'released', 'prepared')
+
+    def __init__(self, conn, created):
+        self.conn=conn
+        self.created=created
+        self.released=created
+        # the connection's prepared statements (see
+        # DBIBase.getPreparedCache())
+        self.prepared=None
+
+
 class ConnectionPool(object):
-    """ a connection pool for a single connection alias."""
+    """ a connection pool for a single connection alias.
+
+    * max_poolsize is the maximum number of connections to create
+      (0 or a negative value means no maximum).
+    * keep_poolsize is the maximum number of idle connections to keep.
+    * timeout is how long, in seconds, to wait for a connection when
+      max_poolsize connections are in use before raising a PyDOError
+      (by default, delay * retries, for backwards compatibility).
+    * max_lifetime, if given, is the age in seconds after which a
+      connection is closed rather than reused.
+    * max_idle, if given, is the time in seconds after which an idle
+      connection is closed rather than reused.
+    * ping_after is how long, in seconds, a connection must have been
+      idle before it is validated with onHandOut() when handed out.
+
+    Statistics are available from stats(); listeners added with
+    addListener() are notified of pool events as they happen.
+    """
+    # upper bounds, in seconds, of the buckets of the checkout
+    # latency histogram
+    latency_buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
     def __init__(self,
                  max_poolsize=0,
                  keep_poolsize=1,
                  delay=0.2,
-                 retries=10):
-        # deque of unused connections
+                 retries=10,
+                 timeout=None,
+                 max_lifetime=None,
+                 max_idle=None,
+                 ping_after=0):
+        # deque of unused connections, most recently released last
         self._free=deque()
-        # list of in-use connections
+        # in-use connections, keyed by id.
         # we need real references to these, not just a count.
-        self._busy=[]
-        # maximum number of connections to create
-        # 0 or a negative value means no maximum
+        self._busy={}
+        # number of connections being created outside the lock
+        self._pending=0
         self._max_poolsize=max_poolsize
-        # maximum number of connections to keep alive
         self._keep_poolsize=keep_poolsize
-        # time to sleep in seconds if max_poolsize connections are in
-        # use before retrying
-        self._delay=delay
-        # number of times to retry in that case
-        self._retries=retries
+        if timeout is None:
+            timeout=delay*retries
+        self._timeout=timeout
+        self._max_lifetime=max_lifetime
+        self._max_idle=max_idle
+        self._ping_after=ping_after
         self._lock=Lock()
+        self._cond=Condition(self._lock)
+        self._listeners=[]
+        self._waits=0
+        self._wait_time=0.0
+        self._checkouts=0
+        # one more bucket for latencies beyond the last bound
+        self._latencies=[0]*(len(self.latency_buckets)+1)
+        self._creates=0
+        self._create_time=0.0
+        self._discards=0
+        self._rejects=0
+        self._timeouts=0
+        self._releases=0
+        self._release_time=0.0
+        self._peak_busy=0
 
-    def connect(self, connectFunc, connectArgs, initFunc=None):
-        return self._connect(connectFunc,
-                             connectArgs,
-                             initFunc,
-                             self._retries)
+    def addListener(self, listener):
+        """registers a callable to be notified of pool events.  It is
+        called, outside the pool's lock, as listener(event, info),
+        where event is one of 'checkout', 'create', 'release',
+        'discard', 'reject' or 'timeout' and info is a dictionary of
+        details; for instance, a checkout has its 'latency', and a
+        release its 'time' spent in onRelease().  Exceptions raised
+        by listeners are logged and otherwise ignored."""
+        self._lock.acquire()
+        try:
+            self._listeners.append(listener)
+        finally:
+            self._lock.release()
 
-    def _connect(self, connectFunc, connectArgs, initFunc, retries):
-        """internal method; don't call it"""
-        max_poolsize=self._max_poolsize
+    def removeListener(self, listener):
+        """unregisters a listener added with addListener()"""
+        self._lock.acquire()
+        try:
+            self._listeners.remove(listener)
+        finally:
+            self._lock.release()
 
+    def _notify(self, event, **info):
+        for listener in self._listeners[:]:
+            try:
+                listener(event, info)
+            except:
+                exception("error in pool listener %r", listener)
+
+    def _expired(self, entry, now):
+        """whether a connection is too old or has been idle too long
+        to reuse"""
+        if self._max_lifetime is not None \
+               and now-entry.created>=self._max_lifetime:
+            return True
+        if self._max_idle is not None \
+               and now-entry.released>=self._max_idle:
+            return True
+        return False
+
+    def connect(self, connectFunc, connectArgs, initFunc=None):
+        """returns a wrapped connection, reusing an idle one if
+        possible, creating one if max_poolsize permits, and otherwise
+        waiting up to the pool's timeout for one to be released."""
+        start=time.time()
+        deadline=start+self._timeout
+        while 1:
+            entry, expired=self._checkout(start, deadline)
+            for e in expired:
+                self._close(e.conn)
+                self._notify('discard', reason='expired')
+            if entry is None:
+                # a slot has been reserved; connect outside the lock
+                entry=self._create(connectFunc, connectArgs, initFunc)
+                break
+            if time.time()-entry.released < self._ping_after \
+                   or self.onHandOut(entry.conn):
+                break
+            # not ok, completely expunge this connection
+            self._discard(entry)
+        latency=time.time()-start
         self._lock.acquire()
         try:
-            # is there a connection available?
-            free=self._free
-            busy=self._busy
-            if free:
-                c=free.popleft()
-                busy.append(c)
+            self._checkouts+=1
+            buckets=self.latency_buckets
+            for i, bound in enumerate(buckets):
+                if latency<=bound:
+                    break
             else:
-                lenbusy=len(busy)
-                if max_poolsize>0:
-                    # there is a cap on the number of connections
-                    # we are allowed to create
-                    assert lenbusy <= max_poolsize
-                    if lenbusy==max_poolsize:
-                        # can't create more, must retry or barf
-                        if not retries:
-                            # barf
-                            raise PyDOError(
-                                  ("all connections in use, attempted retries: "
-                                   "%d") % self._retries)
-                        else:
-                            # retry, but get out of the mutex first
-                            c=None
-                    else:
-                        # All are in use and we are allowed to create more.
-                        # Do so.
-                        c=_real_connect(connectFunc, connectArgs, initFunc)
-                        busy.append(c)
-                else:
-                    # unlimited headroom, create new connection
-                    c=_real_connect(connectFunc, connectArgs, initFunc)
-                    busy.append(c)
+                i=len(buckets)
+            self._latencies[i]+=1
         finally:
             self._lock.release()
-        if c:
-            if self.onHandOut(c):
-                return ConnectionWrapper(c, self)
-            else:
-                # not ok, completely expunge this connection
-                busy.remove(c)
-                # we're going to block, encourage c to die first
-                del c
-        # wait and then retry
-        time.sleep(self._delay)
-        return self._connect(connectFunc, connectArgs, initFunc, retries-1)
+        self._notify('checkout', latency=latency)
+        return ConnectionWrapper(entry.conn, self, entry)
+
+    def _checkout(self, start, deadline):
+        """internal method: under the lock, takes a free connection
+        entry, or reserves a slot for a new connection (returning
+        None), waiting until one of those is possible.  Also returns
+        a list of expired free entries, to be closed by the caller.
+        Raises a PyDOError if the pool's timeout elapses first."""
+        expired=[]
+        waited=False
+        self._cond.acquire()
+        try:
+            try:
+                free=self._free
+                while 1:
+                    now=time.time()
+                    while free:
+                        entry=free.pop()
+                        if self._expired(entry, now):
+                            self._discards+=1
+                            expired.append(entry)
+                        else:
+                            self._busy[id(entry.conn)]=entry
+                            self._peak_busy=max(self._peak_busy,
+                                                len(self._busy))
+                            return entry, expired
+                    max_poolsize=self._max_poolsize
+                    if max_poolsize<=0 \
+                           or len(self._busy)+self._pending < max_poolsize:
+                        self._pending+=1
+                        return None, expired
+                    remaining=deadline-now
+                    if remaining<=0:
+                        self._timeouts+=1
+                        break
+                    waited=True
+                    self._cond.wait(remaining)
+            finally:
+                if waited:
+                    self._waits+=1
+                    self._wait_time+=time.time()-start
+        finally:
+            self._cond.release()
+        # timed out
+        for e in expired:
+            self._close(e.conn)
+            self._notify('discard', reason='expired')
+        self._notify('timeout', wait_time=time.time()-start)
+        raise PyDOError("all %d connections in use; timed out after "
+                        "%.2f seconds" % (self._max_poolsize,
+                                          time.time()-start))
+
+    def _create(self, connectFunc, connectArgs, initFunc):
+        """internal method: creates a connection in a slot reserved
+        by _checkout(), and returns its entry."""
+        start=time.time()
+        try:
+            c=_real_connect(connectFunc, connectArgs, initFunc)
+        except:
+            self._cond.acquire()
+            try:
+                self._pending-=1
+                self._cond.notify()
+            finally:
+                self._cond.release()
+            raise
+        now=time.time()
+        self._cond.acquire()
+        try:
+            self._pending-=1
+            self._creates+=1
+            self._create_time+=now-start
+            entry=self._busy[id(c)]=_PoolEntry(c, now)
+            self._peak_busy=max(self._peak_busy, len(self._busy))
+        finally:
+            self._cond.release()
+        self._notify('create', time=now-start)
+        return entry
+
+    def _discard(self, entry):
+        """internal method: removes a busy connection that failed
+        onHandOut() from the pool and closes it."""
+        self._cond.acquire()
+        try:
+            del self._busy[id(entry.conn)]
+            self._discards+=1
+            self._rejects+=1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        self._close(entry.conn)
+        self._notify('reject')
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except:
+            # it may well be broken already
+            pass
 
     def release(self, conn):
-        keep_poolsize=self._keep_poolsize
-        self._lock.acquire()
+        """returns a real connection to the pool."""
+        start=time.time()
+        self.onRelease(conn)
+        now=time.time()
+        expired=False
+        self._cond.acquire()
         try:
-            # do we keep this connection?
+            self._releases+=1
+            self._release_time+=now-start
             free=self._free
             busy=self._busy
-            numconns=len(free)+len(busy)
-            keep=keep_poolsize >= numconns
-            busy.remove(conn)
+            # do we keep this connection?
+            keep=self._keep_poolsize >= len(free)+len(busy)
+            entry=busy.pop(id(conn))
+            if keep and self._max_lifetime is not None \
+                   and now-entry.created>=self._max_lifetime:
+                keep=False
+                expired=True
+                self._discards+=1
             if keep:
-                free.append(conn)
-            self.onRelease(conn)
+                entry.released=now
+                free.append(entry)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        if not keep:
+            self._close(conn)
+        self._notify('release', time=now-start, kept=keep)
+        if expired:
+            self._notify('discard', reason='expired')
+
+    def stats(self):
+        """returns a snapshot of pool statistics as a dictionary:
+
+        * busy, free: the current numbers of connections in use and idle
+        * peak_busy: the largest number of connections in use at once
+        * checkouts: the number of connections handed out
+        * checkout_latency: a histogram of the time taken to hand out
+          a connection, as a list of (upper bound in seconds, count)
+          pairs, the last bound being None
+        * waits, wait_time: the number of checkouts that had to wait
+          for a connection to be released, and the total time waited
+        * creates, create_time: the number of connections created,
+          and the total time spent connecting
+        * discards: the number of connections closed because they
+          were expired or failed onHandOut()
+        * rejects: the number of connections that failed onHandOut()
+        * timeouts: the number of checkouts that timed out
+        * releases, release_time: the number of connections returned,
+          and the total time spent in onRelease()
+        """
+        self._lock.acquire()
+        try:
+            bounds=list(self.latency_buckets)+[None]
+            return dict(busy=len(self._busy),
+                        free=len(self._free),
+                        peak_busy=self._peak_busy,
+                        checkouts=self._checkouts,
+                        checkout_latency=list(zip(bounds, self._latencies)),
+                        waits=self._waits,
+                        wait_time=self._wait_time,
+                        creates=self._creates,
+                        create_time=self._create_time,
+                        discards=self._discards,
+                        rejects=self._rejects,
+                        timeouts=self._timeouts,
+                        releases=self._releases,
+                        release_time=self._release_time)
         finally:
             self._lock.release()
 
@@ -482,5 +1231,8 @@ class ConnectionPool(object):
 __all__=['initAlias',
          'delAlias',
          'getConnection',
-         'ConnectionPool']
+         'ConnectionPool',
+         'addQueryHook',
+         'removeQueryHook',
+         'SlowQueryLogger']
 
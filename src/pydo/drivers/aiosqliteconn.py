@@ -0,0 +1,29 @@
+"""
+PyDO asynchronous driver for sqlite, using the aiosqlite package (see
+pydo.aio).
+
+"""
+
+from pydo.aio import AsyncDBIBase
+from pydo.drivers.sqliteconn2 import SqliteDBI
+
+import aiosqlite
+
+class AiosqliteDBI(AsyncDBIBase):
+    dialectClass=SqliteDBI
+
+    def __init__(self, connectArgs, pool=None, verbose=False, initFunc=None):
+        super(AiosqliteDBI, self).__init__(connectArgs,
+                                           aiosqlite.connect,
+                                           aiosqlite,
+                                           pool,
+                                           verbose,
+                                           initFunc)
+
+    async def getAutoIncrement(self, name):
+        async with self._connection() as conn:
+            c=await conn.execute("SELECT last_insert_rowid ()")
+            try:
+                return (await c.fetchone())[0]
+            finally:
+                await c.close()
@@ -86,6 +86,12 @@ class MssqlConverter(BindingConverter):
 
 class MssqlDBI(DBIBase):
    auto_increment=True
+   # SQL Server permits at most 2100 parameters per request
+   max_bind_params=2100
+   large_in_threshold=2000
+   # temporary tables are named with a '#'
+   temp_table_create='CREATE TABLE %s (%s)'
+   temp_table_prefix='#pydo_in_'
 
    def __init__(self, connectArgs, pool=None, verbose=False, initFunc=None):
       if pool and not hasattr(pool, 'connect'):
@@ -102,6 +108,20 @@ class MssqlDBI(DBIBase):
    def getConverter(self):
       return MssqlConverter(self.paramstyle)
 
+   def upsertSQL(self, table, cols, values, keys, update):
+      """a MERGE statement (which SQL Server requires to be
+      terminated)."""
+      sql=["MERGE INTO %s AS t USING (SELECT %s) AS s ON (%s)" % (
+         table,
+         ', '.join("%s AS %s" % (v, c) for c, v in zip(cols, values)),
+         ' AND '.join("t.%s = s.%s" % (k, k) for k in keys))]
+      if update:
+         sql.append("WHEN MATCHED THEN UPDATE SET %s" % \
+                    ', '.join("t.%s = s.%s" % (c, c) for c in update))
+      sql.append("WHEN NOT MATCHED THEN INSERT (%s) VALUES (%s);" % (
+         ', '.join(cols), ', '.join("s.%s" % c for c in cols)))
+      return ' '.join(sql)
+
    def getAutoIncrement(self, name):
       q = self.conn.db.cursor ()
       q.execute ("SELECT @@IDENTITY")
@@ -140,6 +160,23 @@ class MssqlDBI(DBIBase):
          return sorted(x[0] for x in res)
       return ()
 
+   def schemaFingerprint(self, schema=None):
+      """the number of objects in the schema and the time of the
+      latest change to any of them.
+      """
+      sql="""
+        SELECT
+          COUNT(*), CONVERT(varchar(30), MAX(modify_date), 126)
+        FROM
+          sys.objects
+        WHERE
+          schema_id=SCHEMA_ID('%s')
+      """ % (schema or 'dbo')
+      c=self.conn.cursor()
+      c.execute(sql)
+      res=c.fetchone()
+      return ':'.join(str(x) for x in res)
+
    def describeTable(self, table, schema=None):
       schema = schema or 'dbo'
       fields={}
@@ -11,11 +11,46 @@ from pydo.field import Field, Unique, Sequence
 from pydo.log import debug
 
 import MySQLdb
+import MySQLdb.cursors
 import sys
 
 if sys.version_info[0] == 3:
     long=int
 
+def _addField(fields, nullableFields, name, nullable, extra):
+    """adds a Field for a column described by SHOW COLUMNS or
+    information_schema.COLUMNS"""
+    if nullable == 'NO':
+        nullable = False
+    elif nullable == 'YES':
+        nullable = True
+    else:
+        raise RuntimeError("%s: unknown `nullable` for column '%s'" %
+                           (nullable, name))
+    if nullable:
+        nullableFields.append(name)
+    if (not nullable) and extra=='auto_increment':
+        fields[name]=Sequence(name)
+    else:
+        fields[name]=Field(name)
+
+def _uniqueIndexes(rows, nullableFields):
+    """returns the sets of columns of unique indexes, from rows of
+    (non_unique, key_name, column_name)"""
+    indices={}
+    blacklist=set(nullableFields)
+    for notunique, keyname, colname in rows:
+        # if not a unique index, the whole index is tainted, don't use it
+        if notunique:
+            blacklist.add(keyname)
+            continue
+        if keyname in blacklist:
+            continue
+        # build dictionary of lists
+        indices.setdefault(keyname, [])
+        indices[keyname].append(colname)
+    return set(frozenset(x) for x in list(indices.values()))
+
 class MysqlConverter(BindingConverter):
     converters={DATE: lambda x: x.value,
                 TIMESTAMP: lambda x: x.value,
@@ -26,6 +61,14 @@ class MysqlDBI(DBIBase):
     auto_increment=True
     autocommit=True
     has_sane_rowcount=False
+    row_value_in=True
+    row_value_compare=True
+    # MySQLdb has no server-side prepared statements, so
+    # prepare_cache_size has no effect
+    # IN lists are limited only by max_allowed_packet, but very long
+    # ones are cheaper to load into a temporary table than to parse
+    large_in_threshold=10000
+    large_in_strategy='temptable'
 
     def __init__(self, connectArgs, pool=None, verbose=False, initFunc=None):
         if pool and not hasattr(pool, 'connect'):
@@ -46,6 +89,21 @@ class MysqlDBI(DBIBase):
     def getConverter(self):
         return MysqlConverter(self.paramstyle)
 
+    def upsertSQL(self, table, cols, values, keys, update):
+        """INSERT ... ON DUPLICATE KEY UPDATE.  MySQL matches any
+        unique key, not only the one in keys."""
+        update=update or keys[:1]
+        return "INSERT INTO %s (%s) VALUES (%s) ON DUPLICATE KEY UPDATE %s" % (
+            table, ', '.join(cols), ', '.join(values),
+            ', '.join("%s = VALUES(%s)" % (c, c) for c in update))
+
+    def serverCursor(self):
+        """returns an unbuffered cursor, which leaves the result set on
+        the server until rows are fetched.  The connection can't be used
+        for other queries until the result set is exhausted or the
+        cursor closed."""
+        return self.conn.cursor(MySQLdb.cursors.SSCursor)
+
     def listTables(self, schema=None):
         """ lists tables in the database."""
         sql="SHOW TABLES"
@@ -59,6 +117,25 @@ class MysqlDBI(DBIBase):
             return []
         return sorted(x[0] for x in res)
 
+    def schemaFingerprint(self, schema=None):
+        """the number of tables and columns in the schema, and when
+        its tables were created (which ALTER TABLE also changes)"""
+        sql="""
+        SELECT COUNT(*), MAX(CREATE_TIME),
+               SUM(CRC32(CONCAT(TABLE_NAME, CREATE_TIME))),
+               (SELECT COUNT(*) FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA=COALESCE(%s, DATABASE()))
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA=COALESCE(%s, DATABASE())
+        """
+        cur=self.conn.cursor()
+        if self.verbose:
+            debug('SQL: %s', (sql,))
+        cur.execute(sql, (schema, schema))
+        res=cur.fetchone()
+        cur.close()
+        return ':'.join(str(x) for x in res)
+
     def describeTable(self, table, schema=None):
         cur=self.conn.cursor()
         if self.verbose:
@@ -80,44 +157,56 @@ class MysqlDBI(DBIBase):
         nullableFields=[]
         for row in res:
             name, tipe, nullable, key, default, extra=row
-            if nullable == 'NO':
-                nullable = False
-            elif nullable == 'YES':
-                nullable = True
-            else:
-                raise RuntimeError("%s: unknown `nullable` for column '%s'" %
-                                   (nullable, name))
-            if nullable:
-                nullableFields.append(name)
-            if (not nullable) and extra=='auto_increment':
-                fields[name]=Sequence(name)
-            else:
-                fields[name]=Field(name)
+            _addField(fields, nullableFields, name, nullable, extra)
 
         sql="SHOW INDEX FROM %s" % table
         execute(sql)
         res=cur.fetchall()
         cur.close()
-        indices={}
-        blacklist=set(nullableFields)
         # columns we care about, and their index in the result set:
         # Non_unique:   1
         # Key_name:     2
         # Column_name : 4
-        for row in res:
-            keyname=row[2]
-            colname=row[4]
-            notunique=row[1]
-            # if not a unique index, the whole index is tainted, don't use it
-            if notunique:
-                blacklist.add(keyname)
-                continue
-            if keyname in blacklist:
-                continue
-            # build dictionary of lists
-            indices.setdefault(keyname, [])
-            indices[keyname].append(colname)
-
-        unique=set(frozenset(x) for x in list(indices.values()))
+        unique=_uniqueIndexes(((row[1], row[2], row[4]) for row in res),
+                              nullableFields)
         return fields, unique
 
+    def describeSchema(self, schema=None, sequence_mapper=None):
+        """describes every table in the schema with two queries of
+        information_schema"""
+        cur=self.conn.cursor()
+        def execute(sql):
+            if self.verbose:
+                debug('SQL: %s', (sql,))
+            cur.execute(sql, (schema,))
+
+        sql="""
+        SELECT TABLE_NAME, COLUMN_NAME, IS_NULLABLE, EXTRA
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA=COALESCE(%s, DATABASE())
+        ORDER BY TABLE_NAME, ORDINAL_POSITION
+        """
+        execute(sql)
+        described={}
+        nullable={}
+        for table, name, isnullable, extra in cur.fetchall():
+            if table not in described:
+                described[table]={}
+                nullable[table]=[]
+            _addField(described[table], nullable[table], name, isnullable, extra)
+
+        sql="""
+        SELECT TABLE_NAME, NON_UNIQUE, INDEX_NAME, COLUMN_NAME
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA=COALESCE(%s, DATABASE())
+        ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+        """
+        execute(sql)
+        indexes={}
+        for row in cur.fetchall():
+            indexes.setdefault(row[0], []).append(row[1:])
+        cur.close()
+        return dict((table, (fields, _uniqueIndexes(indexes.get(table, ()),
+                                                    nullable[table])))
+                    for table, fields in described.items())
+
@@ -13,6 +13,10 @@ class OracleDBI(DBIBase):
     paramstyle = 'named'
     autocommit = None
     auto_increment = True  # Assume a trigger increments the relevant sequence
+    row_value_in = True
+    # Oracle permits at most 1000 expressions in an IN list (ORA-01795)
+    large_in_threshold = 1000
+    large_in_strategy = 'split'
     
     def __init__(self, connectArgs, pool=None, verbose=False, initFunc=None):
        if pool and not hasattr(pool, 'connect'):
@@ -20,37 +24,39 @@ class OracleDBI(DBIBase):
        super(OracleDBI, self).__init__(connectArgs, cx_Oracle.connect,
            cx_Oracle, pool, verbose, initFunc)
 
+    def _connect(self):
+        c=super(OracleDBI, self)._connect()
+        if self.prepare_cache_size:
+            # the OCI statement cache, which reuses statements with
+            # the same SQL text
+            c.stmtcachesize=self.prepare_cache_size
+        return c
+
     @staticmethod
     def sequence_mapper(table, column):
         return "%s_%s_SEQ" % (table, column)
     
-    def execute(self, sql, values=(), qualified=False):
-        """Executes the statement with the values and does conversion
-        of the return result as necessary.
-        result is list of dictionaries, or number of rows affected"""
-        if self.verbose:
-            debug("SQL: %s", sql)
-            debug("bind variables: %s", values)
-        c = self.conn.cursor()
-        if values:
-            c.execute(sql, values)
-        else:
-            c.execute(sql)
-        if c.description is None:
-            resultset = None
-        else:
-            lob_types = set((cx_Oracle.CLOB, cx_Oracle.BLOB))
-            field_types = set(d[1] for d in c.description)
-            have_lobs = field_types & lob_types
+    def _fetchResult(self, cursor):
+        if cursor.description is None:
+            return None
+        lob_types = set((cx_Oracle.CLOB, cx_Oracle.BLOB))
+        field_types = set(d[1] for d in cursor.description)
+        have_lobs = field_types & lob_types
+        if have_lobs:
+            return [list(self.field_values(row)) for row in cursor]
+        return cursor.fetchall()
+
+    def _fetchBatches(self, cursor, arraysize=None):
+        """like DBIBase._fetchBatches, but reads any LOBs in each batch
+        before the next fetch invalidates their locators."""
+        lob_types = set((cx_Oracle.CLOB, cx_Oracle.BLOB))
+        have_lobs = None
+        for rows in super(OracleDBI, self)._fetchBatches(cursor, arraysize):
+            if have_lobs is None:
+                have_lobs = set(d[1] for d in cursor.description) & lob_types
             if have_lobs:
-                resultset = [list(self.field_values(row)) for row in c]
-            else:
-                resultset = c.fetchall()
-        if not resultset:
-            return c.rowcount
-        res = self._convertResultSet(c.description, resultset, qualified)
-        c.close()
-        return res
+                rows = [list(self.field_values(row)) for row in rows]
+            yield rows
 
     @staticmethod
     def field_values(row):
@@ -72,6 +78,19 @@ class OracleDBI(DBIBase):
         cur.close()
         return result
 
+    def upsertSQL(self, table, cols, values, keys, update):
+        """a MERGE statement with the row selected from dual."""
+        sql=["MERGE INTO %s t USING (SELECT %s FROM dual) s ON (%s)" % (
+            table,
+            ', '.join("%s AS %s" % (v, c) for c, v in zip(cols, values)),
+            ' AND '.join("t.%s = s.%s" % (k, k) for k in keys))]
+        if update:
+            sql.append("WHEN MATCHED THEN UPDATE SET %s" % \
+                       ', '.join("t.%s = s.%s" % (c, c) for c in update))
+        sql.append("WHEN NOT MATCHED THEN INSERT (%s) VALUES (%s)" % (
+            ', '.join(cols), ', '.join("s.%s" % c for c in cols)))
+        return ' '.join(sql)
+
     def listTables(self, schema=None):
         """lists the tables in the database schema"""
         if schema is None:
@@ -91,6 +110,24 @@ class OracleDBI(DBIBase):
             return []
         return sorted(x[0] for x in res)
 
+    def schemaFingerprint(self, schema=None):
+        """the number of objects in the schema and the time of the
+        latest DDL on any of them"""
+        if schema is None:
+            schema = 'PUBLIC'
+        sql = """
+            SELECT COUNT(*), TO_CHAR(MAX(t.last_ddl_time), 'YYYYMMDDHH24MISS')
+            FROM sys.all_objects t
+            WHERE t.owner = :schema
+            """
+        cur = self.conn.cursor()
+        if self.verbose:
+            debug("SQL: %s", (sql,))
+        cur.execute(sql, schema=schema)
+        res = cur.fetchone()
+        cur.close()
+        return ':'.join(str(x) for x in res)
+
     def describeTable(self, table, schema=None, sequence_mapper=None):
         """for the given table, returns a 2-tuple: a dict of Field objects
         keyed by name, and list of multi-column unique constraints (sets of Fields)).
@@ -168,3 +205,76 @@ class OracleDBI(DBIBase):
                 fields[column].sequence = sequence
 
         return fields, unique
+
+    def describeSchema(self, schema=None, sequence_mapper=None):
+        """describes every table in the schema with the queries
+        describeTable() runs for one, without the table filter"""
+        if schema is None:
+            schema = 'PUBLIC'
+        if not sequence_mapper:
+            sequence_mapper = self.sequence_mapper
+
+        cur = self.conn.cursor()
+        def execute(sql):
+            if self.verbose:
+                debug("SQL: %s", (sql,))
+            cur.execute(sql, schema=schema)
+
+        sql = """
+            SELECT tc.table_name, tc.column_name
+            FROM sys.all_tab_columns tc
+            WHERE tc.owner = :schema
+            ORDER BY tc.table_name, tc.column_id
+            """
+        execute(sql)
+        described = {}
+        for (table, column_name) in cur:
+            if table not in described:
+                described[table] = ({}, set())
+            described[table][0][column_name] = Field(column_name)
+
+        sql = """
+            SELECT con.table_name, concol.constraint_name, concol.column_name
+            FROM sys.all_constraints con
+            JOIN sys.all_cons_columns concol ON con.owner = concol.owner
+                AND con.constraint_name = concol.constraint_name
+            WHERE con.owner = :schema AND con.constraint_type in ('P', 'U')
+            ORDER BY con.table_name, concol.constraint_name
+            """
+        execute(sql)
+        for ((table, key), rows) in groupby(cur, itemgetter(0, 1)):
+            if table not in described:
+                continue
+            fields, unique = described[table]
+            columns = frozenset(r[2] for r in rows)
+            unique.add(columns)
+            if len(columns) == 1:
+                fields[list(columns)[0]].unique = True
+
+        # see describeTable() about sequences
+        sql = """
+            SELECT seq.sequence_name
+            FROM sys.all_sequences seq
+            WHERE seq.sequence_owner = :schema
+            """
+        execute(sql)
+        sequences = frozenset(sequence for (sequence,) in cur)
+        sql = """
+            SELECT tabcol.table_name, tabcol.column_name
+            FROM sys.all_tab_cols tabcol
+                JOIN sys.all_trigger_cols trigcol ON tabcol.owner = trigcol.table_owner
+                    AND tabcol.table_name = trigcol.table_name
+                    AND tabcol.column_name = trigcol.column_name
+                JOIN sys.all_triggers trig ON trigcol.trigger_owner = trig.owner
+                    AND trigcol.trigger_name = trig.trigger_name
+            WHERE tabcol.owner = :schema
+                AND tabcol.data_type = 'NUMBER' AND trigcol.column_usage = 'NEW OUT'
+                AND trig.status = 'ENABLED'
+            """
+        execute(sql)
+        for (table, column) in cur:
+            sequence = sequence_mapper(table, column)
+            if sequence in sequences and table in described:
+                described[table][0][column].sequence = sequence
+        cur.close()
+        return described
@@ -0,0 +1,41 @@
+"""
+PyDO asynchronous driver for PostgreSQL, using psycopg 3's
+AsyncConnection (see pydo.aio).
+
+"""
+
+from pydo.aio import AsyncDBIBase
+from pydo.drivers.psycopgconn import PsycopgDBI
+from pydo.exceptions import PyDOError
+
+import itertools
+
+import psycopg
+
+_cursor_counter=itertools.count()
+
+class AsyncPsycopgDBI(AsyncDBIBase):
+    dialectClass=PsycopgDBI
+
+    def __init__(self, connectArgs, pool=None, verbose=False, initFunc=None):
+        super(AsyncPsycopgDBI, self).__init__(connectArgs,
+                                              psycopg.AsyncConnection.connect,
+                                              psycopg,
+                                              pool,
+                                              verbose,
+                                              initFunc)
+
+    async def cursor(self, conn):
+        return conn.cursor()
+
+    async def serverCursor(self, conn):
+        """returns a named (server-side) cursor, so that rows are
+        transferred from the server only as they are fetched"""
+        return conn.cursor('pydo_cursor_%d' % next(_cursor_counter))
+
+    async def getSequence(self, name, field, table):
+        name=self.dialect._sequenceName(name, field, table)
+        res=await self.execute("select nextval('%s')" % name)
+        if not res:
+            raise PyDOError("could not get value for sequence %s!" % name)
+        return list(res[0].values())[0]
@@ -16,6 +16,8 @@ from pydo.field import Field
 
 import time
 import datetime
+import itertools
+import re
 import sys
 
 if sys.version_info[0] == 3:
@@ -110,7 +112,49 @@ if havemx:
 class PsycopgConverter(BindingConverter):
     converters=_converters
 
+# used to generate names for server-side cursors
+_cursor_counter=itertools.count(1)
+# used to generate names for prepared statements
+_statement_counter=itertools.count(1)
+
+# the statements PostgreSQL can prepare
+_preparable_pat=re.compile(r'\s*(SELECT|INSERT|UPDATE|DELETE|VALUES|WITH)\b', re.I)
+# bind variable markers, and escaped percent signs, in SQL to be
+# interpolated by psycopg
+_marker_pat=re.compile(r'%(?:\((\w+)\))?s|%%')
+
+def _prepareSQL(sql):
+    """returns the body of a PREPARE statement for sql, with its bind
+    variable markers replaced by numbered parameters, and the list of
+    markers to pass the values to EXECUTE with."""
+    markers=[]
+    def number(m):
+        if m.group(0)=='%%':
+            # not interpolated in the PREPARE
+            return '%'
+        if m.group(1) is None:
+            markers.append('%s')
+            return '$%d' % len(markers)
+        marker=m.group(0)
+        if marker not in markers:
+            markers.append(marker)
+        return '$%d' % (markers.index(marker)+1)
+    return _marker_pat.sub(number, sql), markers
+
 class PsycopgDBI(DBIBase):
+    # bind variables are interpolated client-side, so a multi-row
+    # INSERT is one round trip, while executemany() is one per row
+    multirow_insert=True
+    row_value_in=True
+    row_value_compare=True
+    # psycopg doesn't prepare statements itself; if this is set,
+    # statements with bind variables are prepared with PREPARE and
+    # run with EXECUTE
+    prepare_cache_size=0
+    # large IN lists are bound as one array, so the statement's text
+    # (and plan) doesn't depend on the number of values
+    large_in_threshold=100
+    large_in_strategy='array'
 
     def __init__(self, connectArgs, pool=None, verbose=False, initFunc=None):
        if pool and not hasattr(pool, 'connect'):
@@ -151,37 +195,55 @@ class PsycopgDBI(DBIBase):
     def getConverter(self):
         return PsycopgConverter(self.paramstyle)
 
-    def execute(self, sql, values=(), qualified=False):
-        """Executes the statement with the values and does conversion
-        of the return result as necessary.
-        result is list of dictionaries, or number of rows affected"""
-        if self.verbose:
-            debug("SQL: %s", sql)
-            debug("bind variables: %s", values)
-        c=self.conn.cursor()
-        if values:
-            c.execute(sql, values)
-        else:
-            c.execute(sql)
-        if c.statusmessage=='SELECT':
-            resultset=c.fetchall()
-        else:
-            resultset=None
-        if not resultset:
-            if c.statusmessage.startswith('INSERT') or c.statusmessage.startswith('UPDATE'):
-                # rowcount doesn't work
-                return int(c.statusmessage.split()[-1])
-            return -1
-        res=self._convertResultSet(c.description, resultset, qualified)
-        c.close()
-        return res
+    def _executeCursor(self, cursor, sql, values, many=False):
+        if self.prepare_cache_size>0 and values and _preparable_pat.match(sql):
+            sql=self._prepared(cursor, sql)
+        super(PsycopgDBI, self)._executeCursor(cursor, sql, values, many)
 
-    def getSequence(self, name, field, table):
+    def _prepared(self, cursor, sql):
+        """returns the EXECUTE statement for sql, preparing it on the
+        connection first if that hasn't been done."""
+        cache=self.getPreparedCache()
+        prepared=cache.get(sql)
+        if prepared is None:
+            name='pydo_stmt_%d' % next(_statement_counter)
+            body, markers=_prepareSQL(sql)
+            cursor.execute('PREPARE %s AS %s' % (name, body))
+            prepared=(name, 'EXECUTE %s (%s)' % (name, ', '.join(markers)))
+            for oldname, oldexecute in cache.add(sql, prepared):
+                cursor.execute('DEALLOCATE %s' % oldname)
+        return prepared[1]
+
+    def serverCursor(self):
+        """returns a named (server-side) cursor, so that rows are
+        transferred from the server only as they are fetched.  Named
+        cursors can only be used inside a transaction, so in
+        autocommit mode this returns an ordinary cursor."""
+        if psycopg_version<2 or self.autocommit:
+            return self.conn.cursor()
+        return self.conn.cursor('pydo_cursor_%d' % next(_cursor_counter))
+
+    def _fetchResult(self, cursor):
+        if cursor.statusmessage=='SELECT':
+            return cursor.fetchall()
+
+    def _rowcount(self, cursor):
+        if cursor.statusmessage.startswith('INSERT') \
+               or cursor.statusmessage.startswith('UPDATE'):
+            # rowcount doesn't work
+            return int(cursor.statusmessage.split()[-1])
+        return -1
+
+    def _sequenceName(self, name, field, table):
         if name==True:
             # not a string; infer the sequence name
             name='%s_%s_seq' % (table, field)
             if self.verbose:
                 debug('inferring sequence name: %s', name)
+        return name
+
+    def getSequence(self, name, field, table):
+        name=self._sequenceName(name, field, table)
         cur=self.conn.cursor()
         sql="select nextval('%s')" % name
         if self.verbose:
@@ -192,6 +254,19 @@ class PsycopgDBI(DBIBase):
             raise PyDOError("could not get value for sequence %s!" % name)
         return res[0]
 
+    def getSequenceValues(self, name, field, table, count):
+        name=self._sequenceName(name, field, table)
+        cur=self.conn.cursor()
+        sql="select nextval('%s') from generate_series(1, %d)" % (name, count)
+        if self.verbose:
+            debug("SQL: %s", (sql,))
+        cur.execute(sql)
+        res=cur.fetchall()
+        cur.close()
+        if len(res)!=count:
+            raise PyDOError("could not get values for sequence %s!" % name)
+        return [x[0] for x in res]
+
 
     def listTables(self, schema=None):
         """lists the tables in the database schema"""
@@ -217,6 +292,26 @@ class PsycopgDBI(DBIBase):
         return sorted(x[0] for x in res)
 
 
+    def schemaFingerprint(self, schema=None):
+        """a digest of the schema's rows in pg_class, whose versions
+        (xmin) change with any DDL on its tables, indexes and views"""
+        if schema is None:
+            schema='public'
+        sql="""
+        SELECT md5(string_agg(c.relname || ':' || c.xmin::text, ','
+                              ORDER BY c.relname))
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid=c.relnamespace
+        WHERE n.nspname=%s
+        """
+        cur=self.conn.cursor()
+        if self.verbose:
+            debug("SQL: %s", (sql,))
+        cur.execute(sql, (schema,))
+        res=cur.fetchone()
+        cur.close()
+        return res[0]
+
     def describeTable(self, table, schema=None):
         # verify that the table exists
         sql = """
@@ -323,3 +418,81 @@ class PsycopgDBI(DBIBase):
             d[f.name] = f
         return (d, unique)
 
+    def describeSchema(self, schema=None, sequence_mapper=None):
+        """describes every table and view in the schema with three
+        queries, rather than the four describeTable() runs for each"""
+        if schema is None:
+            schema='public'
+        cur=self.conn.cursor()
+        def execute(sql):
+            if self.verbose:
+                debug("SQL: %s", (sql,))
+            cur.execute(sql, (schema,))
+
+        sql = """
+        SELECT c.relname, a.attname, a.attnum
+        FROM pg_catalog.pg_attribute a
+        JOIN pg_catalog.pg_class c ON c.oid=a.attrelid
+        JOIN pg_catalog.pg_namespace n ON n.oid=c.relnamespace
+        WHERE n.nspname=%s
+          AND c.relkind IN ('r', 'p', 'v')
+          AND a.attnum > 0
+          AND NOT a.attisdropped
+        ORDER BY c.relname, a.attnum
+        """
+        execute(sql)
+        # as in describeTable(), fields are keyed by number at first
+        tables = {}
+        for table, name, num in cur.fetchall():
+            tables.setdefault(table, {})[num] = Field(name)
+
+        sql = """
+        SELECT c.relname, i.indkey
+        FROM pg_catalog.pg_index i
+        JOIN pg_catalog.pg_class c ON c.oid=i.indrelid
+        JOIN pg_catalog.pg_namespace n ON n.oid=c.relnamespace
+        JOIN pg_catalog.pg_attribute a
+          ON a.attrelid=c.oid AND a.attnum=i.indkey[0]
+        WHERE n.nspname=%s
+          AND i.indisunique
+          AND a.attnotnull
+        """
+        execute(sql)
+        uniques = {}
+        for table, indkey in cur.fetchall():
+            fields = tables.get(table)
+            if fields is None:
+                continue
+            L=[int(i) for i in indkey.split(' ')]
+            if [x for x in L if x < 0]:
+                if self.verbose:
+                    debug("skipping constraint with system columns: %s" % indkey)
+                continue
+            if len(L) == 1:
+                fields[L[0]].unique = True
+            else:
+                uniques.setdefault(table, set()).add(
+                    frozenset([fields[i].name for i in L]))
+
+        sql = """
+        SELECT c.relname
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid=c.relnamespace
+        WHERE n.nspname=%s
+          AND c.relkind = 'S'
+        """
+        execute(sql)
+        sequences = set(row[0] for row in cur.fetchall())
+        cur.close()
+
+        described = {}
+        for table, fields in tables.items():
+            d = {}
+            for f in fields.values():
+                sequence = '%s_%s_seq' % (table, f.name)
+                if sequence in sequences:
+                    f.sequence = sequence
+                d[f.name] = f
+            described[table] = (d, uniques.get(table, set()))
+        return described
+
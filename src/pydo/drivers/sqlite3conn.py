@@ -10,6 +10,8 @@ from pydo.exceptions import PyDOError
 from pydo.dbtypes import (DATE, TIMESTAMP, BINARY, INTERVAL,
                           date_formats, timestamp_formats)
 from pydo.log import debug
+from itertools import groupby
+from operator import itemgetter
 from pydo.operators import BindingConverter
 
 import time
@@ -27,6 +29,13 @@ class Sqlite3DBI(DBIBase):
    # sqlite uses an auto increment approach to sequences
    auto_increment=True
    paramstyle=sqlite.paramstyle
+   # row values arrived in sqlite 3.15
+   row_value_in=row_value_compare=sqlite.sqlite_version_info >= (3, 15)
+   # the sqlite module caches prepared statements itself
+   prepare_connect_arg='cached_statements'
+   # leave room below SQLITE_MAX_VARIABLE_NUMBER (999 before sqlite
+   # 3.32) for the query's other binds
+   large_in_threshold=500
    # tables created in a transaction aren't dropped on rollback
    _keeps_tables=True
 
@@ -47,6 +56,10 @@ class Sqlite3DBI(DBIBase):
    def getAutoIncrement(self, name):
       return self._lastrowid
 
+   def tempColumnType(self, values):
+      # an sqlite column without a type holds values of any type
+      return ''
+
    def listTables(self, schema=None):
       """list the tables in the database schema.
       The schema parameter is not supported by this driver.
@@ -62,6 +75,17 @@ class Sqlite3DBI(DBIBase):
       return ()
 
 
+   def schemaFingerprint(self, schema=None):
+      """sqlite increments the schema version with every change to
+      the schema."""
+      if schema is not None:
+         raise ValueError("db schemas not supported by sqlite driver")
+      c=self.conn.cursor()
+      c.execute("PRAGMA schema_version")
+      res=c.fetchone()
+      c.close()
+      return str(res[0])
+
    def describeTable(self, table, schema=None):
       if schema is not None:
          raise ValueError("db schemas not supported by sqlite driver")
@@ -102,7 +126,8 @@ class Sqlite3DBI(DBIBase):
       execute(sql)
       res=c.fetchall()
       for row in res:
-         seq, name, uneek=row
+         # newer versions of sqlite add origin and partial columns
+         seq, name, uneek=row[:3]
          if uneek:
             sql="pragma index_info('%s')" % name
             execute(sql)
@@ -113,6 +138,56 @@ class Sqlite3DBI(DBIBase):
       c.close()
       return fields, unique
 
+   def describeSchema(self, schema=None, sequence_mapper=None):
+      """describes every table in two queries, with the pragma
+      table-valued functions of sqlite 3.16+.
+      """
+      if schema is not None:
+         raise ValueError("db schemas not supported by sqlite driver")
+      if getattr(sqlite, 'sqlite_version_info', (0,)) < (3, 16, 0):
+         return super(Sqlite3DBI, self).describeSchema(schema, sequence_mapper)
+      c=self.conn.cursor()
+
+      if self.verbose:
+         def execute(sql):
+            debug('SQL: %s', (sql,))
+            c.execute(sql)
+      else:
+         execute=c.execute
+
+      described={}
+      nullable={}
+      sql="""SELECT m.name, p.name, p.type, p."notnull", p.pk
+             FROM sqlite_master m, pragma_table_info(m.name) p
+             WHERE m.type='table'
+             ORDER BY m.name, p.cid"""
+      execute(sql)
+      for table, name, type, notnull, pk in c.fetchall():
+         if table not in described:
+            described[table]=({}, set())
+            nullable[table]=set()
+         fields=described[table][0]
+         # as in describeTable()
+         if type=='INTEGER' and int(pk):
+            fields[name]=Sequence(name)
+         else:
+            fields[name]=Field(name)
+         if not int(notnull):
+            nullable[table].add(name)
+
+      sql="""SELECT m.name, l.name, i.name
+             FROM sqlite_master m, pragma_index_list(m.name) l,
+                  pragma_index_info(l.name) i
+             WHERE m.type='table' AND l."unique"
+             ORDER BY m.name, l.name, i.seqno"""
+      execute(sql)
+      for (table, index), rows in groupby(c.fetchall(), itemgetter(0, 1)):
+         unset=frozenset(r[2] for r in rows)
+         if not unset.intersection(nullable[table]):
+            described[table][1].add(unset)
+      c.close()
+      return described
+
    def autocommit():
       def fget(self):
          return self.conn.isolation_level=='IMMEDIATE'
@@ -15,6 +15,8 @@ from pydo.exceptions import PyDOError
 from pydo.dbtypes import (DATE, TIMESTAMP, BINARY, INTERVAL,
                           date_formats, timestamp_formats)
 from pydo.log import debug
+from itertools import groupby
+from operator import itemgetter
 from pydo.operators import BindingConverter
 
 import time
@@ -92,6 +94,14 @@ class SqliteConverter(BindingConverter):
 class SqliteDBI(DBIBase):
    # sqlite uses an auto increment approach to sequences
    auto_increment=True
+   # the default SQLITE_MAX_VARIABLE_NUMBER before sqlite 3.32
+   max_bind_params=999
+   # row values arrived in sqlite 3.15
+   row_value_in=row_value_compare=getattr(sqlite, 'sqlite_version_info', ()) >= (3, 15)
+   # the sqlite3 module caches prepared statements itself
+   prepare_connect_arg='cached_statements' if sys.version_info[0] == 3 else None
+   # leave room below max_bind_params for the query's other binds
+   large_in_threshold=500
 
    def __init__(self, connectArgs, pool=None, verbose=False, initFunc=None):
       if pool and not hasattr(pool, 'connect'):
@@ -113,6 +123,10 @@ class SqliteDBI(DBIBase):
    def getAutoIncrement(self, name):
       return self.conn.db.sqlite_last_insert_rowid()
 
+   def tempColumnType(self, values):
+      # an sqlite column without a type holds values of any type
+      return ''
+
    def listTables(self, schema=None):
       """list the tables in the database schema.
       The schema parameter is not supported by this driver.
@@ -127,6 +141,17 @@ class SqliteDBI(DBIBase):
          return sorted(x[0] for x in res)
       return ()
 
+   def schemaFingerprint(self, schema=None):
+      """sqlite increments the schema version with every change to
+      the schema."""
+      if schema is not None:
+         raise ValueError("db schemas not supported by sqlite driver")
+      c=self.conn.cursor()
+      c.execute("PRAGMA schema_version")
+      res=c.fetchone()
+      c.close()
+      return str(res[0])
+
    def describeTable(self, table, schema=None):
       if schema is not None:
          raise ValueError("db schemas not supported by sqlite driver")
@@ -179,6 +204,56 @@ class SqliteDBI(DBIBase):
       c.close()
       return fields, unique
 
+   def describeSchema(self, schema=None, sequence_mapper=None):
+      """describes every table in two queries, with the pragma
+      table-valued functions of sqlite 3.16+.
+      """
+      if schema is not None:
+         raise ValueError("db schemas not supported by sqlite driver")
+      if getattr(sqlite, 'sqlite_version_info', (0,)) < (3, 16, 0):
+         return super(SqliteDBI, self).describeSchema(schema, sequence_mapper)
+      c=self.conn.cursor()
+
+      if self.verbose:
+         def execute(sql):
+            debug('SQL: %s', (sql,))
+            c.execute(sql)
+      else:
+         execute=c.execute
+
+      described={}
+      nullable={}
+      sql="""SELECT m.name, p.name, p.type, p."notnull", p.pk
+             FROM sqlite_master m, pragma_table_info(m.name) p
+             WHERE m.type='table'
+             ORDER BY m.name, p.cid"""
+      execute(sql)
+      for table, name, type, notnull, pk in c.fetchall():
+         if table not in described:
+            described[table]=({}, set())
+            nullable[table]=set()
+         fields=described[table][0]
+         # as in describeTable()
+         if type=='INTEGER' and int(pk):
+            fields[name]=Sequence(name)
+         else:
+            fields[name]=Field(name)
+         if not int(notnull):
+            nullable[table].add(name)
+
+      sql="""SELECT m.name, l.name, i.name
+             FROM sqlite_master m, pragma_index_list(m.name) l,
+                  pragma_index_info(l.name) i
+             WHERE m.type='table' AND l."unique"
+             ORDER BY m.name, l.name, i.seqno"""
+      execute(sql)
+      for (table, index), rows in groupby(c.fetchall(), itemgetter(0, 1)):
+         unset=frozenset(r[2] for r in rows)
+         if not unset.intersection(nullable[table]):
+            described[table][1].add(unset)
+      c.close()
+      return described
+
    def autocommit():
       # sqlite3.Connection object has no `autocommit` attribute
       # https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection
@@ -9,6 +9,8 @@ from pydo.dbi import DBIBase, ConnectionPool
 from pydo.field import Field, Sequence
 from pydo.exceptions import PyDOError
 from pydo.log import debug
+from itertools import groupby
+from operator import itemgetter
 from pydo.operators import BindingConverter
 
 #
@@ -71,6 +73,14 @@ def sqlite_connect (*args, **kwargs):
 class SqliteDBI(DBIBase):
    # sqlite uses an auto increment approach to sequences
    auto_increment=True
+   # the default SQLITE_MAX_VARIABLE_NUMBER before sqlite 3.32
+   max_bind_params=999
+   # row values arrived in sqlite 3.15
+   row_value_in=row_value_compare=sqlite.sqlite_version_info >= (3, 15)
+   # the sqlite module caches prepared statements itself
+   prepare_connect_arg='cached_statements'
+   # leave room below max_bind_params for the query's other binds
+   large_in_threshold=500
    paramstyle = 'qmark'
 
    def __init__(self, connectArgs, pool=None, verbose=False, initFunc=None):
@@ -95,6 +105,10 @@ class SqliteDBI(DBIBase):
       sql="SELECT last_insert_rowid ()"
       return self.conn.execute (sql).fetchone ()[0]
 
+   def tempColumnType(self, values):
+      # an sqlite column without a type holds values of any type
+      return ''
+
    def listTables(self, schema=None):
       """list the tables in the database schema.
       The schema parameter is not supported by this driver.
@@ -102,7 +116,18 @@ class SqliteDBI(DBIBase):
       if schema is not None:
          raise ValueError("db schemas not supported by sqlite driver")
       sql="SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"
-      return self.conn.execute (sql).fetchall ()
+      return [x[0] for x in self.conn.execute (sql).fetchall ()]
+
+   def schemaFingerprint(self, schema=None):
+      """sqlite increments the schema version with every change to
+      the schema."""
+      if schema is not None:
+         raise ValueError("db schemas not supported by sqlite driver")
+      c=self.conn.cursor()
+      c.execute("PRAGMA schema_version")
+      res=c.fetchone()
+      c.close()
+      return str(res[0])
 
    def describeTable(self, table, schema=None):
       if schema is not None:
@@ -144,7 +169,8 @@ class SqliteDBI(DBIBase):
       execute(sql)
       res=c.fetchall()
       for row in res:
-         seq, name, uneek=row
+         # newer versions of sqlite add origin and partial columns
+         seq, name, uneek=row[:3]
          if uneek:
             sql="pragma index_info('%s')" % name
             execute(sql)
@@ -155,6 +181,56 @@ class SqliteDBI(DBIBase):
       c.close()
       return fields, unique
 
+   def describeSchema(self, schema=None, sequence_mapper=None):
+      """describes every table in two queries, with the pragma
+      table-valued functions of sqlite 3.16+.
+      """
+      if schema is not None:
+         raise ValueError("db schemas not supported by sqlite driver")
+      if getattr(sqlite, 'sqlite_version_info', (0,)) < (3, 16, 0):
+         return super(SqliteDBI, self).describeSchema(schema, sequence_mapper)
+      c=self.conn.cursor()
+
+      if self.verbose:
+         def execute(sql):
+            debug('SQL: %s', (sql,))
+            c.execute(sql)
+      else:
+         execute=c.execute
+
+      described={}
+      nullable={}
+      sql="""SELECT m.name, p.name, p.type, p."notnull", p.pk
+             FROM sqlite_master m, pragma_table_info(m.name) p
+             WHERE m.type='table'
+             ORDER BY m.name, p.cid"""
+      execute(sql)
+      for table, name, type, notnull, pk in c.fetchall():
+         if table not in described:
+            described[table]=({}, set())
+            nullable[table]=set()
+         fields=described[table][0]
+         # as in describeTable()
+         if type=='INTEGER' and int(pk):
+            fields[name]=Sequence(name)
+         else:
+            fields[name]=Field(name)
+         if not int(notnull):
+            nullable[table].add(name)
+
+      sql="""SELECT m.name, l.name, i.name
+             FROM sqlite_master m, pragma_index_list(m.name) l,
+                  pragma_index_info(l.name) i
+             WHERE m.type='table' AND l."unique"
+             ORDER BY m.name, l.name, i.seqno"""
+      execute(sql)
+      for (table, index), rows in groupby(c.fetchall(), itemgetter(0, 1)):
+         unset=frozenset(r[2] for r in rows)
+         if not unset.intersection(nullable[table]):
+            described[table][1].add(unset)
+      c.close()
+      return described
+
    #
    # Slightly confusingly, pysqlite doesn't offer an autocommit
    # mode as such: you set it by setting the isolation level
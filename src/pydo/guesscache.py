@@ -7,8 +7,10 @@ else:
 import os
 import tempfile
 import time
+from threading import Lock
 
 from pydo.utils import getuser
+from pydo.dbi import getConnection
 
 class GuessCache(object):
     """
@@ -60,8 +62,168 @@ class GuessCache(object):
         os.rename(tmppath, path)
 
 
-__all__=['GuessCache']
+class SqliteGuessCache(object):
+    """
+    a GuessCache-compatible cache of table descriptions, kept in a
+    single sqlite database file and memoized in memory.
+
+    Entries are keyed by the connection alias, schema and table of a
+    class, rather than the class itself, and all those for an alias
+    and schema are loaded together the first time one is needed.  If
+    check_schema is true and the database driver can give a schema
+    fingerprint (see DBIBase.schemaFingerprint()), entries stored
+    under a different fingerprint are ignored, so a change to the
+    schema invalidates them; the fingerprint is fetched once per
+    alias and schema in each process.  warm() fills the cache for a
+    whole schema in one pass.
+    """
+    def __init__(self, path=None, check_schema=True):
+        if path is None:
+            path=os.path.join(tempfile.gettempdir(),
+                              '_'.join(x for x in (getuser(), 'pydoguesscache.db') if x))
+        self.path=path
+        self.check_schema=check_schema
+        self._lock=Lock()
+        self._db=None
+        # (alias, schema) -> (fingerprint, {name: data})
+        self._memo={}
+
+    def _getDB(self):
+        if self._db is None:
+            import sqlite3
+            db=sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            db.execute("""CREATE TABLE IF NOT EXISTS guesses (
+                          alias TEXT NOT NULL,
+                          schema TEXT NOT NULL,
+                          name TEXT NOT NULL,
+                          fingerprint TEXT,
+                          data BLOB NOT NULL,
+                          PRIMARY KEY (alias, schema, name))""")
+            db.commit()
+            self._db=db
+        return self._db
+
+    @staticmethod
+    def _key(obj):
+        name=obj.getTable(False)
+        mapper=obj.sequence_mapper
+        if mapper:
+            # describeTable() output depends on the mapper too
+            name='%s;%s.%s' % (name, mapper.__module__,
+                               getattr(mapper, '__qualname__', mapper.__name__))
+        return obj.connectionAlias, obj.schema or '', name
+
+    def _entries(self, alias, schema):
+        memo=self._memo.get((alias, schema))
+        if memo is None:
+            if self.check_schema:
+                fingerprint=getConnection(alias).schemaFingerprint(schema or None)
+            else:
+                fingerprint=None
+            rows=self._getDB().execute(
+                "SELECT name, fingerprint, data FROM guesses "
+                "WHERE alias=? AND schema=?", (alias, schema)).fetchall()
+            entries=dict((name, pickle.loads(data)) for name, fp, data in rows
+                         if fingerprint is None or fp==fingerprint)
+            memo=self._memo[(alias, schema)]=(fingerprint, entries)
+        return memo
+
+    def retrieve(self, obj):
+        alias, schema, name=self._key(obj)
+        self._lock.acquire()
+        try:
+            return self._entries(alias, schema)[1].get(name)
+        finally:
+            self._lock.release()
+
+    def store(self, obj, data):
+        alias, schema, name=self._key(obj)
+        self._lock.acquire()
+        try:
+            fingerprint, entries=self._entries(alias, schema)
+            db=self._getDB()
+            db.execute("INSERT OR REPLACE INTO guesses VALUES (?, ?, ?, ?, ?)",
+                       (alias, schema, name, fingerprint, pickle.dumps(data, 2)))
+            db.commit()
+            entries[name]=data
+        finally:
+            self._lock.release()
+
+    def clear(self, obj=None):
+        """removes the entry for a class, or all entries if obj is None"""
+        self._lock.acquire()
+        try:
+            db=self._getDB()
+            if obj is None:
+                db.execute("DELETE FROM guesses")
+                self._memo.clear()
+            else:
+                alias, schema, name=self._key(obj)
+                db.execute("DELETE FROM guesses WHERE alias=? AND schema=? AND name=?",
+                           (alias, schema, name))
+                memo=self._memo.get((alias, schema))
+                if memo:
+                    memo[1].pop(name, None)
+            db.commit()
+        finally:
+            self._lock.release()
+
+    def warm(self, alias, schema=None):
+        """describes every table in a schema of the database of a
+        connection alias, replacing whatever was cached for it, and
+        returns the number of tables.  Classes with a sequence_mapper
+        aren't covered."""
+        dbi=getConnection(alias)
+        fingerprint=dbi.schemaFingerprint(schema)
+        entries=dbi.describeSchema(schema)
+        schema=schema or ''
+        self._lock.acquire()
+        try:
+            db=self._getDB()
+            db.execute("DELETE FROM guesses WHERE alias=? AND schema=?",
+                       (alias, schema))
+            db.executemany("INSERT INTO guesses VALUES (?, ?, ?, ?, ?)",
+                           [(alias, schema, name, fingerprint, pickle.dumps(data, 2))
+                            for name, data in entries.items()])
+            db.commit()
+            self._memo[(alias, schema)]=(fingerprint, entries)
+        finally:
+            self._lock.release()
+        return len(entries)
+
+
+def main(args=None):
+    """warms a SqliteGuessCache from the command line:
+
+      python -m pydo.guesscache -a ALIAS [-s SCHEMA] [-f CACHEFILE] DRIVER CONNECTARGS
+
+    CONNECTARGS is a JSON object of keyword arguments for the driver,
+    or else a string (for instance, an sqlite database file).  The
+    alias must be the one the classes use, since entries are keyed by
+    it."""
+    import json
+    from optparse import OptionParser
+    from pydo.dbi import initAlias
+    parser=OptionParser(usage="%prog -a ALIAS [-s SCHEMA] [-f CACHEFILE] DRIVER CONNECTARGS")
+    parser.add_option('-a', '--alias', help='the connection alias of the classes')
+    parser.add_option('-s', '--schema', help='the database schema')
+    parser.add_option('-f', '--file', help='the cache file')
+    opts, args=parser.parse_args(args)
+    if len(args)!=2 or not opts.alias:
+        parser.error("an alias, driver and connection arguments are required")
+    driver, connectArgs=args
+    try:
+        connectArgs=json.loads(connectArgs)
+    except ValueError:
+        pass
+    initAlias(opts.alias, driver, connectArgs)
+    cache=SqliteGuessCache(opts.file)
+    n=cache.warm(opts.alias, opts.schema)
+    print("cached %d tables in %s" % (n, cache.path))
 
 
+__all__=['GuessCache', 'SqliteGuessCache']
 
 
+if __name__=='__main__':
+    main()
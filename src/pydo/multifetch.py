@@ -1,6 +1,5 @@
 from pydo.base import PyDO
-from pydo.log import debug
-from pydo.utils import iflatten, _strip_tablename
+from pydo.utils import iflatten, _strip_tablename, every
 from inspect import isclass
 import string
 import sys
@@ -30,6 +29,9 @@ class TableAlias(object):
     def getDBI(self):
         return self.obj.getDBI()
 
+    def getAsyncDBI(self):
+        return self.obj.getAsyncDBI()
+
     def __call__(self, **kwargs):
         return self.obj(**kwargs)
 
@@ -49,6 +51,56 @@ def _processResultSpec(resultSpec):
                 raise ValueError("table alias or string expression: %s" % i)
             yield i
 
+def _prepare(resultSpec, sqlTemplate, values, kwargs, asynchronous=False):
+    """returns the DBI object (the async one, if asynchronous is
+    true), the plan for turning rows into result tuples, the names of
+    the columns, the SQL and the bind values for a fetch"""
+    resultSpec=list(_processResultSpec(resultSpec))
+    objs=[x for x in resultSpec if not isinstance(x, basestring)]
+    # check that all objs have the same connectionAlias
+    caliases=tuple(frozenset(o.connectionAlias for o in objs))
+    if len(caliases)>1:
+        raise ValueError("objects passed to fetch must have same connection alias")
+    elif len(caliases)==0:
+        raise ValueError("must supply some object in result spec")
+    if asynchronous:
+        dbi=objs[0].getAsyncDBI()
+    else:
+        dbi=objs[0].getDBI()
+
+    tables = ', '.join(x.getTable() for x in objs)
+    # if an item has no uniqueness constraints, it really could
+    # be all null; otherwise, take all-nullness to mean that
+    # we're dealing with a join with a no matching row for that
+    # table.  "noneable" means here, "we can represent it as None"
+    allcols=[]
+    # for each item in the result spec, the item, the slice of the
+    # row containing its data, and (for objects) the field names
+    # and whether an all-null slice means None
+    plan=[]
+    p=0
+    for item in resultSpec:
+        if hasattr(item, 'getColumns'):
+            cols=sorted(item.getColumns(True))
+            allcols.append(cols)
+            plan.append((item,
+                         p,
+                         p+len(cols),
+                         [_strip_tablename(col) for col in cols],
+                         bool(item.getUniquenessConstraints())))
+            p+=len(cols)
+        else:
+            allcols.append(item)
+            plan.append((item, p, p+1, None, False))
+            p+=1
+    columns=', '.join(iflatten(allcols))
+    sql=string.Template(sqlTemplate).substitute(kwargs,
+                                                TABLES=tables,
+                                                COLUMNS=columns)
+    if len(values)==1 and isinstance(values[0], dict):
+        values=values[0]
+    return dbi, plan, list(iflatten(allcols)), sql, values
+
 def iterfetch(resultSpec, sqlTemplate, *values, **kwargs):
     """
     a method that executes sql and returns rows of tuples of PyDO
@@ -75,11 +127,12 @@ def iterfetch(resultSpec, sqlTemplate, *values, **kwargs):
       $TABLES -- a list of tables similarly computed.
 
     Additional interpolation variables may be passed in as keyword
-    arguments.  Bind variables to the SQL may also be passed in,
-    through positional arguments; if there is only one positional
-    argument, and it is a dictionary, it will be used instead of a
-    list of values, under the assumption that either the 'named' or
-    'pyformat' paramstyle is being used.
+    arguments, except for "arraysize", which is reserved.  Bind
+    variables to the SQL may also be passed in, through positional
+    arguments; if there is only one positional argument, and it is a
+    dictionary, it will be used instead of a list of values, under the
+    assumption that either the 'named' or 'pyformat' paramstyle is
+    being used.
 
     For each element E in the resultSpec, the result row contains one
     element F.  If E is a PyDO class, F will either be an instance of
@@ -87,81 +140,77 @@ def iterfetch(resultSpec, sqlTemplate, *values, **kwargs):
     E has a uniqueness constraint (which in PyDO is implicitly a not
     null constraint), None.  If E is a string, F will be whatever the
     cursor returned for that column.
-    """
-
-    resultSpec=list(_processResultSpec(resultSpec))
-    objs=[x for x in resultSpec if not isinstance(x, basestring)]
-    # check that all objs have the same connectionAlias
-    caliases=tuple(frozenset(o.connectionAlias for o in objs))
-    if len(caliases)>1:
-        raise ValueError("objects passed to fetch must have same connection alias")
-    elif len(caliases)==0:
-        raise ValueError("must supply some object in result spec")
-    dbi=objs[0].getDBI()
 
-    tables = ', '.join(x.getTable() for x in objs)
-    # if an item has no uniqueness constraints, it really could
-    # be all null; otherwise, take all-nullness to mean that
-    # we're dealing with a join with a no matching row for that
-    # table.  "noneable" means here, "we can represent it as None"
-    noneable=[o for o in objs if o.getUniquenessConstraints()]
-    allcols=[]
-    for item in resultSpec:
-        if hasattr(item, 'getColumns'):
-            allcols.append(sorted(item.getColumns(True)))
-        else:
-            allcols.append(item)
-    columns=', '.join(iflatten(allcols))
-    sql=string.Template(sqlTemplate).substitute(kwargs,
-                                                TABLES=tables,
-                                                COLUMNS=columns)
-    c=dbi.cursor()
-    if len(values)==1 and isinstance(values[0], dict):
-        values=values[0]
-    if dbi.verbose:
-        debug('SQL: %s', sql)
-        debug('bind variables: %s', values)
-    # psycopg may not like an empty tuple here
-    if values:
-        c.execute(sql, values)
-    else:
-        c.execute(sql)
-    result=c.fetchall()
-    c.close()
-    if not result:
-        raise StopIteration
+    Rows are fetched lazily from a server-side cursor (where the
+    driver supports it), arraysize at a time; the "arraysize" keyword
+    argument overrides the DBI object's default.  The cursor is
+    closed when the rows are exhausted or the iterator is closed, and
+    if the connection is verbose the number of rows fetched is logged.
+    """
+    return _iterfetch(resultSpec, sqlTemplate, values, kwargs, True)
+
+def _iterfetch(resultSpec, sqlTemplate, values, kwargs, server):
+    arraysize=kwargs.pop('arraysize', None)
+    dbi, plan, columns, sql, values=_prepare(resultSpec, sqlTemplate, values, kwargs)
+    batches=dbi.iterBatches(sql, values, arraysize, server=server)
+    try:
+        for description, rows in batches:
+            for row in rows:
+                yield _resultRow(plan, row)
+    finally:
+        batches.close()
+
+def _resultRow(plan, row):
+    """turns a row into a result tuple according to a plan made by
+    _prepare()"""
     retrow=[]
-    for row in result:
-        del retrow[:]
-        p=0
-        for o, cols in zip(resultSpec, allcols):
-            if isinstance(o, basestring):
-                retrow.append(row[p])
-                p+=1
-            else:
-                assert isinstance(o, TableAlias) or (isclass(o) and issubclass(o, PyDO))
-                d={}
-                for col in cols:
-                    d[_strip_tablename(col)]=row[p]
-                    p+=1
-                if o in noneable:
-                    for v in d.values():
-                        if v is not None:
-                            notnull=True
-                            break
-                        else:
-                            notnull=False
-                else:
-                    notnull=True
-                if notnull:
-                    retrow.append(o(**d))
-                else:
-                    retrow.append(None)
-        yield tuple(retrow)
+    for o, start, end, names, noneable in plan:
+        if names is None:
+            retrow.append(row[start])
+            continue
+        data=row[start:end]
+        if noneable and every(None, data):
+            retrow.append(None)
+        else:
+            retrow.append(o(**dict(zip(names, data))))
+    return tuple(retrow)
 
 def fetch(resultSpec, sqlTemplate, *values, **kwargs):
-    return list(iterfetch(resultSpec, sqlTemplate, *values, **kwargs))
-
-fetch.__doc__=iterfetch.__doc__
+    if kwargs.pop('columnar', False):
+        arraysize=kwargs.pop('arraysize', None)
+        dbi, plan, columns, sql, values=_prepare(resultSpec, sqlTemplate, values, kwargs)
+        return dbi.executeColumns(sql, values, arraysize=arraysize, names=columns)
+    # all the rows are wanted at once, so a server-side cursor would
+    # only add round trips
+    return list(_iterfetch(resultSpec, sqlTemplate, values, kwargs, False))
+
+fetch.__doc__=iterfetch.__doc__+"""
+    fetch() fetches the rows with an ordinary cursor, and returns a
+    list of the tuples, unless the keyword argument
+    "columnar" is true, in which case it returns the result by column,
+    as a dictionary mapping the columns in the select list (qualified
+    by table name or alias for PyDO classes) to arrays of values (see
+    pydo.columnar), without creating any PyDO instances.
+    """
 
-__all__=['fetch']
+async def aiterfetch(resultSpec, sqlTemplate, *values, **kwargs):
+    """an asynchronous iterator counterpart of iterfetch(), for PyDO
+    classes whose connectionAlias is asynchronous (see pydo.aio)"""
+    arraysize=kwargs.pop('arraysize', None)
+    dbi, plan, columns, sql, values=_prepare(resultSpec, sqlTemplate, values,
+                                             kwargs, True)
+    batches=dbi.iterBatches(sql, values, arraysize)
+    try:
+        async for description, rows in batches:
+            for row in rows:
+                yield _resultRow(plan, row)
+    finally:
+        await batches.aclose()
+
+async def afetch(resultSpec, sqlTemplate, *values, **kwargs):
+    """coroutine counterpart of fetch(), without the columnar
+    option"""
+    return [row async for row in aiterfetch(resultSpec, sqlTemplate,
+                                            *values, **kwargs)]
+
+__all__=['fetch', 'iterfetch', 'afetch', 'aiterfetch']
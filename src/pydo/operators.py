@@ -83,7 +83,8 @@ appropriate formats and accumulating the values inside the converter.
 """
 
 
-__all__=['FIELD', 'CONSTANT', 'NULL', 'SET', 'SQLOperator', 'BindingConverter']
+__all__=['FIELD', 'CONSTANT', 'NULL', 'SET', 'SQLOperator', 'BindingConverter',
+         'render']
 import sys
 if sys.version_info[0] == 3:
     basestring=str
@@ -188,18 +189,15 @@ class SQLOperator(SQLtuple):
         if not isinstance(t, SQLOperator):
             tl=[t[0]]
             for x in t[1:]:
-                if isinstance(x, (SET, tuple)):
-                    if not isinstance(x, (SET, SQLOperator)):
-                        x=SQLOperator(x, converter)
-                    else:
-                        x.setConverter(converter)
+                if isinstance(x, tuple) and not isinstance(x, SQLOperator):
+                    x=SQLOperator(x, converter)
                 tl.append(x)
             t=tuple(tl)
         return tuple.__new__(cls, t)
 
     def __init__(self, t, converter=None):
         super(SQLOperator, self).__init__(t)
-        # is this being done twice?
+        # this sets the converter of the arguments, too
         self.setConverter(converter)
 
     def setConverter(self, converter):
@@ -342,6 +340,33 @@ class BETWEEN(PolyadicOperator):
 
 __all__.append("BETWEEN")
 
+class ROW(PolyadicOperator):
+    """a row value constructor, for comparing several columns at once:
+
+    >>> IN(ROW(FIELD('a'), FIELD('b')), SET(ROW(1, 2), ROW(3, 4)))
+    ((a, b) IN ((1, 2), (3, 4)))
+    """
+    operator='ROW'
+
+    def __repr__(self):
+        return "(%s)" % ', '.join(self._convert(a) for a in self[1:])
+
+__all__.append("ROW")
+
+class ANY(MonadicOperator):
+    """compares with the elements of an array, bound as a single
+    value, in databases that support it (such as PostgreSQL):
+
+    >>> EQ(FIELD('a'), ANY([1, 2, 3]))
+    (a = ANY([1, 2, 3]))
+    """
+    operator='ANY'
+
+    def _repr_single(self):
+        return "ANY(%s)" % self._convert(self[1])
+
+__all__.append("ANY")
+
 class BindingConverter(object):
     """A value converter that uses bind variables.
 
@@ -411,6 +436,51 @@ class BindingConverter(object):
             return converter(val)
         return val
 
+    def placeholders(self, n):
+        """returns a list of n bind variable markers in the
+        converter's paramstyle, for a statement that will be executed
+        repeatedly (e.g., with executemany()) with rows of values
+        prepared by rowValues().  Unlike calling the converter, this
+        doesn't accumulate any values."""
+        p=self.paramstyle
+        if p=='format':
+            return ['%s']*n
+        elif p=='qmark':
+            return ['?']*n
+        elif p=='numeric':
+            return [':%d' % i for i in range(1, n+1)]
+        elif p=='named':
+            return [':n%d' % i for i in range(1, n+1)]
+        elif p=='pyformat':
+            return ['%%(n%d)s' % i for i in range(1, n+1)]
+
+    def rowValues(self, vals):
+        """converts a row of values into bind variables matching the
+        markers returned by placeholders().  None is bound as a value
+        (i.e., NULL), not rendered into SQL."""
+        vals=[self.convert(v) for v in vals]
+        if self.paramstyle in ('named', 'pyformat'):
+            return dict(('n%d' % i, v) for i, v in enumerate(vals, 1))
+        return vals
+
+    def bindValues(self, vals):
+        """binds a list of values (none of them None or SQL, which
+        would be rendered into the SQL instead) and returns their bind
+        variable markers, as calling the converter on each in turn
+        would."""
+        vals=[self.convert(v) for v in vals]
+        p=self.paramstyle
+        if p in ('named', 'pyformat'):
+            names=[self._genName() for v in vals]
+            self._named_values.update(zip(names, vals))
+            if p=='named':
+                return [":%s" % n for n in names]
+            return ["%%(%s)s" % n for n in names]
+        self._values.extend(vals)
+        if p=='numeric':
+            return [":%d" % self._genNumber() for v in vals]
+        return ['%s' if p=='format' else '?']*len(vals)
+
     def __call__(self, val):
         if val is None:
             return 'NULL'
@@ -435,6 +505,93 @@ class BindingConverter(object):
             self._named_values[name]=val
             return "%%(%s)s" % name
 
+
+# SQL templates for the shapes of operator expressions rendered with
+# render(): the literal SQL fragments between their bind variables.
+# It is simply emptied if it gets too big.
+_templates={}
+_templates_size=1000
+_template_mark='\0'
+
+class _TemplateConverter(BindingConverter):
+    """a converter that marks where values go, rather than binding
+    them, and records the values in the order it sees them"""
+    def __init__(self):
+        super(_TemplateConverter, self).__init__('qmark')
+        self.seen=[]
+
+    def __call__(self, val):
+        if val is None or isinstance(val, (CONSTANT, SET, SQLOperator)):
+            return super(_TemplateConverter, self).__call__(val)
+        self.seen.append(val)
+        return _template_mark
+
+def _shape(x, values):
+    """returns a hashable key for the structure of an expression,
+    and appends its bindable values to values, in order."""
+    if isinstance(x, SQLOperator):
+        return (x.__class__, x[0])+tuple([_shape(y, values) for y in x[1:]])
+    if isinstance(x, SET):
+        vals=x.values
+        for y in vals:
+            if y is None or isinstance(y, (SQLOperator, SET, CONSTANT)):
+                return (SET,)+tuple(_shape(y, values) for y in vals)
+        # the usual case, a set of plain values
+        values.extend(vals)
+        return (SET, len(vals))
+    if isinstance(x, CONSTANT):
+        return (CONSTANT, x.name)
+    if x is None:
+        return None
+    values.append(x)
+    return _template_mark
+
+def _compile(x, values, converter):
+    """renders x to find the SQL fragments between its values, which
+    must be those of values; returns None if they aren't."""
+    tc=_TemplateConverter()
+    if hasattr(x, 'setConverter'):
+        x.setConverter(tc)
+    try:
+        sql=repr(x)
+    finally:
+        if hasattr(x, 'setConverter'):
+            x.setConverter(converter)
+    if len(tc.seen)!=len(values) \
+           or [v for v, w in zip(values, tc.seen) if v is not w] \
+           or sql.count(_template_mark)!=len(values):
+        return None
+    return tuple(sql.split(_template_mark))
+
+def render(x, converter):
+    """returns the SQL for an operator expression, binding its values
+    with converter, as repr() would after x.setConverter(converter).
+
+    The SQL for each shape of expression (its operators, constants,
+    nulls and number of values) is compiled once into a template and
+    cached, so expressions of the same shape with new values are
+    rendered by binding the values alone."""
+    if isinstance(x, tuple) and not isinstance(x, SQLOperator):
+        x=SQLOperator(x)
+    values=[]
+    key=_shape(x, values)
+    template=_templates.get(key)
+    if template is None:
+        template=_compile(x, values, converter)
+        if template is None:
+            # evidently not rendered in the order of its arguments
+            x.setConverter(converter)
+            return repr(x)
+        if len(_templates)>=_templates_size:
+            _templates.clear()
+        _templates[key]=template
+    if not values:
+        return template[0]
+    sql=[None]*(2*len(values)+1)
+    sql[::2]=template
+    sql[1::2]=converter.bindValues(values)
+    return ''.join(sql)
+
 if __name__=='__main__':
     import doctest
     doctest.testmod()
@@ -0,0 +1,109 @@
+"""
+running independent queries concurrently.
+
+A page that calls getSome() on several unrelated classes waits for
+each round trip in turn.  gather() runs such calls at the same time
+in a pool of worker threads, and returns their results in order:
+
+    >>> from pydo.parallel import defer, gather
+    >>> fungi, user=gather(defer(Fungus.getSome, genus='Boletus'),
+    ...                    defer(User.getUnique, id=uid))
+
+Each worker uses its own connection for each alias, as any thread
+does (see DBIBase), so the aliases should have connection pools; the
+connection is given back when the call is done, ending its
+transaction.  The calls should therefore be queries: changes they
+make are rolled back unless they commit them themselves.
+"""
+
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+from pydo import dbi as _dbi
+
+# the number of worker threads
+max_threads=8
+
+_executor=None
+_executor_lock=Lock()
+
+class Deferred(object):
+    """a call to be made later, made by defer()"""
+    __slots__=('func', 'args', 'kwargs')
+
+    def __init__(self, func, args, kwargs):
+        self.func=func
+        self.args=args
+        self.kwargs=kwargs
+
+    def __call__(self):
+        try:
+            return self.func(*self.args, **self.kwargs)
+        finally:
+            _endConnections()
+
+    def __repr__(self):
+        return '<Deferred %s>' % getattr(self.func, '__qualname__', self.func)
+
+def defer(func, *args, **kwargs):
+    """returns a Deferred call of func with the arguments given, for
+    gather()"""
+    return Deferred(func, args, kwargs)
+
+def _endConnections():
+    """gives back the connections the current thread has taken"""
+    for dbi in list(_dbi._connections.values()):
+        if 'connection' in dbi._local.__dict__:
+            dbi.endConnection()
+
+def _getExecutor():
+    global _executor
+    _executor_lock.acquire()
+    try:
+        if _executor is None:
+            _executor=ThreadPoolExecutor(max_threads)
+        return _executor
+    finally:
+        _executor_lock.release()
+
+def gather(*calls, **kwargs):
+    """makes the Deferred calls concurrently in worker threads and
+    returns a list of their results, in the same order.  If any
+    raises, the first exception (in order) is raised once all the
+    calls are done, unless the keyword argument return_exceptions is
+    true, in which case exceptions are returned as results."""
+    return_exceptions=kwargs.pop('return_exceptions', False)
+    if kwargs:
+        raise ValueError("unrecognized keyword arguments: %s" \
+                         % ', '.join(kwargs))
+    executor=_getExecutor()
+    futures=[executor.submit(c) for c in calls]
+    results=[]
+    error=None
+    for f in futures:
+        try:
+            res=f.result()
+        except Exception as e:
+            if not return_exceptions:
+                if error is None:
+                    error=e
+                continue
+            res=e
+        results.append(res)
+    if error is not None:
+        raise error
+    return results
+
+def shutdown():
+    """stops the worker threads (they are started again if needed)"""
+    global _executor
+    _executor_lock.acquire()
+    try:
+        executor, _executor=_executor, None
+    finally:
+        _executor_lock.release()
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+__all__=['defer', 'gather']
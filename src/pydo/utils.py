@@ -4,6 +4,8 @@ utility functions imported by other PyDO modules.
 
 import getpass
 import sys
+from collections import OrderedDict
+from threading import Lock
 from pydo.log import debug
 
 
@@ -100,6 +102,93 @@ def iflatten(*l):
 def flatten(*l):
     return list(iflatten(*l))
 
+def ichunks(iterable, size):
+    """yields lists of at most size items from iterable"""
+    chunk=[]
+    for i in iterable:
+        chunk.append(i)
+        if len(chunk)>=size:
+            yield chunk
+            chunk=[]
+    if chunk:
+        yield chunk
+
+class LRUCache(object):
+    """
+    a thread-safe mapping that discards its least recently used
+    entries when it grows beyond maxsize, and counts lookup hits and
+    misses.  A maxsize of 0 disables it.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize=maxsize
+        self.hits=0
+        self.misses=0
+        self._data=OrderedDict()
+        self._lock=Lock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            try:
+                val=self._data[key]
+            except KeyError:
+                self.misses+=1
+                return default
+            self._data.move_to_end(key)
+            self.hits+=1
+            return val
+        finally:
+            self._lock.release()
+
+    def __setitem__(self, key, val):
+        self.add(key, val)
+
+    def add(self, key, val):
+        """sets key to val, and returns a list of the values discarded
+        to make room for it"""
+        if self.maxsize<=0:
+            return [val]
+        evicted=[]
+        self._lock.acquire()
+        try:
+            self._data[key]=val
+            self._data.move_to_end(key)
+            while len(self._data)>self.maxsize:
+                evicted.append(self._data.popitem(last=False)[1])
+        finally:
+            self._lock.release()
+        return evicted
+
+    def pop(self, key, default=None):
+        self._lock.acquire()
+        try:
+            return self._data.pop(key, default)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+            self.hits=0
+            self.misses=0
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def stats(self):
+        """returns a dictionary of the cache's hits, misses, size and maxsize"""
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    size=len(self._data),
+                    maxsize=self.maxsize)
+
+
 def formatTexp(o, a):
     if o.getTable()==a:
         return a
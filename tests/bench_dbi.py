@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+A microbenchmark of looking up the DBI object for a connection alias,
+which every PyDO operation does, with increasing numbers of threads.
+
+   python bench_dbi.py [-n calls per thread] [thread counts]
+
+For comparison, it also times the lookup as it was done before the
+lock-free path, with the module lock held.
+"""
+
+import os
+import sys
+import threading
+import time
+
+_d = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(_d, '../src'))
+
+import pydo as P
+import pydo.dbi as D
+
+ALIAS='pydobench'
+
+class Bench(P.PyDO):
+    connectionAlias=ALIAS
+    fields=('id',)
+
+def locked(alias):
+    D._connlock.acquire()
+    try:
+        return D._aliases[alias]['connection']
+    finally:
+        D._connlock.release()
+
+def timeit(func, calls, threads):
+    """returns the total calls per second made by threads threads
+    each calling func calls times"""
+    start=threading.Event()
+    def work():
+        start.wait()
+        for i in range(calls):
+            func()
+    workers=[threading.Thread(target=work) for i in range(threads)]
+    for w in workers:
+        w.start()
+    t=time.time()
+    start.set()
+    for w in workers:
+        w.join()
+    return calls*threads/(time.time()-t)
+
+def main(args):
+    calls=100000
+    if args[:1]==['-n']:
+        calls=int(args[1])
+        args=args[2:]
+    counts=[int(a) for a in args] or [1, 2, 4, 8, 16]
+    P.initAlias(ALIAS, 'sqlite2', dict(database=':memory:'))
+    try:
+        D.getConnection(ALIAS)
+        cases=(('locked lookup', lambda: locked(ALIAS)),
+               ('getConnection()', lambda: D.getConnection(ALIAS)),
+               ('getDBI()', Bench.getDBI))
+        print('%-8s %s' % ('threads', ''.join('%18s' % c for c, f in cases)))
+        for n in counts:
+            rates=[timeit(f, calls, n) for c, f in cases]
+            print('%-8d %s' % (n, ''.join('%16.0f/s' % r for r in rates)))
+    finally:
+        P.delAlias(ALIAS)
+
+if __name__=='__main__':
+    main(sys.argv[1:])
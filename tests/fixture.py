@@ -2,6 +2,10 @@ from pydo.dbi import getConnection
 import pydo as P
 import config
 import sys
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
 
 
 _SEQ_COL_SQL = dict(sqlite='INTEGER PRIMARY KEY NOT NULL',
@@ -216,3 +220,41 @@ class base_fixture(Fixture):
             self.db.rollback()
 
         self.post()
+
+
+@contextmanager
+def pooled_alias(alias):
+    """sets up alias as a copy of the pydotest alias with a connection
+    pool, for tests that use connections from several threads, and
+    yields a PyDO class C for base_fixture's table c, which is dropped
+    afterwards along with the alias"""
+    stuff=P.dbi._aliases['pydotest'].copy()
+    connectArgs=dict(stuff['connectArgs'])
+    tmpdir=None
+    if stuff['driver'].startswith('sqlite'):
+        # pooled connections move between threads
+        connectArgs['check_same_thread']=False
+        if connectArgs.get('database')==':memory:':
+            # worker connections must see the same database
+            tmpdir=tempfile.mkdtemp()
+            connectArgs['database']=os.path.join(tmpdir, '%s.db' % alias)
+    P.initAlias(alias,
+                stuff['driver'],
+                connectArgs,
+                P.ConnectionPool(max_poolsize=4, keep_poolsize=4),
+                stuff['verbose'])
+    class C(P.PyDO):
+        connectionAlias=alias
+        fields=(P.Sequence('id'), 'x')
+    db=C.getDBI()
+    try:
+        db.execute(base_fixture.tables['C'] % dict(seqsql=get_sequence_sql()))
+        yield C
+    finally:
+        try:
+            db.execute('DROP TABLE c')
+            db.commit()
+        finally:
+            P.delAlias(alias)
+            if tmpdir:
+                shutil.rmtree(tmpdir)
@@ -17,6 +17,7 @@ from pydo import initAlias, delAlias, setLogLevel
 setLogLevel(logging.DEBUG)
 
 # import the actual tests
+from test_aio import *
 from test_base import *
 from test_dbi import *
 from test_dbtypes import *
@@ -24,6 +25,7 @@ from test_fields import *
 from test_guesscache import *
 from test_multifetch import *
 from test_operators import *
+from test_parallel import *
 
 if __name__=='__main__':
     drivers, tags, pat, use_unit = _config.readCmdLine(sys.argv[1:])
@@ -0,0 +1,94 @@
+"""
+
+tests for the pydo.aio module.
+
+These need the aiosqlite package; without it they aren't run.
+
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+
+import pydo as P
+from pydo import aio
+from pydo.multifetch import afetch, aiterfetch
+from testingtesting import tag, info
+
+aiotags=['sqlite', 'sqlite2', 'sqlite3', 'aio']
+try:
+    import aiosqlite
+except ImportError:
+    info("aiosqlite is not installed; skipping the tests in test_aio")
+    # no driver tags, so never selected
+    aiotags=['aio']
+
+def _withAlias(test, pool=None):
+    """runs the coroutine function test with a PyDO class using a new
+    aiosqlite alias for a temporary database"""
+    tmpdir=tempfile.mkdtemp()
+    aio.initAlias('pydotestaio',
+                  'aiosqlite',
+                  dict(database=os.path.join(tmpdir, 'aio.db')),
+                  pool)
+    class T(P.PyDO):
+        connectionAlias='pydotestaio'
+        table='t'
+        fields=(P.Sequence('id'), 'x')
+    async def run():
+        await T.getAsyncDBI().execute('CREATE TABLE t (id INTEGER PRIMARY KEY, x INTEGER)')
+        try:
+            await test(T)
+        finally:
+            if pool:
+                await pool.close()
+    try:
+        asyncio.run(run())
+    finally:
+        aio.delAlias('pydotestaio')
+        shutil.rmtree(tmpdir)
+
+@tag(*aiotags)
+def test_aio1():
+    """the coroutine query methods"""
+    async def test(T):
+        a=await T.anew(x=1)
+        assert a['id']==1
+        b=await T.anew(x=2, refetch=True)
+        assert b==dict(id=2, x=2)
+        assert await T.agetUnique(id=2)==b
+        assert await T.agetUnique(id=3) is None
+        assert [o.x for o in await T.agetSome(order='x DESC')]==[2, 1]
+        assert [o.x for o in await T.agetSome(P.GT(P.FIELD('x'), 1))]==[2]
+        rows=await afetch([T, 'x*10'], 'SELECT $COLUMNS FROM $TABLES ORDER BY id')
+        assert [(o.id, t) for o, t in rows]==[(1, 10), (2, 20)]
+        assert [r async for r in aiterfetch([T], 'SELECT $COLUMNS FROM $TABLES',
+                                            arraysize=1)]==[(a,), (b,)]
+    _withAlias(test)
+
+@tag(*aiotags)
+def test_aio2():
+    """transactions and the async connection pool"""
+    async def test(T):
+        adbi=T.getAsyncDBI()
+        try:
+            async with adbi.transaction():
+                await T.anew(x=1)
+                assert len(await T.agetSome())==1
+                raise KeyError
+        except KeyError:
+            pass
+        assert await T.agetSome()==[]
+        async with adbi.transaction():
+            await T.anew(x=1)
+            await T.anew(x=2)
+        checkouts=adbi.pool.stats()['checkouts']
+        results=await asyncio.gather(*[T.agetSome() for i in range(10)])
+        assert [len(r) for r in results]==[2]*10
+        stats=adbi.pool.stats()
+        # how many overlap depends on the driver's awaits
+        assert 1<=stats['peak_busy']<=2
+        assert stats['busy']==0
+        assert stats['checkouts']-checkouts==10
+        assert stats['checkouts']==stats['releases']
+    _withAlias(test, aio.AsyncConnectionPool(max_poolsize=2, keep_poolsize=2))
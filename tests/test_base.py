@@ -4,13 +4,14 @@ tests for the pydo.base module.
 """
 from testingtesting import tag
 import config
-from fixture import Fixture, base_fixture, get_sequence_sql
+from fixture import Fixture, base_fixture, get_sequence_sql, pooled_alias
 import pydo as P
 
 import random
 import string
 import sys
 import itertools
+import datetime
 
 def ranwords(num, length=9):
     s=set()
@@ -303,6 +304,39 @@ class test_project10(base_fixture):
         assert 'user1' in cols
         assert 'poop' in cols
 
+class test_project11(base_fixture):
+    usetables=['E']
+    tags=alltags
+
+    def pre(self):
+        self.E.new(id=1, user1='me', user2='you')
+        self.E.new(id=2, user1='him', user2='her')
+
+    def run(self):
+        p=self.E.project('id', 'user1', dict(name='user2', asname='count'),
+                         compact=True)
+        assert not p.mutable
+        assert p is self.E.project('id', 'user1', dict(name='user2', asname='count'),
+                                   compact=True)
+        res=p.getSome(order='id')
+        assert len(res)==2
+        r=res[0]
+        assert isinstance(r, P.Record)
+        assert r.user1=='me'
+        assert r['count']=='you'
+        assert r.count=='you'
+        assert r.get('nonesuch') is None
+        assert r.dict()==dict(id=1, user1='me', count='you')
+        try:
+            r.user1='them'
+        except AttributeError:
+            pass
+        else:
+            assert 0, "expected AttributeError"
+        assert p.getUnique(id=2).user1=='him'
+        assert [x.id for x in p.iterSome(order='id')]==[1, 2]
+
+
 @tag(*alltags)
 def test_guess_tablename1():
     class base(P.PyDO):
@@ -449,6 +483,39 @@ class test_new2(base_fixture):
 
 
 
+class test_newMany1(base_fixture):
+    usetables=('C', 'D')
+    tags=alltags
+
+    def run(self):
+        # no sequences involved: one group, inserted in bulk
+        res=self.D.newMany((dict(id=i, x=i*2) for i in range(50)), chunksize=20)
+        assert [o.id for o in res]==list(range(50))
+        assert self.D.getCount()==50
+        assert self.D.getUnique(id=7).x==14
+        # rows with different column sets
+        res=self.D.newMany([dict(id=100), dict(id=101, x=None), dict(id=102, x=5)])
+        assert [o.x for o in res]==[None, None, 5]
+        assert self.D.getUnique(id=102).x==5
+        assert self.D.getUnique(id=100).x is None
+
+
+class test_newMany2(base_fixture):
+    usetables=('C',)
+    tags=alltags
+
+    def run(self):
+        rows=[dict(x=i) for i in range(30)]
+        rows.append(dict(id=1000, x=1000))
+        res=self.C.newMany(rows, chunksize=7)
+        assert len(res)==31
+        ids=[o.id for o in res]
+        assert None not in ids
+        assert len(set(ids))==31
+        for o in res:
+            assert self.C.getUnique(id=o.id).x==o.x
+        assert res[-1].id==1000
+
 class test_update1(base_fixture):
     tags=alltags
     usetables=['A']
@@ -530,6 +597,58 @@ class test_deleteSome1(base_fixture):
         assert cnt==0
 
 
+class test_upsert1(base_fixture):
+    usetables=('A', 'A_C')
+    tags=alltags
+
+    def pre(self):
+        self.a=self.A.new(refetch=True, name='a0', x=0, y=0, z=0)
+
+    def run(self):
+        a=self.A.upsert(name='a0', x=5, y=0, z=0)
+        assert a.id==self.a.id
+        assert a.x==5
+        assert a.d==33
+        b=self.A.upsert(name='a1', x=1, y=1, z=1)
+        assert b.id!=a.id
+        assert self.A.getCount()==2
+        # again, now that the statement is cached
+        c=self.A.upsert(name='a1', x=7, y=1, z=1)
+        assert (c.id, c.x)==(b.id, 7)
+        ac=self.A_C.upsert(a_id=1, c_id=2)
+        assert (ac.a_id, ac.c_id)==(1, 2)
+        assert self.A_C.upsert(a_id=1, c_id=2)==ac
+        assert self.A_C.getCount()==1
+        try:
+            self.A.upsert(x=1, y=None, z=1)
+        except ValueError:
+            pass
+        else:
+            assert 0, "expected ValueError"
+
+
+class test_upsertMany1(base_fixture):
+    usetables=('A',)
+    tags=alltags
+
+    def pre(self):
+        for i in range(3):
+            self.A.new(name='a%d' % i, x=i, y=i, z=i)
+
+    def run(self):
+        old=dict((a.name, a.id) for a in self.A.getSome())
+        rows=[dict(name='a%d' % i, x=10+i, y=i, z=i) for i in range(5)]
+        assert self.A.upsertMany(rows, chunksize=2) is None
+        assert [a.x for a in self.A.getSome(order='name')]==[10, 11, 12, 13, 14]
+        rows=[dict(name='a%d' % i, x=20+i, y=i, z=i) for i in range(4, 7)]
+        As=self.A.upsertMany(rows, refetch=True)
+        assert [(a.name, a.x) for a in As]==[('a4', 24), ('a5', 25), ('a6', 26)]
+        assert self.A.getCount()==7
+        for a in self.A.getSome():
+            if a.name in old:
+                assert a.id==old[a.name]
+
+
 class test_updateSome1(base_fixture):
     usetables=('B',)
     tags=alltags
@@ -637,6 +756,79 @@ class test_delete2(base_fixture):
                     'unique constraint')
 
 
+class test_deleteMany1(base_fixture):
+    usetables=('A', 'A_C')
+    tags=alltags
+
+    def pre(self):
+        for i in range(10):
+            self.A.new(name='a%d' % i, x=i, y=i, z=i)
+        for i in range(4):
+            for j in range(4):
+                self.A_C.new(a_id=i, c_id=j)
+
+    def run(self):
+        As=self.A.getSome(order='x')
+        assert self.A.deleteMany(As[:6]+As[:2])==6
+        assert [a.x for a in self.A.getSome(order='x')]==[6, 7, 8, 9]
+        assert not As[0].mutable
+        try:
+            As[0].update(dict(x=100))
+        except ValueError:
+            pass
+        else:
+            assert 0, "expected ValueError"
+        acs=self.A_C.getSome(c_id=0)
+        assert self.A_C.deleteMany(acs)==4
+        # the same, without row values
+        db=self.A_C.getDBI()
+        db.row_value_in=False
+        try:
+            assert self.A_C.deleteMany(self.A_C.getSome(c_id=1))==4
+        finally:
+            del db.row_value_in
+        assert sorted(set(ac.c_id for ac in self.A_C.getSome()))==[2, 3]
+        assert self.A.deleteMany([])==0
+        # in several statements, of which the driver can't count the rows
+        db=self.A.getDBI()
+        db.max_bind_params=2
+        db._rowcount=lambda cursor: -1
+        try:
+            assert self.A.updateMany(self.A.getSome(), dict(d=1))==-1
+            assert self.A.deleteMany(self.A.getSome())==-1
+        finally:
+            del db.max_bind_params
+            del db._rowcount
+        assert self.A.getCount()==0
+
+
+class test_updateMany1(base_fixture):
+    usetables=('A', 'A_C')
+    tags=alltags
+
+    def pre(self):
+        for i in range(10):
+            self.A.new(name='a%d' % i, x=i, y=i, z=i)
+        for i in range(3):
+            self.A_C.new(a_id=i, c_id=i)
+
+    def run(self):
+        As=self.A.getSome(order='x')
+        assert self.A.updateMany(As[::2], dict(b_id=44))==5
+        assert [a.b_id for a in As]==[44, None]*5
+        assert [a.b_id for a in self.A.getSome(order='x')]==[44, None]*5
+        acs=self.A_C.getSome(order='a_id')
+        assert self.A_C.updateMany(acs[1:], dict(c_id=7))==2
+        assert [(ac.a_id, ac.c_id) for ac in self.A_C.getSome(order='a_id')]== \
+               [(0, 0), (1, 7), (2, 7)]
+        try:
+            self.A.updateMany(As, dict(nonesuch=1))
+        except KeyError:
+            pass
+        else:
+            assert 0, "expected KeyError"
+
+
 class test_joinTable1(base_fixture):
     usetables=('A', 'C', 'A_C')
     tags=alltags
@@ -718,6 +910,243 @@ class test_getSome2(base_fixture):
         assert len(some)==5
 
 
+class test_iterSome1(base_fixture):
+    usetables=('B',)
+    tags=alltags
+
+    def pre(self):
+        for i in range(25):
+            self.B.new(x=i % 5)
+
+    def run(self):
+        it=self.B.iterSome(x=3, order='id', arraysize=2)
+        res=list(it)
+        assert len(res)==5
+        assert [o.id for o in res]==[o.id for o in self.B.getSome(x=3, order='id')]
+        for o in res:
+            assert isinstance(o, self.B)
+            assert o.x==3
+        assert len(list(self.B.iterSome(arraysize=7)))==25
+        assert list(self.B.iterSome(x=400))==[]
+
+class test_iterSome2(base_fixture):
+    usetables=('B',)
+    tags=alltags
+
+    def pre(self):
+        for i in range(10):
+            self.B.new(x=i)
+
+    def run(self):
+        # abandon the iterator early; the connection must remain usable
+        it=self.B.iterSome(order='id', arraysize=3)
+        first=next(it)
+        assert first.x==0
+        it.close()
+        assert len(self.B.getSome())==10
+
+class test_iterSome3(base_fixture):
+    """streaming in autocommit mode, where there's no transaction for
+    a server-side cursor to live in"""
+    usetables=('B',)
+    tags=alltags
+
+    def pre(self):
+        for i in range(10):
+            self.B.new(x=i)
+
+    def run(self):
+        db=self.db
+        autocommit=db.autocommit
+        db.autocommit=True
+        try:
+            assert [b.x for b in self.B.iterSome(order='x', arraysize=3)]==list(range(10))
+            assert sum(len(rows) for desc, rows in
+                       db.iterBatches('SELECT x FROM b', arraysize=4))==10
+            assert len(db.executeColumns('SELECT x FROM b')['x'])==10
+        finally:
+            db.autocommit=autocommit
+
+class test_keyset1(base_fixture):
+    usetables=('A',)
+    tags=alltags
+
+    def pre(self):
+        for i in range(25):
+            self.A.new(name='a%02d' % i, x=i % 4, y=i, z=i)
+
+    def run(self):
+        expected=[a.name for a in self.A.getSome(order='x, id')]
+        page=self.A.getSome(order='x', after=None, limit=10)
+        names=[a.name for a in page]
+        while page:
+            page=self.A.getSome(order='x', after=page[-1], limit=10)
+            names.extend(a.name for a in page)
+        assert names==expected
+        # the same, without row value comparisons
+        db=self.A.getDBI()
+        db.row_value_compare=False
+        try:
+            names=[a.name for a in self.A.iterKeyset(order='x DESC', chunksize=4)]
+        finally:
+            del db.row_value_compare
+        assert names==[a.name for a in self.A.getSome(order='x DESC, id DESC')]
+        names=[a.name for a in self.A.iterKeyset(P.LT(P.FIELD('y'), 20),
+                                                 order=[('x', 'DESC')],
+                                                 chunksize=4)]
+        assert names==[a.name for a in self.A.getSome(P.LT(P.FIELD('y'), 20),
+                                                      order='x DESC, id DESC')]
+        assert [a.id for a in self.A.iterKeyset(chunksize=5)]== \
+               sorted(a.id for a in self.A.getSome())
+        try:
+            self.A.getSome(after=None, order='x NULLS FIRST')
+        except ValueError:
+            pass
+        else:
+            assert 0, "expected ValueError"
+
+
+class test_iterChunks1(base_fixture):
+    usetables=('A',)
+    tags=alltags
+
+    def pre(self):
+        for i in range(25):
+            self.A.new(name='a%02d' % i, x=i % 4, y=i, z=i)
+
+    def run(self):
+        chunks=list(self.A.iterChunks(10, order='x'))
+        assert [len(c) for c in chunks]==[10, 10, 5]
+        assert [a.name for c in chunks for a in c]== \
+               [a.name for a in self.A.getSome(order='x, id')]
+        # updating as we go, committing each chunk
+        for chunk in self.A.iterChunks(7, P.GT_EQ(P.FIELD('y'), 5), commit=True):
+            self.A.updateMany(chunk, dict(d=0))
+        assert self.A.getCount(d=0)==20
+
+
+# (binding parameters doesn't work with the sqlite driver's paramstyle)
+@tag(*[t for t in alltags if t!='sqlite'])
+def test_iterChunks2():
+    """iterChunks() fetching ahead in threads with their own connections"""
+    with pooled_alias('pydotestchunks') as C:
+        db=C.getDBI()
+        C.newMany(dict(x=i % 3) for i in range(50))
+        db.commit()
+        for order, total in (('x', 'x, id'), ('x DESC', 'x DESC, id DESC')):
+            expected=C.getSome(order=total)
+            chunks=list(C.iterChunks(8, order=order, threads=3))
+            assert [len(c) for c in chunks]==[8]*6+[2]
+            assert [c.id for chunk in chunks for c in chunk]==[c.id for c in expected]
+        chunks=C.iterChunks(8, threads=3)
+        assert [c.id for c in next(chunks)]==list(range(1, 9))
+        chunks.close()
+        assert len(db.pool._busy)<=1
+
+
+class test_largeIn1(base_fixture):
+    usetables=('A',)
+    tags=alltags
+
+    def pre(self):
+        for i in range(25):
+            self.A.new(name='a%02d' % i, x=i % 4, y=i, z=i)
+
+    def run(self):
+        ys=list(range(0, 25, 2))+[None, 4]
+        big=P.IN(P.FIELD('y'), P.SET(*ys))
+        expected=[a.y for a in self.A.getSome(big, order='y')]
+        assert expected==list(range(0, 25, 2))
+        db=self.A.getDBI()
+        db.large_in_threshold=5
+        try:
+            for strategy in ('chunk', 'split', 'temptable'):
+                db.large_in_strategy=strategy
+                # unordered, chunks are queried separately
+                assert sorted(a.y for a in self.A.getSome(big))==expected
+                assert sorted(a.y for a in self.A.iterSome(big))==expected
+                # ordered or aggregated, they can't be
+                assert [a.y for a in self.A.getSome(big, order='y')]==expected
+                assert self.A.getCount(big)==len(expected)
+            # too many values to split in one statement
+            db.large_in_strategy='split'
+            db.max_bind_params=10
+            try:
+                assert sorted(a.y for a in self.A.getSome(big))==expected
+                try:
+                    self.A.getSome(big, order='y')
+                except ValueError:
+                    pass
+                else:
+                    assert 0, "expected ValueError"
+            finally:
+                del db.max_bind_params
+            db.large_in_strategy='chunk'
+            assert self.A.updateSome(dict(z=-1), big)==len(expected)
+            assert self.A.getCount(z=-1)==len(expected)
+            assert self.A.deleteSome(big)==len(expected)
+            assert self.A.getCount()==25-len(expected)
+        finally:
+            del db.large_in_threshold
+            del db.large_in_strategy
+
+
+@tag(*[t for t in alltags if t!='sqlite'])
+def test_largeIn2():
+    """large IN lists of dates, which only sqlite can put in a
+    temporary table, still work where a temporary table is wanted"""
+    db=P.getConnection('pydotest')
+    db.execute('CREATE TABLE dated (d DATE)')
+    try:
+        class Dated(P.PyDO):
+            connectionAlias='pydotest'
+            table='dated'
+            fields=('d',)
+        days=[datetime.date(2000, 1, 1)+datetime.timedelta(i) for i in range(30)]
+        Dated.newMany(dict(d=d) for d in days)
+        assert P.dbi.DBIBase.tempColumnType(db, days) is None
+        db.large_in_threshold=5
+        try:
+            for strategy in ('chunk', 'temptable'):
+                db.large_in_strategy=strategy
+                # ordered, so 'chunk' wants a temporary table too
+                found=Dated.getSome(P.IN(P.FIELD('d'), P.SET(*days[::2])),
+                                    order='d')
+                assert len(found)==15
+        finally:
+            del db.large_in_threshold
+            del db.large_in_strategy
+    finally:
+        db.execute('DROP TABLE dated')
+
+
+class test_statementCache1(base_fixture):
+    usetables=('B',)
+    tags=alltags
+
+    def pre(self):
+        for i in range(10):
+            self.B.new(x=i % 2 or None)
+
+    def run(self):
+        B=self.B
+        B.getSome(x=1)
+        hits=B.getStatementCacheStats()['hits']
+        # the same shape reuses the compiled statement with new values
+        assert len(B.getSome(x=1))==5
+        assert len(B.getSome(x=None))==5
+        assert len(B.getSome(x=2))==0
+        stats=B.getStatementCacheStats()
+        assert stats['hits']==hits+2
+        assert stats['size']<=stats['maxsize']
+        o=B.getSome(order='id')[0]
+        o2=B.getUnique(id=o.id)
+        assert o2==o
+        o2.x=33
+        assert B.getUnique(id=o.id).x==33
+        assert B.getUnique(id=-1) is None
+
+
 
 class test_refresh1(base_fixture):
     usetables=('A',)
@@ -828,6 +1257,136 @@ class test_foreignkey1(base_fixture):
         a.B=b2
         assert a.b_id==b2.id
 
+class test_identity_map1(base_fixture):
+    usetables=('A', 'B')
+    tags=alltags
+
+    def pre(self):
+        self.A.B=P.ForeignKey('b_id', 'id', self.B)
+        self.B.use_identity_map=True
+        b=self.B.new(x=44)
+        self.A.new(name='aardvark',
+                   b_id=b.id,
+                   x=1,
+                   y=2,
+                   z=3)
+
+    def run(self):
+        B=self.B
+        a=self.A.getUnique(name='aardvark')
+        b=a.B
+        assert a.B is b
+        assert B.getUnique(id=b.id) is b
+        assert B.getSome(x=44)[0] is b
+        b.x=45
+        assert B.getUnique(id=b.id) is b
+        # changes made behind the map's back are seen after a refresh
+        B.getDBI().execute('UPDATE b SET x=46')
+        assert B.getUnique(id=b.id).x==45
+        b.refresh()
+        assert b.x==46
+        B.updateSome(dict(x=47), id=b.id)
+        b2=B.getUnique(id=b.id)
+        assert b2 is not b
+        assert b2.x==47
+        B.getDBI().clearIdentityMap()
+        assert B.getUnique(id=b.id) is not b2
+        b2.delete()
+        assert B.getUnique(id=b.id) is None
+        # streamed rows use the map, but aren't added to it
+        for i in range(20):
+            B.new(x=i)
+        db=B.getDBI()
+        db.clearIdentityMap()
+        b=B.getSome(x=0)[0]
+        streamed=list(B.iterSome(order='x'))
+        assert streamed[0] is b
+        assert len(B._identityMap(db))==1
+        # instances reached only through a foreign key stay in the map
+        a=self.A.getUnique(name='aardvark')
+        a.b_id=streamed[1].id
+        statements=[]
+        hook=lambda phase, info: phase=='before' and statements.append(info['sql'])
+        P.addQueryHook(hook)
+        try:
+            assert [a.B.x for i in range(3)]==[1, 1, 1]
+        finally:
+            P.removeQueryHook(hook)
+        assert len(statements)==1
+
+
+class test_write_behind1(base_fixture):
+    usetables=('B', 'D')
+    tags=alltags
+
+    def pre(self):
+        for i in range(5):
+            self.B.new(x=i)
+            self.D.new(id=i, x=i)
+        self.B.write_behind=True
+        self.D.write_behind=True
+
+    def run(self):
+        B, D=self.B, self.D
+        bs=B.getSome(order='id')
+        ds=D.getSome(order='id')
+        statements=[]
+        hook=lambda phase, info: phase=='before' and statements.append(info['sql'])
+        P.addQueryHook(hook)
+        try:
+            for b in bs:
+                b.x+=10
+                b.x+=10
+            for d in ds[:2]:
+                # changing the unique field too
+                d.update(dict(id=d.id+100, x=-1))
+            assert not statements
+            B.flush()
+        finally:
+            P.removeQueryHook(hook)
+        # one statement per class and shape of change
+        assert len(statements)==2
+        assert [b.x for b in B.getSome(order='id')]==[20, 21, 22, 23, 24]
+        assert sorted(d.id for d in D.getSome(x=-1))==[100, 101]
+        # pending changes are written before any other query
+        bs[0].x=0
+        assert B.getUnique(id=bs[0].id).x==0
+        B.flush()
+
+
+class test_write_behind2(base_fixture):
+    """changes pending when a flush fails are discarded by rollback,
+    and later ones are still written"""
+    usetables=('B', 'D')
+    tags=alltags
+
+    def pre(self):
+        self.b=self.B.new(x=1)
+        self.D.new(id=1, x=1)
+        self.d=self.D.new(id=2, x=2)
+        self.db.commit()
+        self.B.write_behind=True
+        self.D.write_behind=True
+
+    def run(self):
+        b, d=self.b, self.d
+        # conflicts with the other row, so the first group fails
+        d.id=1
+        b.x=2
+        try:
+            self.db.flush()
+        except Exception:
+            pass
+        else:
+            raise AssertionError("flush should have failed")
+        self.db.rollback()
+        assert '_pending' not in b.__dict__
+        assert '_pending' not in d.__dict__
+        b.x=99
+        self.db.commit()
+        assert self.B.getUnique(id=b.id).x==99
+
+
 class test_foreignkey2(base_fixture):
     usetables=('A_C', 'F')
     tags=alltags
@@ -936,6 +1495,69 @@ class test_one_to_many3(base_fixture):
         assert len(tmp)==0
 
 
+class test_prefetch1(base_fixture):
+    usetables=('A', 'B')
+    tags=alltags
+
+    def pre(self):
+        self.A.B=P.ForeignKey('b_id', 'id', self.B)
+        self.B.getA=P.OneToMany('id', 'b_id', self.A)
+        bs=[self.B.new(x=i) for i in range(3)]
+        for i in range(10):
+            self.A.new(name='a%d' % i,
+                       b_id=bs[i % 2].id,
+                       x=i,
+                       y=i,
+                       z=i)
+        self.A.new(name='orphan', x=-1, y=-1, z=-1)
+
+    def run(self):
+        As=self.A.getSome(order='name', prefetch='B')
+        Bs=P.prefetch(self.B.getSome(order='id'), 'getA')
+        # the related objects are no longer fetched from the database
+        self.A.deleteSome()
+        self.B.deleteSome()
+        assert len(As)==11
+        for a in As[:10]:
+            assert isinstance(a.B, self.B)
+            assert a.B.id==a.b_id
+        assert As[10].B is None
+        assert [len(b.getA()) for b in Bs]==[5, 5, 0]
+        assert set(a.b_id for a in Bs[0].getA())==set([Bs[0].id])
+        # with arguments, the accessor queries as usual
+        assert Bs[0].getA(x=0)==[]
+        try:
+            P.prefetch(As, 'name')
+        except ValueError:
+            pass
+        else:
+            assert 0, "expected ValueError"
+
+
+class test_prefetch2(base_fixture):
+    usetables=('A_C', 'F')
+    tags=alltags
+
+    def pre(self):
+        self.A_C.getF=P.OneToMany(('a_id', 'c_id'), ('a_id', 'c_id'), self.F)
+        self.F.A_C=P.ForeignKey(('a_id', 'c_id'), ('a_id', 'c_id'), self.A_C)
+        self.A_C.new(a_id=1, c_id=1)
+        self.A_C.new(a_id=2, c_id=2)
+        for i in range(4):
+            self.F.new(a_id=1, c_id=1)
+        for i in range(3):
+            self.F.new(a_id=2, c_id=2)
+
+    def run(self):
+        acs=self.A_C.getSome(order='a_id', prefetch=['getF'])
+        fs=self.F.getSome(prefetch=['A_C'])
+        self.F.deleteSome()
+        self.A_C.deleteSome()
+        assert [len(ac.getF()) for ac in acs]==[4, 3]
+        for f in fs:
+            assert (f.A_C.a_id, f.A_C.c_id)==(f.a_id, f.c_id)
+
+
 class test_many_to_many1(base_fixture):
     """
     this is the same as test_joinTable1, but rewritten to use ManyToMany.
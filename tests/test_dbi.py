@@ -96,6 +96,35 @@ def test_swapConnection1():
     assert conn1 is db.conn
 
 
+@tag(*dbitags)
+def test_getDBI1():
+    """classes cache their DBI object until the alias is reinitialized"""
+    stuff=D._aliases['pydotest'].copy()
+    args=(stuff['driver'], stuff['connectArgs'], None, stuff['verbose'])
+    D.initAlias('pydotestcache', *args)
+    try:
+        class C(P.PyDO):
+            connectionAlias='pydotestcache'
+            fields=('id',)
+        db=C.getDBI()
+        assert C.getDBI() is db
+        assert D.getConnection('pydotestcache') is db
+        D.delAlias('pydotestcache')
+        try:
+            C.getDBI()
+        except ValueError:
+            pass
+        else:
+            assert 0, "expected ValueError"
+        D.initAlias('pydotestcache', *args)
+        db2=C.getDBI()
+        assert db2 is not db
+        assert D.getConnection('pydotestcache') is db2
+        C.connectionAlias='pydotest'
+        assert C.getDBI() is D.getConnection('pydotest')
+    finally:
+        D.delAlias('pydotestcache')
+
 @tag(*dbitags)
 def test_pool1():
     stuff=D._aliases['pydotest'].copy()
@@ -164,6 +193,197 @@ def test_pool2():
     D.delAlias('pydotestpool')
 
 
+@tag(*dbitags)
+def test_pool3():
+    db=D.getConnection('pydotest')
+    pool=D.ConnectionPool(max_poolsize=1, keep_poolsize=1, timeout=5)
+    connect=lambda: pool.connect(db.connectFunc, db.connectArgs, db.initFunc)
+    conn=connect()
+    got=[]
+    t=threading.Thread(target=lambda: got.append(connect()))
+    t.start()
+    time.sleep(0.2)
+    # the other thread is blocked until the connection is released
+    assert not got
+    conn.close()
+    t.join()
+    assert len(got)==1
+    stats=pool.stats()
+    assert stats['creates']==1
+    assert stats['waits']==1
+    assert stats['busy']==1
+    got[0].close()
+    assert pool.stats()['free']==1
+    # time out waiting
+    pool._timeout=0.1
+    conn=connect()
+    try:
+        connect()
+    except P.PyDOError:
+        pass
+    else:
+        assert 0, "expected PyDOError"
+    assert pool.stats()['timeouts']==1
+    conn.close()
+
+@tag(*dbitags)
+def test_pool4():
+    db=D.getConnection('pydotest')
+    pool=D.ConnectionPool(keep_poolsize=2, max_lifetime=0.2)
+    connect=lambda: pool.connect(db.connectFunc, db.connectArgs, db.initFunc)
+    conn=connect()
+    real=conn._conn
+    conn.close()
+    conn=connect()
+    assert conn._conn is real
+    conn.close()
+    time.sleep(0.3)
+    # too old to reuse
+    conn=connect()
+    assert conn._conn is not real
+    conn.close()
+    stats=pool.stats()
+    assert stats['creates']==2
+    assert stats['discards']==1
+
+@tag(*dbitags)
+def test_pool5():
+    db=D.getConnection('pydotest')
+    pool=D.ConnectionPool(max_poolsize=2, keep_poolsize=2, timeout=0.1)
+    events=[]
+    pool.addListener(lambda event, info: events.append(event))
+    connect=lambda: pool.connect(db.connectFunc, db.connectArgs, db.initFunc)
+    c1=connect()
+    c2=connect()
+    try:
+        connect()
+    except P.PyDOError:
+        pass
+    c1.close()
+    c2.close()
+    c1=connect()
+    c1.close()
+    assert events==['create', 'checkout',
+                    'create', 'checkout',
+                    'timeout',
+                    'release', 'release',
+                    'checkout',
+                    'release']
+    stats=pool.stats()
+    assert stats['checkouts']==3
+    assert stats['peak_busy']==2
+    assert stats['busy']==0
+    assert stats['free']==2
+    assert stats['releases']==3
+    assert stats['timeouts']==1
+    assert sum(n for bound, n in stats['checkout_latency'])==3
+    assert stats['checkout_latency'][-1][0] is None
+
+@tag(*dbitags)
+def test_prepared1():
+    """the prepared statement cache belongs to the real connection"""
+    stuff=D._aliases['pydotest'].copy()
+    D.initAlias('pydotestpool',
+                stuff['driver'],
+                stuff['connectArgs'],
+                D.ConnectionPool(max_poolsize=1, keep_poolsize=1),
+                stuff['verbose'])
+    try:
+        db=D.getConnection('pydotestpool')
+        db.prepare_cache_size=2
+        cache=db.getPreparedCache()
+        assert cache.maxsize==2
+        res=db.execute('SELECT 1+1 AS x')
+        assert res[0]['x']==2
+        cache['SELECT 1']=None
+        db.endConnection()
+        # the same connection, back from the pool
+        assert db.getPreparedCache() is cache
+        db.endConnection()
+        # a connection the pool discards takes its cache with it
+        db.pool.onHandOut=lambda conn: False
+        assert db.getPreparedCache() is not cache
+        assert len(db.getPreparedCache())==0
+    finally:
+        D.delAlias('pydotestpool')
+
+@tag('dbi', 'psycopg')
+def test_prepared2():
+    """bind variable markers are numbered for PREPARE and listed for EXECUTE"""
+    from pydo.drivers.psycopgconn import _prepareSQL
+    assert _prepareSQL('SELECT * FROM a WHERE x = %s AND y > %s')== \
+           ('SELECT * FROM a WHERE x = $1 AND y > $2', ['%s', '%s'])
+    # a name used twice is one parameter
+    assert _prepareSQL('UPDATE a SET x = %(n1)s WHERE y = %(n2)s OR z = %(n1)s')== \
+           ('UPDATE a SET x = $1 WHERE y = $2 OR z = $1', ['%(n1)s', '%(n2)s'])
+    # escaped percent signs, as in LIKE patterns, aren't parameters
+    assert _prepareSQL("SELECT * FROM a WHERE name LIKE 'a%%' AND x = %s")== \
+           ("SELECT * FROM a WHERE name LIKE 'a%' AND x = $1", ['%s'])
+    assert _prepareSQL("SELECT '%%s'")==("SELECT '%s'", [])
+
+class test_queryhooks1(base_fixture):
+    usetables=('C',)
+    tags=dbitags
+
+    def run(self):
+        events=[]
+        def hook(phase, info):
+            events.append((phase, info.copy()))
+        logged=[]
+        slow=D.SlowQueryLogger(0, log=lambda *args: logged.append(args))
+        D.addQueryHook(hook)
+        D.addQueryHook(slow)
+        try:
+            self.C.new(x=1)
+            self.C.newMany([dict(x=2), dict(x=3)])
+            assert len(self.C.getSome())==3
+            assert len(list(P.iterfetch([self.C], 'SELECT $COLUMNS FROM $TABLES')))==3
+            try:
+                self.db.execute('SELECT nonesuch FROM c')
+            except self.db.exceptions['Error']:
+                pass
+            else:
+                assert 0, "expected error"
+        finally:
+            D.removeQueryHook(hook)
+            D.removeQueryHook(slow)
+        self.C.getSome()
+        phases=[p for p, i in events]
+        assert phases.count('before')==phases.count('after')+1
+        assert phases[-1]=='error'
+        after=[i for p, i in events if p=='after']
+        assert len(logged)==len(after)
+        for info in after:
+            assert info['elapsed']>=0
+            assert info['dbi'] is self.db
+        select=[i for i in after if i['sql'].startswith('SELECT')]
+        assert select[0]['caller'] is self.C
+        assert select[0]['rows']==3
+        # iterfetch
+        assert select[1]['caller'] is None
+        assert select[1]['rows']==3
+
+class test_factory1(base_fixture):
+    usetables=('C',)
+    tags=dbitags
+
+    def run(self):
+        for i in range(3):
+            self.C.new(x=i)
+        res=self.db.execute('SELECT c.id, c.x FROM c ORDER BY x', factory=self.C)
+        assert [type(o) for o in res]==[self.C]*3
+        assert [o.x for o in res]==[0, 1, 2]
+        assert sorted(res[0])==['id', 'x']
+        res=self.db.execute('SELECT id, x FROM c ORDER BY x')
+        assert res[2]=={'id': res[2]['id'], 'x': 2}
+        it=self.db.iterExecute('SELECT id, x FROM c', factory=tuple)
+        assert sorted(x for row in it for k, x in row if k=='x')==[0, 1, 2]
+        # column names are computed once per distinct description
+        desc=(('c.id',), ('x',))
+        names=D.DBIBase._fieldNames(desc)
+        assert names==('id', 'x')
+        assert D.DBIBase._fieldNames(desc) is names
+
 @tag(*dbitags)
 def test_autocommit1():
     db=D.getConnection('pydotest')
@@ -234,3 +454,20 @@ class test_describeTable1(base_fixture):
 
 
 
+
+class test_describeSchema1(base_fixture):
+    usetables=('A', 'B', 'A_C', 'D')
+    useObjs=False
+    tags=dbitags
+
+    def run(self):
+        def summary(description):
+            fields, unique=description
+            return (sorted((f.name, type(f).__name__, bool(f.unique), f.sequence)
+                           for f in fields.values()),
+                    sorted(sorted(u) for u in unique))
+        described=self.db.describeSchema()
+        for table in ('a', 'b', 'a_c', 'd'):
+            assert summary(described[table])==summary(self.db.describeTable(table))
+        classes=P.autoschema('pydotest', guesscache=False)
+        assert sorted(classes['A'].getColumns())==sorted(described['a'][0])
@@ -4,7 +4,11 @@ tests for the pydo.guesscache module.
 
 from testingtesting import tag
 import config
+from fixture import base_fixture
 import pydo as P
+import os
+import shutil
+import tempfile
 
 alltags=list(config.ALLDRIVERS) + ['guesscache']
 
@@ -21,3 +25,39 @@ def test_guesscache1():
     assert cache.retrieve(HTTPConnection)==list(range(4))
     cache.clear(HTTPConnection)
     assert cache.retrieve(HTTPConnection) is None
+
+
+class test_guesscache2(base_fixture):
+    usetables=('A', 'B')
+    useObjs=False
+    tags=alltags
+
+    def run(self):
+        tmpdir=tempfile.mkdtemp()
+        try:
+            cache=P.SqliteGuessCache(os.path.join(tmpdir, 'guesses.db'))
+            assert cache.warm('pydotest')>=2
+            class A(P.PyDO):
+                connectionAlias='pydotest'
+                guesscache=cache
+                guess_columns=True
+            assert 'name' in A.getFields()
+            assert frozenset(('y', 'z')) in A.getUniquenessConstraints()
+            # another process would read the entries from the file
+            class B(P.PyDO):
+                connectionAlias='pydotest'
+                guesscache=P.SqliteGuessCache(cache.path)
+                guess_columns=True
+            assert sorted(B.getFields())==['id', 'x']
+            cache.clear(A)
+            assert cache.retrieve(A) is None
+            assert cache.retrieve(B) is not None
+            if self.db.schemaFingerprint() is not None:
+                # a schema change invalidates the stored entries
+                self.db.execute('CREATE TABLE guesscache_extra (x INTEGER)')
+                try:
+                    assert P.SqliteGuessCache(cache.path).retrieve(B) is None
+                finally:
+                    self.db.execute('DROP TABLE guesscache_extra')
+        finally:
+            shutil.rmtree(tmpdir)
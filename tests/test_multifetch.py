@@ -72,3 +72,63 @@ class test_fetch2(base_fixture):
         assert cobj.x==77
         assert int(cnt)==4
 
+
+class test_iterfetch1(base_fixture):
+    tags=alltags
+    usetables=['C']
+
+    def pre(self):
+        for n in range(10):
+            self.C.new(x=n)
+
+    def run(self):
+        objs=[self.C, 'x * 2']
+        sql="SELECT $COLUMNS FROM $TABLES ORDER BY x"
+        res=list(P.iterfetch(objs, sql, arraysize=3))
+        assert len(res)==10
+        for i, (cobj, dbl) in enumerate(res):
+            assert cobj.x==i
+            assert int(dbl)==i*2
+        # abandoning the iterator early releases the cursor
+        it=P.iterfetch(objs, sql, arraysize=3)
+        assert next(it)[0].x==0
+        it.close()
+        # empty result sets
+        sql="SELECT $COLUMNS FROM $TABLES WHERE x > 100"
+        assert P.fetch(objs, sql)==[]
+        # in autocommit mode, where server-side cursors may not work
+        autocommit=self.db.autocommit
+        self.db.autocommit=True
+        try:
+            sql="SELECT $COLUMNS FROM $TABLES ORDER BY x"
+            assert [c.x for c, dbl in P.fetch(objs, sql)]==list(range(10))
+            assert [c.x for c, dbl in P.iterfetch(objs, sql, arraysize=3)]==list(range(10))
+        finally:
+            self.db.autocommit=autocommit
+
+
+class test_columnar1(base_fixture):
+    tags=alltags
+    usetables=['C']
+
+    def pre(self):
+        for n in range(10):
+            self.C.new(x=n)
+        self.C.new(x=None)
+
+    def run(self):
+        res=self.C.getSome('x IS NOT NULL', order='x', columnar=True)
+        assert sorted(res)==['id', 'x']
+        assert list(res['x'])==list(range(10))
+        res=self.C.getSome(columnar=True, order='x')
+        assert len(res['x'])==11
+        # the null makes this a float column
+        assert [x for x in res['x'] if x==x]==list(range(10))
+        res=self.C.getSome(x=400, columnar=True)
+        assert len(res['x'])==0
+        sql="SELECT $COLUMNS FROM $TABLES WHERE x < 5 ORDER BY x"
+        res=P.fetch([self.C, 'x * 2'], sql, columnar=True)
+        assert sorted(res)==['c.id', 'c.x', 'x * 2']
+        assert list(res['x * 2'])==[0, 2, 4, 6, 8]
+        res=self.db.execute('SELECT x FROM c WHERE x < 3 ORDER BY x', columnar=True)
+        assert list(res['x'])==[0, 1, 2]
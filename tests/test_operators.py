@@ -33,6 +33,31 @@ def test_converter1():
 
 
 
+@tag(*alltags)
+def test_render1():
+    def make(a, b, c):
+        return AND(EQ(FIELD('x'), a),
+                   OR(ISNULL(FIELD('y')), BETWEEN(FIELD('y'), b, c)),
+                   IN(FIELD('z'), SET(a, b, c)),
+                   NE(FIELD('w'), None))
+    for style in BindingConverter.supported_styles:
+        for vals in ((1, 2, 3), ('a', 'b', 'c'), (4, 5, 6)):
+            op=make(*vals)
+            c1=BindingConverter(style)
+            c1(0)
+            c2=BindingConverter(style)
+            c2(0)
+            # with values already bound, too
+            assert render(op, c1)==str(SQLOperator(op, c2))
+            assert c1.values==c2.values
+    # the same shape renders from the same template
+    from pydo import operators
+    key=operators._shape(make(7, 8, 9), [])
+    assert key in operators._templates
+    assert render(('=', FIELD('x'), 1), BindingConverter('qmark'))=='(x = ?)'
+    assert render(EQ(FIELD('x'), '\0'), BindingConverter('qmark'))=='(x = ?)'
+
+
 class test_converter2(base_fixture):
     usetables=['E']
     tags=alltags
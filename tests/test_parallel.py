@@ -0,0 +1,36 @@
+"""
+
+tests for the pydo.parallel module.
+
+"""
+from pydo.parallel import defer, gather
+from testingtesting import tag
+import config
+from fixture import pooled_alias
+
+paralleltags=[t for t in config.ALLDRIVERS if t!='sqlite']+['parallel']
+
+@tag(*paralleltags)
+def test_gather1():
+    """queries run concurrently with connections from the pool"""
+    with pooled_alias('pydotestparallel') as C:
+        db=C.getDBI()
+        C.newMany(dict(x=i % 3) for i in range(20))
+        db.commit()
+        some, count, one=gather(defer(C.getSome, x=1, order='id'),
+                                defer(C.getCount),
+                                defer(C.getUnique, id=3))
+        assert [c.id for c in some]==[c.id for c in C.getSome(x=1, order='id')]
+        assert count==20
+        assert one==dict(id=3, x=2)
+        results=gather(defer(C.getCount), defer(C.getUnique), return_exceptions=True)
+        assert results[0]==20
+        assert isinstance(results[1], ValueError)
+        try:
+            gather(defer(C.getUnique), defer(C.getCount))
+        except ValueError:
+            pass
+        else:
+            assert 0, "expected ValueError"
+        db.commit()
+        assert len(db.pool._busy)==0